@@ -1,9 +1,9 @@
 from flask_restx import Namespace, Resource, fields
 from flask import request
 from app.models.stock import Stock
-from app.models.financials import Financials
 from app.models.price import StockPrice
 from app.models.score import StockScore
+from app.services.financial_snapshot import FinancialSnapshotService
 from app import db
 from datetime import datetime, timedelta
 
@@ -62,7 +62,7 @@ class StockDetail(Resource):
             ns.abort(404, f"Stock {ticker} not found")
 
         # Get latest financials
-        latest_financials = Financials.query.filter_by(ticker_id=stock.id).order_by(Financials.fiscal_date.desc()).first()
+        latest_financials = FinancialSnapshotService.latest(stock.id)
 
         # Get latest score
         latest_score = StockScore.query.filter_by(ticker_id=stock.id).order_by(StockScore.date.desc()).first()
@@ -4,3 +4,7 @@ from .price import StockPrice
 from .financials import Financials
 from .watchlist import Watchlist
 from .score import StockScore
+from .dirty_ticker import DirtyTicker
+from .indicator_state import IndicatorState
+from .latest_financials import LatestFinancials
+from .collector_checkpoint import CollectorCheckpoint
@@ -0,0 +1,18 @@
+from app import db
+from datetime import datetime
+
+class CollectorCheckpoint(db.Model):
+    """
+    Per-ticker progress of a collector run. A run id names one logical run
+    (e.g. 'kr_prices:2024-01-05'), so a restarted or retried task skips the
+    tickers already marked done.
+    """
+    __tablename__ = 'collector_checkpoints'
+
+    run_id = db.Column(db.String(64), primary_key=True)
+    ticker_id = db.Column(db.Integer, db.ForeignKey('stocks.id'), primary_key=True)
+    status = db.Column(db.String(10), nullable=False)  # 'done' or 'failed'
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<CollectorCheckpoint {self.run_id} {self.ticker_id} {self.status}>'
@@ -0,0 +1,15 @@
+from app import db
+from datetime import datetime
+
+class DirtyTicker(db.Model):
+    """
+    Tickers that received new price or financial rows since the last scoring run.
+    Their sectors are rescored; every other sector carries its scores forward.
+    """
+    __tablename__ = 'dirty_tickers'
+
+    ticker_id = db.Column(db.Integer, db.ForeignKey('stocks.id'), primary_key=True)
+    marked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<DirtyTicker {self.ticker_id} @ {self.marked_at}>'
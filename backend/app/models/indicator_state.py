@@ -0,0 +1,20 @@
+from app import db
+from datetime import datetime
+
+class IndicatorState(db.Model):
+    """
+    Running Wilder RSI state per ticker, advanced one bar at a time as prices
+    are ingested. `bars` counts the price changes folded into the averages.
+    """
+    __tablename__ = 'indicator_states'
+
+    ticker_id = db.Column(db.Integer, db.ForeignKey('stocks.id'), primary_key=True)
+    avg_gain = db.Column(db.Float, nullable=False, default=0.0)
+    avg_loss = db.Column(db.Float, nullable=False, default=0.0)
+    bars = db.Column(db.Integer, nullable=False, default=0)
+    last_close = db.Column(db.Float)
+    last_timestamp = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<IndicatorState {self.ticker_id} @ {self.last_timestamp}>'
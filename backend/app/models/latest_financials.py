@@ -0,0 +1,29 @@
+from app import db
+from datetime import datetime
+
+class LatestFinancials(db.Model):
+    """
+    Snapshot of every `financials` row at each ticker's latest fiscal date.
+    Refreshed by the financials collectors so scoring and the stock detail
+    endpoint read a ticker's latest figures by key instead of aggregating the
+    whole financials history.
+    """
+    __tablename__ = 'latest_financials'
+
+    ticker_id = db.Column(db.Integer, db.ForeignKey('stocks.id'), primary_key=True)
+    financials_id = db.Column(db.Integer, db.ForeignKey('financials.id', ondelete='CASCADE'), primary_key=True)
+    fiscal_date = db.Column(db.Date, nullable=False)
+    period = db.Column(db.String(20))
+
+    pe_ratio = db.Column(db.Numeric(10, 2))
+    pb_ratio = db.Column(db.Numeric(10, 2))
+    roe = db.Column(db.Numeric(10, 4))
+    eps = db.Column(db.Numeric(10, 2))
+
+    revenue = db.Column(db.BigInteger)
+    net_income = db.Column(db.BigInteger)
+
+    refreshed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<LatestFinancials {self.ticker_id} {self.period} {self.fiscal_date}>'
@@ -12,5 +12,10 @@ class StockPrice(db.Model):
     close = db.Column(db.Numeric(10, 2))
     volume = db.Column(db.BigInteger)
 
+    __table_args__ = (
+        # Latest bar per stock (price_watermarks) as an index probe
+        db.Index('ix_stock_prices_ticker_id_timestamp', 'ticker_id', 'timestamp'),
+    )
+
     def __repr__(self):
         return f'<StockPrice {self.ticker_id} @ {self.timestamp}>'
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app import db
+from app.models.collector_checkpoint import CollectorCheckpoint
+from app.services.upsert import dialect_insert
+
+class CheckpointService:
+    """
+    Persists which tickers a collector run has finished, so a restarted or
+    retried task resumes where it stopped. Marks are written in the caller's
+    transaction, together with the data they vouch for.
+    """
+    CHUNK_SIZE = 1000
+    RETENTION_DAYS = 7
+
+    @staticmethod
+    def run_id(collector, day=None):
+        """
+        Run id of a collector's daily run, e.g. 'kr_prices:2024-01-05' (UTC date).
+        """
+        day = day or datetime.utcnow().date()
+        return f"{collector}:{day.isoformat()}"
+
+    @staticmethod
+    def completed(run_id, ticker_ids):
+        """
+        The subset of `ticker_ids` already done in the run.
+        """
+        ticker_ids = list(ticker_ids)
+        done = set()
+        chunk_size = CheckpointService.CHUNK_SIZE
+        for i in range(0, len(ticker_ids), chunk_size):
+            rows = db.session.query(CollectorCheckpoint.ticker_id).filter(
+                CollectorCheckpoint.run_id == run_id,
+                CollectorCheckpoint.status == 'done',
+                CollectorCheckpoint.ticker_id.in_(ticker_ids[i:i + chunk_size])
+            )
+            done.update(tid for (tid,) in rows)
+        return done
+
+    @staticmethod
+    def mark(run_id, ticker_ids, status):
+        """
+        Records tickers as 'done' or 'failed' in the run. Runs in the caller's
+        transaction; the caller commits.
+        """
+        ticker_ids = sorted(set(ticker_ids))
+        now = datetime.utcnow()
+        chunk_size = CheckpointService.CHUNK_SIZE
+        for i in range(0, len(ticker_ids), chunk_size):
+            stmt = dialect_insert(CollectorCheckpoint).values([
+                {'run_id': run_id, 'ticker_id': tid, 'status': status, 'updated_at': now}
+                for tid in ticker_ids[i:i + chunk_size]
+            ])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['run_id', 'ticker_id'],
+                set_={'status': stmt.excluded.status, 'updated_at': stmt.excluded.updated_at}
+            )
+            db.session.execute(stmt)
+
+    @staticmethod
+    def progress(run_id):
+        """
+        {'done': count, 'failed': count} of the run across all its tasks.
+        """
+        counts = dict(db.session.query(
+            CollectorCheckpoint.status, func.count()
+        ).filter(CollectorCheckpoint.run_id == run_id).group_by(CollectorCheckpoint.status).all())
+        return {'done': counts.get('done', 0), 'failed': counts.get('failed', 0)}
+
+    @staticmethod
+    def purge(days=None):
+        """
+        Deletes checkpoints older than `days` (default RETENTION_DAYS).
+        Returns the number of rows removed.
+        """
+        cutoff = datetime.utcnow() - timedelta(days=days or CheckpointService.RETENTION_DAYS)
+        removed = CollectorCheckpoint.query.filter(
+            CollectorCheckpoint.updated_at < cutoff
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return removed
@@ -1,124 +1,326 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
 import pandas as pd
-import yfinance as yf
-from pykrx import stock as krx_stock
-from sqlalchemy.dialects.postgresql import insert
+from flask import current_app
 from app import db
 from app.models.stock import Stock
 from app.models.financials import Financials
+from app.services.scoring_service import ScoringService
+from app.services.financial_snapshot import FinancialSnapshotService
+from app.services.providers import get_provider
+from app.services.ingestion import AdaptiveLimiter, classify_failure
+from app.services.upsert import changed, dialect_insert, execute_upsert, upsert_counts
 
 logger = logging.getLogger(__name__)
 
 class USFinancialService:
+    # Columns written by the upsert (a row only changes if one of them does)
+    FIELDS = ('pe_ratio', 'pb_ratio', 'roe', 'eps', 'revenue', 'net_income')
+
+    @staticmethod
+    def fetch_statements(ticker):
+        """
+        Annual income statement (line items x fiscal dates).
+        """
+        return get_provider().us_statements(ticker)
+
+    @staticmethod
+    def fetch_info(ticker):
+        """
+        Current/TTM stats as a dict (scalar fields only).
+        """
+        return get_provider().us_info(ticker)
+
+    @staticmethod
+    def financial_records(stock_id, ticker, financials_df, info):
+        """
+        Financials rows from an income statement (historical annual data)
+        and an info dict (current TTM data).
+        """
+        records = []
+
+        if financials_df is not None and not financials_df.empty:
+            # financials_df columns are Dates (Timestamp)
+            for date in financials_df.columns:
+                try:
+                    fiscal_date = date.date()
+
+                    # yfinance rows are labeled. We look for 'Total Revenue' and 'Net Income'
+                    # Note: yfinance keys change sometimes. We use .get with defaults.
+                    # Common keys: 'Total Revenue', 'Net Income'
+
+                    revenue = None
+                    if 'Total Revenue' in financials_df.index:
+                        revenue = financials_df.loc['Total Revenue', date]
+
+                    net_income = None
+                    if 'Net Income' in financials_df.index:
+                        net_income = financials_df.loc['Net Income', date]
+                    elif 'Net Income Common Stockholders' in financials_df.index:
+                        net_income = financials_df.loc['Net Income Common Stockholders', date]
+
+                    if revenue is not None or net_income is not None:
+                        records.append({
+                            'ticker_id': stock_id,
+                            'fiscal_date': fiscal_date,
+                            'period': 'Annual',
+                            'revenue': float(revenue) if revenue is not None else None,
+                            'net_income': float(net_income) if net_income is not None else None,
+                            # Ratios are typically point-in-time, hard to get historical from this call
+                            'pe_ratio': None,
+                            'pb_ratio': None,
+                            'roe': None,
+                            'eps': None
+                        })
+                except Exception as e:
+                    logger.warning(f"Error parsing historical data for {ticker} at {date}: {e}")
+                    continue
+
+        if info:
+            # Use today as fiscal_date for current snapshot
+            today = datetime.utcnow().date()
+
+            pe = info.get('trailingPE')
+            pb = info.get('priceToBook')
+            roe = info.get('returnOnEquity')
+            eps = info.get('trailingEps')
+            revenue_ttm = info.get('totalRevenue')
+            # net_income_ttm = info.get('netIncomeToCommon')
+
+            records.append({
+                'ticker_id': stock_id,
+                'fiscal_date': today,
+                'period': 'TTM',
+                'pe_ratio': float(pe) if pe else None,
+                'pb_ratio': float(pb) if pb else None,
+                'roe': float(roe) if roe else None,
+                'eps': float(eps) if eps else None,
+                'revenue': revenue_ttm,
+                'net_income': None # info usually has ttm, but we focus on ratios here
+            })
+
+        return records
+
+    @staticmethod
+    def save_financials(stock_id, records):
+        """
+        Upserts a stock's financials rows and, if any changed, refreshes its
+        snapshot and marks it for rescoring. Runs in the caller's transaction;
+        the caller commits. Returns the inserted/updated/unchanged counts.
+        """
+        stmt = dialect_insert(Financials).values(records)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['ticker_id', 'fiscal_date', 'period'],
+            set_={
+                'pe_ratio': stmt.excluded.pe_ratio,
+                'pb_ratio': stmt.excluded.pb_ratio,
+                'roe': stmt.excluded.roe,
+                'eps': stmt.excluded.eps,
+                'revenue': stmt.excluded.revenue,
+                'net_income': stmt.excluded.net_income
+            },
+            where=changed(stmt, USFinancialService.FIELDS)
+        )
+
+        counts = execute_upsert(stmt, len(records))
+        if counts['inserted'] or counts['updated']:
+            FinancialSnapshotService.refresh([stock_id])
+            ScoringService.mark_dirty([stock_id])
+        return counts
+
     @staticmethod
     def update_financials(stock_id, ticker):
         """
         Fetch and update financials for a US stock using yfinance.
         Fetches both historical annual data and current TTM data.
+        Returns False if the update failed.
         """
-        try:
-            stock = yf.Ticker(ticker)
-            
-            # 1. Fetch historical financials (Income Statement)
-            # This gives us Revenue, Net Income for past years
-            financials_df = stock.financials
-            
-            records = []
-            
-            if not financials_df.empty:
-                # financials_df columns are Dates (Timestamp)
-                for date in financials_df.columns:
-                    try:
-                        fiscal_date = date.date()
-                        
-                        # yfinance rows are labeled. We look for 'Total Revenue' and 'Net Income'
-                        # Note: yfinance keys change sometimes. We use .get with defaults.
-                        # Common keys: 'Total Revenue', 'Net Income'
-                        
-                        revenue = None
-                        if 'Total Revenue' in financials_df.index:
-                            revenue = financials_df.loc['Total Revenue', date]
-                        elif 'Total Revenue' in financials_df.index: # sometimes case differs?
-                             pass 
-                        
-                        net_income = None
-                        if 'Net Income' in financials_df.index:
-                            net_income = financials_df.loc['Net Income', date]
-                        elif 'Net Income Common Stockholders' in financials_df.index:
-                            net_income = financials_df.loc['Net Income Common Stockholders', date]
-
-                        if revenue is not None or net_income is not None:
-                            records.append({
-                                'ticker_id': stock_id,
-                                'fiscal_date': fiscal_date,
-                                'period': 'Annual',
-                                'revenue': float(revenue) if revenue is not None else None,
-                                'net_income': float(net_income) if net_income is not None else None,
-                                # Ratios are typically point-in-time, hard to get historical from this call
-                                'pe_ratio': None,
-                                'pb_ratio': None,
-                                'roe': None,
-                                'eps': None
-                            })
-                    except Exception as e:
-                        logger.warning(f"Error parsing historical data for {ticker} at {date}: {e}")
-                        continue
+        return not USFinancialService.update_financials_batch([(stock_id, ticker)], workers=1)['failed']
 
-            # 2. Fetch current stats (TTM/Snapshot)
-            # yfinance .info contains current/TTM data
+    @staticmethod
+    def _fetch_part(app, limiter, kind, ticker):
+        """
+        One provider call ('statements' or 'info') in a worker thread.
+        Returns (value, error).
+        """
+        with app.app_context():
+            limiter.acquire()
             try:
-                info = stock.info
-                if info:
-                    # Use today as fiscal_date for current snapshot
-                    today = datetime.utcnow().date()
-                    
-                    pe = info.get('trailingPE')
-                    pb = info.get('priceToBook')
-                    roe = info.get('returnOnEquity')
-                    eps = info.get('trailingEps')
-                    revenue_ttm = info.get('totalRevenue')
-                    # net_income_ttm = info.get('netIncomeToCommon')
-                    
-                    records.append({
-                        'ticker_id': stock_id,
-                        'fiscal_date': today,
-                        'period': 'TTM',
-                        'pe_ratio': float(pe) if pe else None,
-                        'pb_ratio': float(pb) if pb else None,
-                        'roe': float(roe) if roe else None,
-                        'eps': float(eps) if eps else None,
-                        'revenue': revenue_ttm,
-                        'net_income': None # info usually has ttm, but we focus on ratios here
-                    })
+                if kind == 'statements':
+                    value = USFinancialService.fetch_statements(ticker)
+                else:
+                    value = USFinancialService.fetch_info(ticker)
             except Exception as e:
-                logger.warning(f"Error fetching info for {ticker}: {e}")
+                limiter.record(classify_failure(e))
+                return None, e
+            limiter.record('ok')
+            return value, None
+
+    @staticmethod
+    def update_financials_batch(stocks, workers=None):
+        """
+        Updates financials for (stock_id, ticker) pairs. The statement and
+        info requests of up to `workers` stocks run concurrently (paced by
+        the shared yfinance limiter); the calling thread, which owns the
+        database session, writes each stock once both responses are in.
+        Returns {'stocks': count, 'failed': [tickers], 'inserted'/'updated'/
+        'unchanged': row counts}.
+        """
+        app = current_app._get_current_object()
+        limits = app.config['INGESTION_LIMITS']['yfinance']
+        limiter = AdaptiveLimiter.shared('yfinance', limits['rate'], limits.get('burst'),
+                                         limits.get('min_rate'), limits.get('cooldown', 30.0))
+        workers = workers or app.config.get('US_FINANCIALS_WORKERS', 4)
+        jobs = iter(stocks)
+        summary = dict({'stocks': 0, 'failed': []}, **upsert_counts())
 
+        with ThreadPoolExecutor(max_workers=2 * workers) as pool:
+            pending = {}
+            parts = {}
+
+            def fill():
+                while len(parts) < workers:
+                    job = next(jobs, None)
+                    if job is None:
+                        return
+                    stock_id, ticker = job
+                    parts[stock_id] = {}
+                    for kind in ('statements', 'info'):
+                        future = pool.submit(USFinancialService._fetch_part, app, limiter, kind, ticker)
+                        pending[future] = (stock_id, ticker, kind)
+
+            fill()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stock_id, ticker, kind = pending.pop(future)
+                    parts[stock_id][kind] = future.result()
+                    if len(parts[stock_id]) == 2:
+                        summary['stocks'] += 1
+                        counts = USFinancialService._save_fetched(stock_id, ticker, parts.pop(stock_id))
+                        if counts is None:
+                            summary['failed'].append(ticker)
+                            continue
+                        for key, value in counts.items():
+                            summary[key] += value
+                fill()
+
+        return summary
+
+    @staticmethod
+    def _save_fetched(stock_id, ticker, parts):
+        """
+        Writes one stock's fetched statements and info. Returns the upsert
+        counts, or None if the update failed.
+        """
+        statements, error = parts['statements']
+        if error is not None:
+            logger.error(f"Error updating US financials for {ticker}: {error}")
+            return None
+        info, error = parts['info']
+        if error is not None:
+            logger.warning(f"Error fetching info for {ticker}: {error}")
+
+        try:
+            records = USFinancialService.financial_records(stock_id, ticker, statements, info)
             if not records:
-                return
+                return upsert_counts()
+            counts = USFinancialService.save_financials(stock_id, records)
+            db.session.commit()
+            return counts
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error updating US financials for {ticker}: {e}")
+            return None
+
+class KoreanFinancialService:
+    # Records per INSERT statement (bind parameter limit)
+    CHUNK_SIZE = 1000
+    # Rows written per transaction during a backfill
+    BACKFILL_BATCH_SIZE = 50000
+    FUNDAMENTAL_COLUMNS = ['BPS', 'PER', 'PBR', 'EPS']
+    # Columns written by the upsert
+    FIELDS = ('pe_ratio', 'pb_ratio', 'roe', 'eps')
+
+    @staticmethod
+    def ticker_map():
+        """
+        KR stocks we track as a frame of (ticker, ticker_id).
+        """
+        rows = db.session.query(Stock.ticker, Stock.id).filter(
+            Stock.market.in_(['KOSPI', 'KOSDAQ', 'KRX', 'KONEX'])
+        ).all()
+        return pd.DataFrame(rows, columns=['ticker', 'ticker_id'])
+
+    @staticmethod
+    def fundamental_records(df, tickers, fiscal_date):
+        """
+        Converts a pykrx fundamentals frame (BPS, PER, PBR, EPS indexed by
+        ticker) into Financials rows for the tracked `tickers` with column
+        operations. ROE is EPS / BPS; non-positive PER/PBR, zero EPS and a
+        missing ROE become NULL. Rows with a non-numeric value and all-zero
+        (holiday) rows are dropped.
+        """
+        if df.empty or tickers.empty:
+            return []
+
+        values = df.reindex(columns=KoreanFinancialService.FUNDAMENTAL_COLUMNS).apply(pd.to_numeric, errors='coerce')
+        values = values[values.notna().all(axis=1) & (values != 0).any(axis=1)]
+        values.index = values.index.astype(str)
+        # pykrx indexes by ticker; only tracked stocks survive the merge
+        merged = values.rename_axis('ticker').reset_index().merge(tickers, on='ticker', how='inner')
+        if merged.empty:
+            return []
 
-            # Upsert
-            stmt = insert(Financials).values(records)
+        bps, per, pbr, eps = (merged[col] for col in KoreanFinancialService.FUNDAMENTAL_COLUMNS)
+        frame = pd.DataFrame({
+            'ticker_id': merged['ticker_id'],
+            'fiscal_date': fiscal_date,
+            # 'Daily': a daily snapshot; pykrx PER is based on the last reported earnings
+            'period': 'Daily',
+            'pe_ratio': per.where(per > 0),
+            'pb_ratio': pbr.where(pbr > 0),
+            'roe': (eps / bps).where(bps > 0),
+            'eps': eps.where(eps != 0),
+            'revenue': None,  # Not available in this call
+            'net_income': None
+        })
+        frame = frame.astype(object).where(frame.notna(), None)
+        frame['ticker_id'] = frame['ticker_id'].astype(int)
+        return frame.to_dict('records')
+
+    @staticmethod
+    def write_financials(records):
+        """
+        Upserts Financials rows (of one or many dates) in chunks, refreshes
+        the snapshot of their tickers and marks them for rescoring; a batch
+        where nothing changed skips both. Runs in the caller's transaction;
+        the caller commits. Returns the inserted/updated/unchanged counts.
+        """
+        counts = upsert_counts()
+        chunk_size = KoreanFinancialService.CHUNK_SIZE
+        for i in range(0, len(records), chunk_size):
+            chunk = records[i:i + chunk_size]
+            stmt = dialect_insert(Financials).values(chunk)
             stmt = stmt.on_conflict_do_update(
                 index_elements=['ticker_id', 'fiscal_date', 'period'],
                 set_={
                     'pe_ratio': stmt.excluded.pe_ratio,
                     'pb_ratio': stmt.excluded.pb_ratio,
                     'roe': stmt.excluded.roe,
-                    'eps': stmt.excluded.eps,
-                    'revenue': stmt.excluded.revenue,
-                    'net_income': stmt.excluded.net_income
-                }
+                    'eps': stmt.excluded.eps
+                },
+                where=changed(stmt, KoreanFinancialService.FIELDS)
             )
-            
-            db.session.execute(stmt)
-            db.session.commit()
-            
-        except Exception as e:
-            db.session.rollback()
-            logger.error(f"Error updating US financials for {ticker}: {e}")
+            execute_upsert(stmt, len(chunk), counts)
+
+        if counts['inserted'] or counts['updated']:
+            ticker_ids = sorted({r['ticker_id'] for r in records})
+            FinancialSnapshotService.refresh(ticker_ids)
+            ScoringService.mark_dirty(ticker_ids)
+        return counts
 
-class KoreanFinancialService:
     @staticmethod
     def update_financials(target_date=None):
         """
@@ -127,92 +329,111 @@ class KoreanFinancialService:
         """
         if target_date is None:
             target_date = datetime.now()
-        
+
         # pykrx expects YYYYMMDD
         date_str = target_date.strftime("%Y%m%d")
-            
+
         try:
             # columns: BPS, PER, PBR, EPS, DIV, DPS
             # market="ALL" covers KOSPI, KOSDAQ, KONEX
-            df = krx_stock.get_market_fundamental_by_ticker(date_str, market="ALL")
-            
+            df = get_provider().kr_fundamentals(date_str)
+
             if df.empty:
                 logger.warning(f"No KR financials found for {date_str}")
                 return
 
-            # Map ticker to stock_id
-            # We fetch relevant stocks to ensure we only update what we track
-            stocks = Stock.query.filter(Stock.market.in_(['KOSPI', 'KOSDAQ', 'KRX', 'KONEX'])).all()
-            ticker_map = {s.ticker: s.id for s in stocks}
-            
-            records = []
-            fiscal_date = target_date.date()
-            
-            for ticker, row in df.iterrows():
-                ticker_str = str(ticker)
-                # pykrx might return int ticker or string. Usually string with leading zeros if using .str accessors, but here it's index.
-                # If it's an integer index (rare in pykrx but possible), we cast. 
-                # Actually pykrx usually returns ticker as index.
-                
-                # Check mapping
-                stock_id = ticker_map.get(ticker_str)
-                if not stock_id:
-                    continue
-                
-                try:
-                    bps = float(row['BPS'])
-                    per = float(row['PER'])
-                    pbr = float(row['PBR'])
-                    eps = float(row['EPS'])
-                except (ValueError, KeyError):
-                    continue
-                
-                # Calculate ROE = EPS / BPS
-                # We handle division by zero
-                roe = None
-                if bps > 0:
-                     roe = eps / bps
-                
-                # We label this 'Daily' as it's a daily fundamental snapshot
-                # Or 'TTM' if we consider these are TTM based (usually PER is Price/Last Year EPS or TTM EPS)
-                # Let's call it 'Daily' for now to distinguish from US TTM which is explicit.
-                # Actually, pykrx PER is often based on previous year earnings until new report.
-                
-                records.append({
-                    'ticker_id': stock_id,
-                    'fiscal_date': fiscal_date,
-                    'period': 'Daily', 
-                    'pe_ratio': per if per > 0 else None,
-                    'pb_ratio': pbr if pbr > 0 else None,
-                    'roe': roe,
-                    'eps': eps if eps != 0 else None,
-                    'revenue': None, # Not available in this call
-                    'net_income': None
-                })
-                
+            records = KoreanFinancialService.fundamental_records(
+                df, KoreanFinancialService.ticker_map(), target_date.date()
+            )
             if not records:
                 logger.info(f"No matching stocks found for KR financials on {date_str}")
                 return
 
-            # Batch Insert with chunks
-            chunk_size = 1000
-            for i in range(0, len(records), chunk_size):
-                chunk = records[i:i+chunk_size]
-                stmt = insert(Financials).values(chunk)
-                stmt = stmt.on_conflict_do_update(
-                    index_elements=['ticker_id', 'fiscal_date', 'period'],
-                    set_={
-                        'pe_ratio': stmt.excluded.pe_ratio,
-                        'pb_ratio': stmt.excluded.pb_ratio,
-                        'roe': stmt.excluded.roe,
-                        'eps': stmt.excluded.eps
-                    }
-                )
-                db.session.execute(stmt)
-            
+            counts = KoreanFinancialService.write_financials(records)
             db.session.commit()
-            logger.info(f"Updated financials for {len(records)} KR stocks for {date_str}")
-            
+            logger.info(
+                f"Updated financials for {len(records)} KR stocks for {date_str}: {counts['inserted']} new, "
+                f"{counts['updated']} changed, {counts['unchanged']} unchanged"
+            )
+            return counts
+
         except Exception as e:
             db.session.rollback()
             logger.error(f"Error updating KR financials: {e}")
+
+    @staticmethod
+    def _fetch_date(app, limiter, day):
+        with app.app_context():
+            limiter.acquire()
+            try:
+                df = get_provider().kr_fundamentals(day.strftime("%Y%m%d"))
+            except Exception as e:
+                limiter.record(classify_failure(e))
+                return day, None, e
+            limiter.record('ok')
+            return day, df, None
+
+    @staticmethod
+    def backfill_financials(dates, workers=None):
+        """
+        Point-in-time fundamentals for many trading dates (a list of dates).
+        Dates are fetched concurrently within the pykrx rate limit; the
+        calling thread transforms each day and writes BACKFILL_BATCH_SIZE
+        rows per transaction. Non-trading days come back empty and are skipped.
+        Returns {'dates': fetched, 'rows': count, 'failed': [dates],
+        'inserted'/'updated'/'unchanged': row counts}.
+        """
+        app = current_app._get_current_object()
+        limits = app.config['INGESTION_LIMITS']['pykrx']
+        limiter = AdaptiveLimiter.shared('pykrx', limits['rate'], limits.get('burst'),
+                                         limits.get('min_rate'), limits.get('cooldown', 30.0))
+        workers = workers or limits.get('workers', 4)
+        tickers = KoreanFinancialService.ticker_map()
+        summary = dict({'dates': 0, 'rows': 0, 'failed': []}, **upsert_counts())
+        batch = []
+
+        def flush(batch):
+            try:
+                counts = KoreanFinancialService.write_financials(batch)
+                db.session.commit()
+                summary['rows'] += len(batch)
+                for key, value in counts.items():
+                    summary[key] += value
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Failed to write a batch of {len(batch)} KR financials: {e}")
+                summary['failed'].extend(sorted({r['fiscal_date'].isoformat() for r in batch}))
+
+        days = iter(dates)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+
+            def fill():
+                # At most 2 * workers frames in memory
+                while len(pending) < 2 * workers:
+                    day = next(days, None)
+                    if day is None:
+                        return
+                    pending.add(pool.submit(KoreanFinancialService._fetch_date, app, limiter, day))
+
+            fill()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    day, df, error = future.result()
+                    summary['dates'] += 1
+                    if error is not None:
+                        logger.error(f"Error fetching KR financials for {day}: {error}")
+                        summary['failed'].append(day.isoformat())
+                        continue
+                    batch.extend(KoreanFinancialService.fundamental_records(df, tickers, day))
+                fill()
+
+                if len(batch) >= KoreanFinancialService.BACKFILL_BATCH_SIZE:
+                    flush(batch)
+                    batch = []
+
+        if batch:
+            flush(batch)
+        summary['failed'].sort()
+        return summary
@@ -0,0 +1,71 @@
+from datetime import datetime
+from sqlalchemy import func, insert, literal, select
+from app import db
+from app.models.financials import Financials
+from app.models.latest_financials import LatestFinancials
+
+class FinancialSnapshotService:
+    """
+    Maintains `latest_financials`: every financials row at each ticker's
+    latest fiscal date.
+    """
+    CHUNK_SIZE = 1000
+    COLUMNS = ['fiscal_date', 'period', 'pe_ratio', 'pb_ratio', 'roe', 'eps', 'revenue', 'net_income']
+
+    @staticmethod
+    def refresh(ticker_ids=None):
+        """
+        Rebuilds the snapshot rows of the given tickers (all tickers if None)
+        from `financials`. Runs in the caller's transaction so the snapshot
+        commits together with the financials upsert; the caller commits.
+        """
+        if ticker_ids is None:
+            LatestFinancials.query.delete(synchronize_session=False)
+            FinancialSnapshotService._insert_latest(None)
+            return
+
+        ticker_ids = sorted(set(int(tid) for tid in ticker_ids))
+        chunk_size = FinancialSnapshotService.CHUNK_SIZE
+        for i in range(0, len(ticker_ids), chunk_size):
+            chunk = ticker_ids[i:i + chunk_size]
+            LatestFinancials.query.filter(
+                LatestFinancials.ticker_id.in_(chunk)
+            ).delete(synchronize_session=False)
+            FinancialSnapshotService._insert_latest(chunk)
+
+    @staticmethod
+    def _insert_latest(ticker_ids):
+        latest = db.session.query(
+            Financials.ticker_id,
+            func.max(Financials.fiscal_date).label('max_date')
+        )
+        if ticker_ids is not None:
+            latest = latest.filter(Financials.ticker_id.in_(ticker_ids))
+        latest = latest.group_by(Financials.ticker_id).subquery()
+
+        columns = FinancialSnapshotService.COLUMNS
+        rows = select(
+            Financials.ticker_id,
+            Financials.id,
+            *[getattr(Financials, col) for col in columns],
+            literal(datetime.utcnow(), db.DateTime)
+        ).join(
+            latest,
+            (Financials.ticker_id == latest.c.ticker_id) &
+            (Financials.fiscal_date == latest.c.max_date)
+        )
+
+        db.session.execute(
+            insert(LatestFinancials).from_select(
+                ['ticker_id', 'financials_id'] + columns + ['refreshed_at'], rows
+            )
+        )
+
+    @staticmethod
+    def latest(ticker_id):
+        """
+        A ticker's latest financials row (highest id on its latest fiscal date).
+        """
+        return LatestFinancials.query.filter_by(ticker_id=ticker_id).order_by(
+            LatestFinancials.financials_id.desc()
+        ).first()
@@ -0,0 +1,225 @@
+import logging
+import numpy as np
+from flask import current_app
+from app import db
+from app.models.price import StockPrice
+from app.models.stock import Stock
+from app.models.indicator_state import IndicatorState
+
+logger = logging.getLogger(__name__)
+
+class IndicatorService:
+    """
+    Incremental Wilder RSI kept per ticker in `indicator_states`.
+
+    The first 14 price changes are averaged (simple mean), after which each
+    change is folded in with Wilder smoothing: avg = avg + (x - avg) / 14.
+    Advancing a ticker by one bar is O(1), so ingestion keeps the state current
+    and scoring reads RSI from it instead of re-deriving it from history.
+    """
+    RSI_PERIOD = 14
+    STATE_CHUNK_SIZE = 1000
+
+    @staticmethod
+    def rsi_from_averages(avg_gain, avg_loss):
+        """
+        RSI = 100 - 100 / (1 + avg gain / avg loss), elementwise.
+        Flat series (0 / 0) are treated as neutral.
+        """
+        avg_gain = np.asarray(avg_gain, dtype=float)
+        avg_loss = np.asarray(avg_loss, dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = 100 - (100 / (1 + avg_gain / avg_loss))
+        return np.where(np.isnan(values), 50, values)
+
+    @staticmethod
+    def state_rsi(state):
+        """
+        RSI of a stored state, or None until it has seen 14 price changes.
+        """
+        if state is None or state.bars < IndicatorService.RSI_PERIOD:
+            return None
+        return float(IndicatorService.rsi_from_averages(state.avg_gain, state.avg_loss))
+
+    @staticmethod
+    def wilder_step(state, close, timestamp):
+        """
+        Folds one bar into a state in place.
+        """
+        if state.last_close is not None:
+            delta = close - state.last_close
+            k = min(state.bars + 1, IndicatorService.RSI_PERIOD)
+            state.avg_gain += (max(delta, 0.0) - state.avg_gain) / k
+            state.avg_loss += (max(-delta, 0.0) - state.avg_loss) / k
+            state.bars += 1
+        state.last_close = close
+        state.last_timestamp = timestamp
+
+    @staticmethod
+    def wilder_rsi(closes):
+        """
+        Wilder RSI for every row of a price matrix (see
+        `ScoringService.load_price_matrix`), computed from the bars in the
+        window with the same steps as `wilder_step`. NaN where a row has fewer
+        than 15 bars.
+        """
+        period = IndicatorService.RSI_PERIOD
+        n_rows, window = closes.shape
+        avg_gain = np.zeros(n_rows)
+        avg_loss = np.zeros(n_rows)
+        bars = np.zeros(n_rows, dtype=int)
+
+        for col in range(1, window):
+            delta = closes[:, col] - closes[:, col - 1]
+            ok = ~np.isnan(delta)
+            if not ok.any():
+                continue
+            k = np.minimum(bars + 1, period)
+            gain = np.where(ok & (delta > 0), delta, 0.0)
+            loss = np.where(ok & (delta < 0), -delta, 0.0)
+            avg_gain = np.where(ok, avg_gain + (gain - avg_gain) / k, avg_gain)
+            avg_loss = np.where(ok, avg_loss + (loss - avg_loss) / k, avg_loss)
+            bars += ok
+
+        return np.where(bars >= period, IndicatorService.rsi_from_averages(avg_gain, avg_loss), np.nan)
+
+    @staticmethod
+    def enabled():
+        """
+        Whether states are kept current on ingestion (RSI_METHOD 'wilder').
+        """
+        return current_app.config.get('RSI_METHOD', 'sma') == 'wilder'
+
+    @staticmethod
+    def apply_bars(ticker_id, bars):
+        """
+        Advances a ticker's state with newly ingested (timestamp, close) bars.
+        Runs in the caller's transaction after the prices were written; the
+        caller commits.
+
+        Bars at or before the stored last timestamp (backfills, corrections of
+        the latest bar) or a ticker without state trigger a rebuild from the
+        stored history instead.
+        """
+        state = db.session.get(IndicatorState, ticker_id)
+        if state is None or not IndicatorService._advance(state, bars):
+            return IndicatorService.rebuild_state(ticker_id)
+        return state
+
+    @staticmethod
+    def apply_price_bars(bars):
+        """
+        Advances the states of many tickers, {ticker_id: [(timestamp, close)]},
+        loading them with one query per STATE_CHUNK_SIZE tickers. Used by price
+        writes, so tickers without a state are skipped rather than rebuilt
+        from their full history in the write path; rebuild_indicator_states
+        seeds them. Runs in the caller's transaction; the caller commits.
+
+        Bars at or before a state's last timestamp (backfills, corrections)
+        cannot be folded in; the state is dropped instead of rebuilt inline,
+        so the ticker is scored on window RSI until the nightly seeding
+        rebuilds it.
+        """
+        ticker_ids = list(bars)
+        for i in range(0, len(ticker_ids), IndicatorService.STATE_CHUNK_SIZE):
+            chunk = ticker_ids[i:i + IndicatorService.STATE_CHUNK_SIZE]
+            for state in IndicatorState.query.filter(IndicatorState.ticker_id.in_(chunk)):
+                if not IndicatorService._advance(state, bars[state.ticker_id]):
+                    db.session.delete(state)
+
+    @staticmethod
+    def _advance(state, bars):
+        """
+        Folds bars newer than the state into it. Returns False, leaving the
+        state untouched, when any bar is at or before its last timestamp.
+        """
+        bars = sorted((ts, float(close)) for ts, close in bars if close is not None)
+        if bars and state.last_timestamp is not None and bars[0][0] <= state.last_timestamp:
+            return False
+
+        for ts, close in bars:
+            IndicatorService.wilder_step(state, close, ts)
+        return True
+
+    @staticmethod
+    def rebuild_state(ticker_id):
+        """
+        Recomputes a ticker's state from its full price history.
+        Runs in the caller's transaction; the caller commits.
+        """
+        rows = db.session.query(
+            StockPrice.timestamp,
+            db.cast(StockPrice.close, db.Float)
+        ).filter(
+            StockPrice.ticker_id == ticker_id,
+            StockPrice.close.isnot(None)
+        ).order_by(StockPrice.timestamp).all()
+
+        state = db.session.get(IndicatorState, ticker_id)
+        if state is None:
+            state = IndicatorState(ticker_id=ticker_id)
+            db.session.add(state)
+        state.avg_gain = 0.0
+        state.avg_loss = 0.0
+        state.bars = 0
+        state.last_close = None
+        state.last_timestamp = None
+
+        for ts, close in rows:
+            IndicatorService.wilder_step(state, close, ts)
+        return state
+
+    @staticmethod
+    def missing_states():
+        """
+        Ids of stocks with prices but no indicator state, in id order.
+        """
+        has_prices = db.session.query(StockPrice.ticker_id).filter(
+            StockPrice.ticker_id == Stock.id
+        ).exists()
+        return [
+            stock_id for (stock_id,) in db.session.query(Stock.id).outerjoin(
+                IndicatorState, IndicatorState.ticker_id == Stock.id
+            ).filter(IndicatorState.ticker_id.is_(None), has_prices).order_by(Stock.id)
+        ]
+
+    @staticmethod
+    def rebuild_states(ticker_ids):
+        """
+        Rebuilds the state of every given ticker, committing per ticker.
+        Used to seed the table when switching RSI_METHOD to 'wilder'.
+        Returns the number of states rebuilt.
+        """
+        count = 0
+        for ticker_id in ticker_ids:
+            try:
+                IndicatorService.rebuild_state(ticker_id)
+                db.session.commit()
+                count += 1
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Failed to rebuild indicator state for {ticker_id}: {e}")
+        return count
+
+    @staticmethod
+    def load_rsi(ticker_ids, latest_dates):
+        """
+        Stored RSI for tickers whose state ends exactly at their latest bar in
+        `latest_dates` (datetime64, one per ticker). States that are ahead of
+        it (historical scoring dates) or too short are left out.
+        Returns {ticker_id: rsi}.
+        """
+        ticker_ids = [int(tid) for tid in ticker_ids]
+        if not ticker_ids:
+            return {}
+
+        latest = dict(zip(ticker_ids, latest_dates))
+        states = IndicatorState.query.filter(IndicatorState.ticker_id.in_(ticker_ids)).all()
+        result = {}
+        for state in states:
+            rsi = IndicatorService.state_rsi(state)
+            if rsi is None or state.last_timestamp is None:
+                continue
+            if np.datetime64(state.last_timestamp, 'ns') == latest[state.ticker_id]:
+                result[state.ticker_id] = rsi
+        return result
@@ -0,0 +1,500 @@
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta
+import requests
+from flask import current_app
+from app import db
+from app.services.checkpoint import CheckpointService
+from app.services.market_data import price_watermarks, start_after, write_prices
+from app.services.upsert import upsert_counts
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, holding at most
+    `capacity` so an idle source allows a short burst.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, self.rate))
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate):
+        """
+        Changes the refill rate; tokens accrued so far are kept.
+        """
+        with self._lock:
+            self._refill()
+            self.rate = float(rate)
+
+    def acquire(self, tokens=1):
+        """
+        Blocks until `tokens` are available and takes them. A request larger
+        than the bucket waits for a full bucket and leaves it in debt.
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                need = min(tokens, self.capacity)
+                if self._tokens >= need:
+                    self._tokens -= tokens
+                    return
+                delay = (need - self._tokens) / self.rate
+            self._sleep(delay)
+
+def classify_failure(error):
+    """
+    Kind of a failed provider call: 'throttled' (HTTP 429 / rate limit),
+    'timeout', 'connection', or 'error' for anything that retrying at a
+    slower pace would not fix.
+    """
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None) or getattr(error, 'status_code', None)
+    message = str(error).lower()
+    if status == 429 or 'ratelimit' in type(error).__name__.lower() \
+            or 'too many requests' in message or 'rate limit' in message:
+        return 'throttled'
+    if isinstance(error, (TimeoutError, socket.timeout, requests.exceptions.Timeout)):
+        return 'timeout'
+    if isinstance(error, (ConnectionError, requests.exceptions.ConnectionError)):
+        return 'connection'
+    return 'error'
+
+class AdaptiveLimiter:
+    """
+    Request pacing for one data source that adapts to throttling (AIMD).
+
+    Every successful call raises the rate by `increase`, up to the configured
+    `max_rate`; every throttling signal (429, timeout, dropped connection)
+    halves it, down to `min_rate`. Empty frames are ambiguous -- a delisted
+    ticker returns one too -- so they only count as throttling while most
+    of the last `window` calls failed or came back empty.
+
+    After `failure_threshold` consecutive throttling failures the circuit
+    opens: no requests for `cooldown` seconds, then a single probe. A
+    successful probe closes the circuit; a failed one reopens it for twice
+    as long (at most `max_cooldown`).
+    """
+    THROTTLING = ('throttled', 'timeout', 'connection')
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, rate, burst=None, min_rate=None, increase=None, decrease=0.5,
+                 failure_threshold=5, cooldown=30.0, max_cooldown=300.0, window=20, empty_ratio=0.5,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.max_rate = float(rate)
+        self.min_rate = float(min_rate or self.max_rate / 20)
+        self.increase = float(increase or self.max_rate / 50)
+        self.decrease = decrease
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.empty_ratio = empty_ratio
+        self.bucket = TokenBucket(rate, burst, clock=clock, sleep=sleep)
+        self._clock = clock
+        self._sleep = sleep
+        self._recent = deque(maxlen=window)
+        self._failures = 0
+        self._cooldown = cooldown
+        self._open_until = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, source, rate, burst=None, min_rate=None, cooldown=30.0):
+        """
+        The process-wide limiter of a source, so concurrent pipelines and
+        tasks in one worker back off together.
+        """
+        with cls._shared_lock:
+            limiter = cls._shared.get(source)
+            if limiter is None:
+                limiter = cls(rate, burst, min_rate=min_rate, cooldown=cooldown)
+                cls._shared[source] = limiter
+            return limiter
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._open_until is None:
+                return 'closed'
+            return 'half_open' if self._probing else 'open'
+
+    def acquire(self, tokens=1):
+        """
+        Blocks while the circuit is open (or a probe is in flight), then
+        waits for `tokens` at the current rate.
+        """
+        while True:
+            with self._lock:
+                if self._open_until is None:
+                    break
+                now = self._clock()
+                if not self._probing and now >= self._open_until:
+                    self._probing = True
+                    break
+                delay = max(self._open_until - now, 1.0 / self.bucket.rate)
+            self._sleep(delay)
+        self.bucket.acquire(tokens)
+
+    def record(self, outcome):
+        """
+        Reports the outcome of a call: 'ok', 'empty', 'error' or one of
+        THROTTLING. Returns True if it was treated as throttling.
+        """
+        with self._lock:
+            self._recent.append(outcome)
+            throttled = outcome in AdaptiveLimiter.THROTTLING
+            if outcome == 'empty':
+                failed = sum(1 for o in self._recent if o != 'ok')
+                throttled = len(self._recent) >= 5 and failed / len(self._recent) >= self.empty_ratio
+
+            if not throttled:
+                if outcome == 'ok':
+                    self._failures = 0
+                    self._set_rate(self.bucket.rate + self.increase)
+                if self._open_until is not None and self._probing:
+                    logger.info(f"Circuit closed, resuming at {self.bucket.rate:.2f} requests/s")
+                    self._open_until = None
+                    self._probing = False
+                    self._cooldown = self.base_cooldown
+                return False
+
+            self._set_rate(self.bucket.rate * self.decrease)
+            # A throttled probe, empty or not, reopens the circuit; otherwise
+            # acquire() would wait for a probe that already came back
+            if self._probing:
+                self._cooldown = min(self._cooldown * 2, self.max_cooldown)
+                self._trip()
+                return True
+            if outcome == 'empty':
+                return True
+            self._failures += 1
+            if self._open_until is None and self._failures >= self.failure_threshold:
+                self._trip()
+            return True
+
+    def _set_rate(self, rate):
+        self.bucket.set_rate(min(self.max_rate, max(self.min_rate, rate)))
+
+    def _trip(self):
+        self._open_until = self._clock() + self._cooldown
+        self._probing = False
+        logger.warning(f"Circuit open for {self._cooldown:.0f}s after {self._failures} throttled requests")
+
+class PricePipeline:
+    """
+    Fetches OHLCV for many stocks concurrently and writes them in batches.
+
+    Worker threads only talk to the data source, each request paced by the
+    source's AdaptiveLimiter. The calling thread (which owns the database
+    session) collects the results and upserts them `batch_size` rows at a
+    time. At most `2 * workers` fetches are in flight, which bounds memory.
+
+    With `group_size` > 1 and a service that has `fetch_ohlcv_batch`, stocks
+    sharing a date range are fetched `group_size` tickers per call; tickers
+    missing from a group's result are retried one by one.
+
+    Stocks whose fetch was throttled go to a retry queue that is worked off
+    after the other stocks, at most `max_retries` times each.
+    """
+    # An empty frame for a range starting this long ago is suspicious
+    EMPTY_GRACE_DAYS = 7
+    # With a run id, checkpoints are written at least every this many stocks
+    CHECKPOINT_STOCKS = 100
+
+    def __init__(self, service, rate, burst=None, workers=4, batch_size=5000, group_size=1,
+                 min_rate=None, cooldown=30.0, max_retries=2, limiter=None):
+        self.service = service
+        self.limiter = limiter or AdaptiveLimiter(rate, burst, min_rate=min_rate, cooldown=cooldown)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.group_size = group_size if hasattr(service, 'fetch_ohlcv_batch') else 1
+        self.max_retries = max_retries
+
+    @classmethod
+    def for_service(cls, service):
+        """
+        Pipeline using the INGESTION_LIMITS settings of the service's source,
+        paced by the source's shared limiter.
+        """
+        limits = current_app.config['INGESTION_LIMITS'][service.SOURCE]
+        limiter = AdaptiveLimiter.shared(service.SOURCE, limits['rate'], limits.get('burst'),
+                                         limits.get('min_rate'), limits.get('cooldown', 30.0))
+        return cls(service, limiter=limiter, **limits)
+
+    def _expects_data(self, start_date):
+        cutoff = datetime.now() - timedelta(days=PricePipeline.EMPTY_GRACE_DAYS)
+        return datetime.strptime(start_date, '%Y-%m-%d') < cutoff
+
+    def _record_frame(self, empty, start_date):
+        """
+        Reports a response to the limiter. Returns True if it was throttled.
+        """
+        if empty and self._expects_data(start_date):
+            return self.limiter.record('empty')
+        self.limiter.record('ok')
+        return False
+
+    def _fetch(self, stock_id, ticker, start_date, end_date=None):
+        """
+        Returns (stock_id, ticker, records, error, retry); `retry` is set when
+        the fetch was throttled and is worth repeating later.
+        """
+        self.limiter.acquire()
+        try:
+            df = self.service.fetch_ohlcv(ticker, start_date, end_date)
+        except Exception as e:
+            return stock_id, ticker, [], e, self.limiter.record(classify_failure(e))
+
+        if self._record_frame(df.empty, start_date):
+            return stock_id, ticker, [], None, True
+        try:
+            records = [] if df.empty else self.service.price_records(stock_id, ticker, df)
+            return stock_id, ticker, records, None, False
+        except Exception as e:
+            return stock_id, ticker, [], e, False
+
+    def _fetch_group(self, app, group):
+        """
+        Runs `_fetch_unit` in a worker thread inside the application context
+        (the response cache reads its settings from the app config).
+        """
+        with app.app_context():
+            return self._fetch_unit(group)
+
+    def _fetch_unit(self, group):
+        """
+        Fetches a list of (stock_id, ticker, start_date, end_date) jobs sharing
+        a date range. Returns one _fetch-style result per job, in job order.
+        """
+        if len(group) == 1:
+            return [self._fetch(*group[0])]
+
+        # One HTTP request, one token: pacing per symbol would make a batch
+        # no faster than fetching its tickers one by one
+        self.limiter.acquire()
+        tickers = [job[1] for job in group]
+        try:
+            frames = self.service.fetch_ohlcv_batch(tickers, group[0][2], group[0][3])
+            throttled = self._record_frame(not frames, group[0][2])
+        except Exception as e:
+            logger.error(f"Error fetching a batch of {len(tickers)} tickers: {e}")
+            frames = {}
+            throttled = self.limiter.record(classify_failure(e))
+        if throttled:
+            # Falling back to one request per ticker would only add load
+            return [(stock_id, ticker, [], None, True) for stock_id, ticker, _, _ in group]
+
+        results = []
+        for stock_id, ticker, start_date, end_date in group:
+            if ticker not in frames:
+                results.append(self._fetch(stock_id, ticker, start_date, end_date))
+                continue
+            try:
+                records = self.service.price_records(stock_id, ticker, frames[ticker])
+                results.append((stock_id, ticker, records, None, False))
+            except Exception as e:
+                results.append((stock_id, ticker, [], e, False))
+        return results
+
+    def _groups(self, jobs):
+        """
+        Splits jobs into fetch units of up to `group_size` stocks with the same date range.
+        """
+        if self.group_size <= 1:
+            return [[job] for job in jobs]
+
+        by_start = {}
+        for job in jobs:
+            by_start.setdefault(job[2:], []).append(job)
+        return [
+            same_start[i:i + self.group_size]
+            for same_start in by_start.values()
+            for i in range(0, len(same_start), self.group_size)
+        ]
+
+    def run(self, stocks, run_id=None, progress=None):
+        """
+        Updates prices for `stocks`, a list of (stock_id, ticker),
+        (stock_id, ticker, start_date) or (stock_id, ticker, start_date,
+        end_date). Without a start date, fetching resumes after the stock's
+        latest stored price (see `price_watermarks`); without an end date, it
+        runs to the latest bar.
+
+        With a `run_id`, stocks already done in that run are skipped and each
+        stock is checkpointed in the transaction that writes its prices (see
+        CheckpointService), so a restarted run picks up where it stopped.
+        `progress` is called with {'done', 'failed', 'remaining'} stock counts
+        as results come in.
+
+        Returns {'stocks': count, 'rows': count, 'failed': [tickers],
+        'retried': fetches repeated after throttling, 'skipped': stocks done
+        earlier in the run, 'inserted'/'updated'/'unchanged': row counts}.
+        """
+        stocks = list(stocks)
+        total = len(stocks)
+        skipped = CheckpointService.completed(run_id, [job[0] for job in stocks]) if run_id else set()
+        stocks = [job for job in stocks if job[0] not in skipped]
+        # One grouped query for every stock that resumes from its stored prices
+        resume = [job[0] for job in stocks if len(job) < 3 or not job[2]]
+        watermarks = price_watermarks(resume) if resume else {}
+        jobs = [
+            (job[0], job[1], job[2] if len(job) > 2 and job[2] else start_after(watermarks.get(job[0])),
+             job[3] if len(job) > 3 else None)
+            for job in stocks
+        ]
+        units = iter(self._groups(jobs))
+        retries = deque()
+        attempts = {}
+        app = current_app._get_current_object()
+        summary = dict({'stocks': 0, 'rows': 0, 'failed': [], 'retried': 0, 'skipped': len(skipped)},
+                       **upsert_counts())
+        batch = []
+        tickers = {}
+        # Stocks without rows to write, checkpointed with the next batch
+        marks = {'done': [], 'failed': []}
+
+        def report():
+            if progress is not None:
+                failed = len(summary['failed'])
+                progress({'done': summary['skipped'] + summary['stocks'] - failed, 'failed': failed,
+                          'remaining': total - summary['skipped'] - summary['stocks']})
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = set()
+            # Future -> its jobs, which a stock may have several of (one per date range)
+            submitted = {}
+
+            def fill():
+                # New stocks first; the retry queue once they are all submitted
+                while len(pending) < 2 * self.workers:
+                    unit = next(units, None)
+                    if unit is None:
+                        if not retries:
+                            return
+                        unit = [retries.popleft()]
+                    future = pool.submit(self._fetch_group, app, unit)
+                    submitted[future] = unit
+                    pending.add(future)
+
+            fill()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    unit = submitted.pop(future)
+                    for job, (stock_id, ticker, records, error, retry) in zip(unit, future.result()):
+                        if retry and attempts.get(job, 0) < self.max_retries:
+                            attempts[job] = attempts.get(job, 0) + 1
+                            retries.append(job)
+                            summary['retried'] += 1
+                            continue
+
+                        summary['stocks'] += 1
+                        if error is not None:
+                            logger.error(f"Failed to fetch prices for {ticker}: {error}")
+                            summary['failed'].append(ticker)
+                            marks['failed'].append(stock_id)
+                        elif retry:
+                            # Still throttled: left for the next run, not done
+                            logger.warning(f"No prices for {ticker} after {self.max_retries} retries")
+                            marks['failed'].append(stock_id)
+                        elif records:
+                            batch.extend(records)
+                            tickers[stock_id] = ticker
+                        else:
+                            marks['done'].append(stock_id)
+
+                        if summary['stocks'] % 100 == 0:
+                            logger.info(f"Fetched {summary['stocks']} stocks...")
+                fill()
+
+                unmarked = len(tickers) + len(marks['done']) + len(marks['failed'])
+                if len(batch) >= self.batch_size or (run_id and unmarked >= self.CHECKPOINT_STOCKS):
+                    self._flush(batch, tickers, summary, run_id, marks)
+                    batch, tickers = [], {}
+                    marks = {'done': [], 'failed': []}
+                report()
+
+        if batch or (run_id and (marks['done'] or marks['failed'])):
+            self._flush(batch, tickers, summary, run_id, marks)
+            report()
+        if summary['retried']:
+            logger.info(f"Retried {summary['retried']} throttled fetches; "
+                        f"rate now {self.limiter.rate:.2f} requests/s")
+        return summary
+
+    @staticmethod
+    def _checkpoint(run_id, done, failed):
+        if not run_id:
+            return
+        if done:
+            CheckpointService.mark(run_id, done, 'done')
+        if failed:
+            CheckpointService.mark(run_id, failed, 'failed')
+
+    def _flush(self, batch, tickers, summary, run_id=None, marks=None):
+        """
+        Writes one batch, checkpointing its stocks in the same transaction.
+        If it fails, each stock is retried on its own so a bad row only fails
+        its stock.
+        """
+        marks = marks or {'done': [], 'failed': []}
+        try:
+            counts = write_prices(batch) if batch else upsert_counts()
+            self._checkpoint(run_id, list(tickers) + marks['done'], marks['failed'])
+            db.session.commit()
+            self._add_counts(summary, len(batch), counts)
+            return
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error writing price batch, retrying stock by stock: {e}")
+
+        by_stock = {}
+        # Rows are PRICE_FIELDS tuples: (timestamp, ticker_id, ...)
+        for record in batch:
+            by_stock.setdefault(record[1], []).append(record)
+        failed = list(marks['failed'])
+        for stock_id, records in by_stock.items():
+            try:
+                counts = write_prices(records)
+                self._checkpoint(run_id, [stock_id], [])
+                db.session.commit()
+                self._add_counts(summary, len(records), counts)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Failed to update prices for {tickers[stock_id]}: {e}")
+                summary['failed'].append(tickers[stock_id])
+                failed.append(stock_id)
+        try:
+            self._checkpoint(run_id, marks['done'], failed)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error saving checkpoints of run {run_id}: {e}")
+
+    @staticmethod
+    def _add_counts(summary, rows, counts):
+        summary['rows'] += rows
+        for key, value in counts.items():
+            summary[key] += value
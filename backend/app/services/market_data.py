@@ -1,31 +1,210 @@
 import logging
 from datetime import datetime, timedelta
 import pandas as pd
-import FinanceDataReader as fdr
-import yfinance as yf
-import requests
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import func
 from app import db
 from app.models.stock import Stock
 from app.models.price import StockPrice
+from app.services.scoring_service import ScoringService
+from app.services.upsert import changed, dialect_insert, execute_upsert, upsert_counts
+from app.services.price_loader import PriceLoader
+from app.services.indicator_service import IndicatorService
+from app.services.providers import get_provider
 
 logger = logging.getLogger(__name__)
 
+# Rows per INSERT statement (7 columns each, well under the bind parameter limit)
+PRICE_CHUNK_SIZE = 5000
+# Batches at least this large are loaded with COPY on PostgreSQL (see PriceLoader)
+COPY_MIN_ROWS = 2000
+
+# Price rows are tuples in stock_prices column order
+PRICE_FIELDS = ('timestamp', 'ticker_id', 'open', 'high', 'low', 'close', 'volume')
+OHLCV_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+def ohlcv_records(stock_id, ticker, df):
+    """
+    Converts an OHLCV frame (DatetimeIndex; Open, High, Low, Close, Volume)
+    into stock_prices rows with column operations. `stock_id` is one id for
+    the whole frame or a list with one id per row. Timestamps lose their
+    timezone; rows with a missing or non-numeric value are dropped and
+    reported in one log line.
+    """
+    if df.empty:
+        return []
+
+    index = pd.DatetimeIndex(df.index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    stock_ids = pd.Series(stock_id if isinstance(stock_id, list) else [stock_id] * len(df), dtype=object)
+
+    values = df.reindex(columns=OHLCV_COLUMNS).apply(pd.to_numeric, errors='coerce')
+    valid = values.notna().all(axis=1).to_numpy()
+    invalid = int((~valid).sum())
+    if invalid:
+        bad = index[~valid]
+        logger.warning(f"Skipped {invalid} invalid price rows for {ticker} ({bad.min()} - {bad.max()})")
+        values = values[valid]
+        index = index[valid]
+        stock_ids = stock_ids[valid]
+
+    return list(zip(
+        index.to_pydatetime().tolist(),
+        stock_ids.tolist(),
+        values['Open'].astype(float).tolist(),
+        values['High'].astype(float).tolist(),
+        values['Low'].astype(float).tolist(),
+        values['Close'].astype(float).tolist(),
+        values['Volume'].astype('int64').tolist()
+    ))
+
+def price_watermarks(stock_ids):
+    """
+    Latest stored price timestamp per stock, {stock_id: max(timestamp)}, in
+    one query per PRICE_CHUNK_SIZE ids. Stocks without prices are left out.
+
+    The max is a correlated subquery per stock, which the (ticker_id,
+    timestamp) index answers with one probe each; a GROUP BY over the IN list
+    would aggregate every stored bar of those stocks.
+    """
+    stock_ids = list(stock_ids)
+    latest = db.session.query(func.max(StockPrice.timestamp)).filter(
+        StockPrice.ticker_id == Stock.id
+    ).correlate(Stock).scalar_subquery()
+
+    watermarks = {}
+    for i in range(0, len(stock_ids), PRICE_CHUNK_SIZE):
+        rows = db.session.query(Stock.id, latest).filter(Stock.id.in_(stock_ids[i:i + PRICE_CHUNK_SIZE]))
+        watermarks.update((stock_id, timestamp) for stock_id, timestamp in rows if timestamp is not None)
+    return watermarks
+
+def start_after(watermark):
+    """
+    Fetch start date for a stock whose latest price is `watermark`:
+    the next day, or 2000-01-01 for a new stock.
+    """
+    if watermark:
+        return (watermark + timedelta(days=1)).strftime('%Y-%m-%d')
+    return '2000-01-01'
+
+def next_price_start(stock_id):
+    """
+    Day after the stock's latest stored price, or 2000-01-01 for a new stock.
+    """
+    return start_after(price_watermarks([stock_id]).get(stock_id))
+
+def write_prices(records):
+    """
+    Upserts stock_prices rows (PRICE_FIELDS tuples, of one or many stocks).
+    Stocks whose rows were inserted or updated have their RSI state advanced
+    (RSI_METHOD 'wilder') and are marked for rescoring; re-upserted
+    identical bars touch neither. Large batches on PostgreSQL go through
+    COPY. Runs in the caller's transaction; the caller commits.
+    Returns the inserted/updated/unchanged counts.
+    """
+    written = set()
+    if len(records) >= COPY_MIN_ROWS and PriceLoader.supported():
+        counts = PriceLoader.load(records, written)
+    else:
+        counts = insert_prices(records, written)
+    if not written:
+        return counts
+
+    bars = {}
+    for timestamp, stock_id, _, _, _, close, _ in records:
+        if stock_id in written:
+            bars.setdefault(stock_id, []).append((timestamp, close))
+    if IndicatorService.enabled():
+        IndicatorService.apply_price_bars(bars)
+    ScoringService.mark_dirty(bars)
+    return counts
+
+def insert_prices(records, written=None):
+    """
+    Multi-row INSERT ... ON CONFLICT upsert, PRICE_CHUNK_SIZE rows per statement.
+    Rows whose values did not change are left alone. Tickers with inserted or
+    updated rows are added to the `written` set, if given.
+    Returns the inserted/updated/unchanged counts.
+    """
+    counts = upsert_counts()
+    for i in range(0, len(records), PRICE_CHUNK_SIZE):
+        chunk = records[i:i + PRICE_CHUNK_SIZE]
+        stmt = dialect_insert(StockPrice).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['ticker_id', 'timestamp'],
+            set_={
+                'open': stmt.excluded.open,
+                'high': stmt.excluded.high,
+                'low': stmt.excluded.low,
+                'close': stmt.excluded.close,
+                'volume': stmt.excluded.volume
+            },
+            where=changed(stmt, PRICE_FIELDS[2:])
+        )
+        execute_upsert(stmt, len(chunk), counts, written)
+    return counts
+
+# Stock list columns that count as a change (updated_at only moves with them)
+STOCK_FIELDS = ('name', 'market', 'sector', 'industry')
+STOCK_CHUNK_SIZE = 1000
+
+def upsert_stocks(records):
+    """
+    Upserts stock list rows by ticker; rows whose STOCK_FIELDS are unchanged
+    keep their updated_at. A stock that moved sector is marked for rescoring
+    along with a member of its old sector, so both sectors are reranked
+    instead of copied forward. Runs in the caller's transaction; the caller
+    commits. Returns the inserted/updated/unchanged counts.
+    """
+    counts = upsert_counts()
+    moved = {}
+    for i in range(0, len(records), STOCK_CHUNK_SIZE):
+        chunk = records[i:i + STOCK_CHUNK_SIZE]
+        previous = dict(db.session.query(Stock.ticker, Stock.sector).filter(
+            Stock.ticker.in_([r['ticker'] for r in chunk])
+        ))
+        moved.update(
+            (r['ticker'], previous[r['ticker']]) for r in chunk
+            if r['ticker'] in previous and previous[r['ticker']] != r.get('sector')
+        )
+
+        stmt = dialect_insert(Stock).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['ticker'],
+            set_={
+                'name': stmt.excluded.name,
+                'market': stmt.excluded.market,
+                'sector': stmt.excluded.sector,
+                'industry': stmt.excluded.industry,
+                'updated_at': stmt.excluded.updated_at
+            },
+            where=changed(stmt, STOCK_FIELDS)
+        )
+        execute_upsert(stmt, len(chunk), counts)
+
+    if moved:
+        ticker_ids = [tid for (tid,) in db.session.query(Stock.id).filter(Stock.ticker.in_(list(moved)))]
+        old_sectors = {sector for sector in moved.values() if sector}
+        # Dirty markers are per ticker; any one left in the old sector reranks it
+        peers = db.session.query(func.min(Stock.id)).filter(
+            Stock.sector.in_(old_sectors)
+        ).group_by(Stock.sector) if old_sectors else []
+        ScoringService.mark_dirty(ticker_ids + [tid for (tid,) in peers])
+    return counts
+
 class USMarketService:
+    # Rate limit settings key (see INGESTION_LIMITS)
+    SOURCE = 'yfinance'
+    # Stock.market values of the stocks this service prices
+    MARKETS = ('S&P 500',)
+
     @staticmethod
     def fetch_tickers():
         """
         Fetch S&P 500 tickers from Wikipedia.
         """
         try:
-            url = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
-            headers = {'User-Agent': 'Mozilla/5.0'}
-            # Use requests to avoid 403
-            r = requests.get(url, headers=headers)
-            # Use pandas read_html on the response text
-            tables = pd.read_html(r.text)
-            df = tables[0]
-            return df
+            return get_provider().us_tickers()
         except Exception as e:
             logger.error(f"Error fetching US tickers: {str(e)}")
             return pd.DataFrame()
@@ -34,16 +213,42 @@ class USMarketService:
     def fetch_ohlcv(ticker, start_date, end_date=None):
         """
         Fetch OHLCV data for a specific ticker using yfinance.
+        Provider errors are raised so callers can tell throttling from no data.
         """
-        try:
-            # yfinance expects start_date in 'YYYY-MM-DD' format
-            stock = yf.Ticker(ticker)
-            # history
-            df = stock.history(start=start_date, end=end_date, interval="1d")
-            return df
-        except Exception as e:
-            logger.error(f"Error fetching OHLCV for {ticker}: {str(e)}")
-            return pd.DataFrame()
+        return get_provider().us_ohlcv(ticker, start_date, end_date)
+
+    @staticmethod
+    def fetch_ohlcv_batch(tickers, start_date, end_date=None):
+        """
+        Fetch OHLCV for several tickers with one yf.download call.
+        Returns {ticker: DataFrame} for the tickers that came back with rows;
+        callers fall back to fetch_ohlcv for the others. Provider errors are raised.
+        """
+        df = get_provider().us_ohlcv_batch(tickers, start_date, end_date)
+        return USMarketService.split_batch(df, tickers)
+
+    @staticmethod
+    def split_batch(df, tickers):
+        """
+        Splits a wide yf.download frame (ticker, field) columns into
+        per-ticker OHLCV frames, dropping the dates a ticker has no bar for.
+        """
+        frames = {}
+        if df is None or df.empty:
+            return frames
+
+        # A single symbol comes back without the ticker level
+        if not isinstance(df.columns, pd.MultiIndex):
+            df = pd.concat({tickers[0]: df}, axis=1)
+
+        available = set(df.columns.get_level_values(0))
+        for ticker in tickers:
+            if ticker not in available:
+                continue
+            frame = df[ticker].dropna(how='all')
+            if not frame.empty:
+                frames[ticker] = frame
+        return frames
 
     @classmethod
     def update_stocks(cls):
@@ -87,93 +292,61 @@ class USMarketService:
         if not records:
             return
 
-        stmt = insert(Stock).values(records)
-        stmt = stmt.on_conflict_do_update(
-            index_elements=['ticker'],
-            set_={
-                'name': stmt.excluded.name,
-                'market': stmt.excluded.market,
-                'sector': stmt.excluded.sector,
-                'industry': stmt.excluded.industry,
-                'updated_at': stmt.excluded.updated_at
-            }
-        )
-        
         try:
-            db.session.execute(stmt)
+            counts = upsert_stocks(records)
             db.session.commit()
-            logger.info(f"Updated {len(records)} stocks for US.")
+            logger.info(
+                f"Updated stocks for US: {counts['inserted']} new, {counts['updated']} changed, "
+                f"{counts['unchanged']} unchanged."
+            )
+            return counts
         except Exception as e:
             db.session.rollback()
             logger.error(f"Failed to update US stocks: {str(e)}")
 
+    @staticmethod
+    def price_records(stock_id, ticker, df):
+        """
+        Converts a yfinance OHLCV frame into stock_prices rows.
+        """
+        return ohlcv_records(stock_id, ticker, df)
+
     @classmethod
     def update_prices(cls, stock_id, ticker, start_date=None):
         """
         Update prices for a specific stock using yfinance.
         """
         if not start_date:
-            last_price = StockPrice.query.filter_by(ticker_id=stock_id).order_by(StockPrice.timestamp.desc()).first()
-            if last_price:
-                start_date = (last_price.timestamp + timedelta(days=1)).strftime('%Y-%m-%d')
-            else:
-                start_date = '2000-01-01'
+            start_date = next_price_start(stock_id)
 
         try:
             df = cls.fetch_ohlcv(ticker, start_date)
             if df.empty:
                 return
 
-            records = []
-            for index, row in df.iterrows():
-                try:
-                    # index is Timestamp
-                    timestamp = index.to_pydatetime()
-                    if timestamp.tzinfo:
-                        timestamp = timestamp.replace(tzinfo=None)
-
-                    records.append({
-                        'ticker_id': stock_id,
-                        'timestamp': timestamp,
-                        'open': float(row['Open']),
-                        'high': float(row['High']),
-                        'low': float(row['Low']),
-                        'close': float(row['Close']),
-                        'volume': int(row['Volume'])
-                    })
-                except Exception as e:
-                    logger.error(f"Error parsing row for {ticker} at {index}: {e}")
-                    continue
-
+            records = cls.price_records(stock_id, ticker, df)
             if not records:
                 return
 
-            stmt = insert(StockPrice).values(records)
-            stmt = stmt.on_conflict_do_update(
-                index_elements=['ticker_id', 'timestamp'],
-                set_={
-                    'open': stmt.excluded.open,
-                    'high': stmt.excluded.high,
-                    'low': stmt.excluded.low,
-                    'close': stmt.excluded.close,
-                    'volume': stmt.excluded.volume
-                }
-            )
-            
-            db.session.execute(stmt)
+            write_prices(records)
             db.session.commit()
         except Exception as e:
             db.session.rollback()
             logger.error(f"Failed to update prices for {ticker}: {str(e)}")
 
 class KoreanMarketService:
+    # Rate limit settings key (see INGESTION_LIMITS)
+    SOURCE = 'fdr'
+    # Stock.market values of the stocks this service prices
+    MARKETS = ('KOSPI', 'KOSDAQ', 'KRX', 'KONEX')
+
     @staticmethod
     def fetch_tickers(market_type='KRX'):
         """
         Fetch ticker list for the specified market (default: KRX which includes KOSPI, KOSDAQ).
         """
         try:
-            return fdr.StockListing(market_type)
+            return get_provider().kr_tickers(market_type)
         except Exception as e:
             logger.error(f"Error fetching tickers for {market_type}: {str(e)}")
             return pd.DataFrame()
@@ -182,13 +355,109 @@ class KoreanMarketService:
     def fetch_ohlcv(ticker, start_date, end_date=None):
         """
         Fetch OHLCV data for a specific ticker.
+        Provider errors are raised so callers can tell throttling from no data.
+        """
+        return get_provider().kr_ohlcv(ticker, start_date, end_date)
+
+    # Daily-incremental mode
+    #
+    # One pykrx call returns every listed ticker's bar for a trading day, so
+    # keeping up to date costs one request per day instead of one per ticker.
+    # Stocks without prices or further behind than SNAPSHOT_MAX_DAYS are left
+    # to the per-ticker path, which fetches their whole range in one request.
+
+    SNAPSHOT_MAX_DAYS = 10
+    SNAPSHOT_COLUMNS = {'시가': 'Open', '고가': 'High', '저가': 'Low', '종가': 'Close', '거래량': 'Volume'}
+
+    @staticmethod
+    def fetch_market_ohlcv(date):
+        """
+        Whole-market (KOSPI, KOSDAQ, KONEX) OHLCV for one day via pykrx,
+        indexed by ticker with Open/High/Low/Close/Volume columns.
+        Empty on non-trading days.
         """
         try:
-            return fdr.DataReader(ticker, start_date, end_date)
+            df = get_provider().kr_market_ohlcv(date.strftime("%Y%m%d"))
         except Exception as e:
-            logger.error(f"Error fetching OHLCV for {ticker}: {str(e)}")
+            logger.error(f"Error fetching KR market OHLCV for {date}: {str(e)}")
             return pd.DataFrame()
 
+        if df.empty:
+            return df
+        df = df.rename(columns=KoreanMarketService.SNAPSHOT_COLUMNS)[OHLCV_COLUMNS]
+        df.index = df.index.astype(str)
+        # Holidays come back as all-zero rows; a zero close is never a real bar
+        return df[df['Close'] > 0]
+
+    @staticmethod
+    def snapshot_records(date, df, stock_ids):
+        """
+        Converts a whole-market snapshot into stock_prices rows for the
+        tickers in `stock_ids` ({ticker: stock_id}).
+        """
+        df = df[df.index.isin(list(stock_ids))]
+        ids = [stock_ids[ticker] for ticker in df.index]
+        df = df.set_axis(pd.DatetimeIndex([pd.Timestamp(date)] * len(df)), axis=0)
+        return ohlcv_records(ids, f"KRX {date}", df)
+
+    @classmethod
+    def update_prices_by_date(cls, stocks, end_date=None):
+        """
+        Brings `stocks` ((stock_id, ticker) pairs) up to `end_date` (default
+        today) with one whole-market snapshot per weekday since the oldest
+        watermark. Each day is written and committed on its own.
+
+        Returns {'dates': days fetched, 'rows': count, 'backfill': [(stock_id,
+        ticker)], 'inserted'/'updated'/'unchanged': counts}; the backfill
+        stocks (new listings, long gaps) still need the per-ticker path.
+        """
+        if end_date is None:
+            end_date = datetime.now().date()
+        watermarks = price_watermarks([stock_id for stock_id, _ in stocks])
+        horizon = end_date - timedelta(days=cls.SNAPSHOT_MAX_DAYS)
+
+        current = {}
+        backfill = []
+        for stock_id, ticker in stocks:
+            watermark = watermarks.get(stock_id)
+            if watermark is None or watermark.date() < horizon:
+                backfill.append((stock_id, ticker))
+            else:
+                current[ticker] = (stock_id, watermark.date())
+
+        summary = dict({'dates': 0, 'rows': 0, 'backfill': backfill}, **upsert_counts())
+        if not current:
+            return summary
+
+        first = min(last for _, last in current.values()) + timedelta(days=1)
+        for day in pd.bdate_range(first, end_date).date:
+            df = cls.fetch_market_ohlcv(day)
+            summary['dates'] += 1
+            if df.empty:
+                continue
+
+            behind = {ticker: stock_id for ticker, (stock_id, last) in current.items() if last < day}
+            records = cls.snapshot_records(day, df, behind)
+            if not records:
+                continue
+            try:
+                counts = write_prices(records)
+                db.session.commit()
+                summary['rows'] += len(records)
+                for key, value in counts.items():
+                    summary[key] += value
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Failed to write KR market prices for {day}: {str(e)}")
+                # Retry these stocks per ticker rather than skipping the day
+                failed = {stock_id for _, stock_id, *_ in records}
+                summary['backfill'].extend(
+                    (stock_id, ticker) for ticker, (stock_id, _) in current.items() if stock_id in failed
+                )
+                current = {t: v for t, v in current.items() if v[0] not in failed}
+
+        return summary
+
     @classmethod
     def update_stocks(cls, market_type='KRX'):
         """
@@ -238,85 +507,48 @@ class KoreanMarketService:
         if not records:
             return
 
-        # Use batch upsert
-        stmt = insert(Stock).values(records)
-        stmt = stmt.on_conflict_do_update(
-            index_elements=['ticker'],
-            set_={
-                'name': stmt.excluded.name,
-                'market': stmt.excluded.market,
-                'sector': stmt.excluded.sector,
-                'industry': stmt.excluded.industry,
-                'updated_at': stmt.excluded.updated_at
-            }
-        )
-        
         try:
-            db.session.execute(stmt)
+            counts = upsert_stocks(records)
             db.session.commit()
-            logger.info(f"Updated {len(records)} stocks for {market_type}.")
+            logger.info(
+                f"Updated stocks for {market_type}: {counts['inserted']} new, {counts['updated']} changed, "
+                f"{counts['unchanged']} unchanged."
+            )
+            return counts
         except Exception as e:
             db.session.rollback()
             logger.error(f"Failed to update stocks: {str(e)}")
 
+    @staticmethod
+    def price_records(stock_id, ticker, df):
+        """
+        Converts a FinanceDataReader OHLCV frame into stock_prices rows.
+        """
+        return ohlcv_records(stock_id, ticker, df)
+
     @classmethod
     def update_prices(cls, stock_id, ticker, start_date=None):
         """
         Update prices for a specific stock.
         """
         if not start_date:
-            # Check last available price date
-            last_price = StockPrice.query.filter_by(ticker_id=stock_id).order_by(StockPrice.timestamp.desc()).first()
-            if last_price:
-                start_date = (last_price.timestamp + timedelta(days=1)).strftime('%Y-%m-%d')
-            else:
-                start_date = '2000-01-01'
+            start_date = next_price_start(stock_id)
 
-        today = datetime.now().strftime('%Y-%m-%d')
-        
-        # If start_date is in future or today (and market closed?), handling today might be tricky if market is open.
-        # For simplicity, we fetch up to today.
-        
-        df = cls.fetch_ohlcv(ticker, start_date)
+        try:
+            df = cls.fetch_ohlcv(ticker, start_date)
+        except Exception as e:
+            logger.error(f"Error fetching OHLCV for {ticker}: {str(e)}")
+            return
         if df.empty:
             return
 
-        records = []
-        for index, row in df.iterrows():
-            try:
-                records.append({
-                    'ticker_id': stock_id,
-                    'timestamp': index,
-                    'open': float(row['Open']),
-                    'high': float(row['High']),
-                    'low': float(row['Low']),
-                    'close': float(row['Close']),
-                    'volume': int(row['Volume'])
-                })
-            except Exception as e:
-                logger.error(f"Error parsing row for {ticker} at {index}: {e}")
-                continue
-
+        records = cls.price_records(stock_id, ticker, df)
         if not records:
             return
 
-        stmt = insert(StockPrice).values(records)
-        stmt = stmt.on_conflict_do_update(
-            index_elements=['ticker_id', 'timestamp'],
-            set_={
-                'open': stmt.excluded.open,
-                'high': stmt.excluded.high,
-                'low': stmt.excluded.low,
-                'close': stmt.excluded.close,
-                'volume': stmt.excluded.volume
-            }
-        )
-        
         try:
-            db.session.execute(stmt)
+            write_prices(records)
             db.session.commit()
-            # logger.info(f"Updated prices for {ticker}: {len(records)} records") 
-            # (Logging every stock might be too verbose, maybe log only errors or summary)
         except Exception as e:
             db.session.rollback()
             logger.error(f"Failed to update prices for {ticker}: {str(e)}")
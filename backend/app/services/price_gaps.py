@@ -0,0 +1,101 @@
+import logging
+from datetime import timedelta
+from sqlalchemy import bindparam, text
+from app import db
+from app.services.ingestion import PricePipeline
+
+logger = logging.getLogger(__name__)
+
+class PriceGapService:
+    """
+    Finds and repairs holes in the middle of stored price series.
+
+    Incremental updates only fetch after a stock's latest bar, so a day lost
+    to a failed fetch is never revisited. A market's trading calendar is
+    derived from the data itself: a day is a trading day if at least
+    `min_coverage` of the stocks listed at the time (first bar <= day <=
+    last bar) have a bar on it. Each stock's calendar days between its first
+    and last bar that it has no bar for are its gaps; days after the last
+    bar are left to the incremental update.
+    """
+    MIN_COVERAGE = 0.5
+
+    @staticmethod
+    def gaps_sql():
+        """
+        One pass over the market's prices: the peer calendar, every stock's
+        missing calendar days, and consecutive missing days collapsed into
+        ranges (calendar position minus the row number is constant within a
+        run). Returns (ticker_id, ticker, gap_start, gap_end, days) rows.
+        """
+        return text("""
+            WITH bars AS (
+                SELECT p.ticker_id, p.timestamp
+                FROM stock_prices p JOIN stocks s ON s.id = p.ticker_id
+                WHERE s.market IN :markets AND p.timestamp >= :since
+            ), spans AS (
+                SELECT ticker_id, MIN(timestamp) AS first_bar, MAX(timestamp) AS last_bar
+                FROM bars GROUP BY ticker_id
+            ), days AS (
+                SELECT timestamp, COUNT(*) AS stocks FROM bars GROUP BY timestamp
+            ), calendar AS (
+                SELECT d.timestamp, ROW_NUMBER() OVER (ORDER BY d.timestamp) AS position
+                FROM days d
+                WHERE d.stocks >= :min_coverage * (
+                    SELECT COUNT(*) FROM spans
+                    WHERE spans.first_bar <= d.timestamp AND spans.last_bar >= d.timestamp
+                )
+            ), missing AS (
+                SELECT sp.ticker_id, c.timestamp,
+                       c.position - ROW_NUMBER() OVER (PARTITION BY sp.ticker_id ORDER BY c.position) AS run
+                FROM spans sp
+                JOIN calendar c ON c.timestamp > sp.first_bar AND c.timestamp < sp.last_bar
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM stock_prices p
+                    WHERE p.ticker_id = sp.ticker_id AND p.timestamp = c.timestamp
+                )
+            )
+            SELECT m.ticker_id, s.ticker, MIN(m.timestamp) AS gap_start, MAX(m.timestamp) AS gap_end,
+                   COUNT(*) AS days
+            FROM missing m JOIN stocks s ON s.id = m.ticker_id
+            GROUP BY m.ticker_id, s.ticker, m.run
+            ORDER BY m.ticker_id, gap_start
+        """).bindparams(
+            bindparam('markets', expanding=True),
+            bindparam('since', type_=db.DateTime)
+        ).columns(gap_start=db.DateTime, gap_end=db.DateTime)
+
+    @staticmethod
+    def find_gaps(service, since, min_coverage=None):
+        """
+        Missing price ranges of the stocks in the service's MARKETS, looking
+        at bars from `since` (datetime) on.
+        Returns [(stock_id, ticker, gap_start, gap_end, days)], days counted
+        on the derived trading calendar.
+        """
+        rows = db.session.execute(PriceGapService.gaps_sql(), {
+            'markets': list(service.MARKETS),
+            'since': since,
+            'min_coverage': min_coverage or PriceGapService.MIN_COVERAGE
+        }).all()
+        return [tuple(row) for row in rows]
+
+    @staticmethod
+    def repair_gaps(service, since, min_coverage=None):
+        """
+        Finds the service's gaps and fetches just those ranges through its
+        fetch_ohlcv, paced like any other price update (see PricePipeline).
+        Returns the pipeline summary plus 'gaps' and 'days' found.
+        """
+        gaps = PriceGapService.find_gaps(service, since, min_coverage)
+        days = sum(gap[4] for gap in gaps)
+        logger.info(f"Found {len(gaps)} {service.SOURCE} price gaps ({days} trading days) since {since:%Y-%m-%d}")
+
+        # The end is passed one day late: yfinance treats it as exclusive;
+        # for sources that include it the extra bar is an unchanged upsert
+        jobs = [
+            (stock_id, ticker, gap_start.strftime('%Y-%m-%d'), (gap_end + timedelta(days=1)).strftime('%Y-%m-%d'))
+            for stock_id, ticker, gap_start, gap_end, _ in gaps
+        ]
+        summary = PricePipeline.for_service(service).run(jobs)
+        return dict(summary, gaps=len(gaps), days=days)
@@ -0,0 +1,150 @@
+import csv
+import io
+import logging
+from datetime import timedelta
+from sqlalchemy import text
+from app import db
+from app.services.upsert import upsert_counts
+
+logger = logging.getLogger(__name__)
+
+class PriceLoader:
+    """
+    Bulk loads stock_prices rows on PostgreSQL without building a huge
+    multi-row INSERT.
+
+    Rows are streamed with COPY into a session-private temporary staging
+    table (temporary tables are never WAL-logged and concurrent loaders
+    cannot see each other's rows), then merged into the hypertable with one
+    INSERT ... SELECT ... ON CONFLICT per time window, so each statement
+    only touches a few hypertable chunks. Batches of up to
+    SINGLE_MERGE_ROWS rows are merged in one statement.
+    """
+    STAGING_TABLE = 'stock_prices_staging'
+    COLUMNS = ('timestamp', 'ticker_id', 'open', 'high', 'low', 'close', 'volume')
+    MERGE_WINDOW = timedelta(days=30)
+    COPY_BUFFER_ROWS = 50000
+    SINGLE_MERGE_ROWS = 100000
+
+    @staticmethod
+    def supported():
+        return db.session.get_bind().dialect.name == 'postgresql'
+
+    @staticmethod
+    def to_csv(rows):
+        """
+        Rows (tuples in COLUMNS order) as a CSV buffer for COPY. None is written
+        as an empty field, which COPY's CSV format reads as NULL.
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for timestamp, ticker_id, open_, high, low, close, volume in rows:
+            writer.writerow((timestamp.isoformat(sep=' '), ticker_id, open_, high, low, close, volume))
+        buffer.seek(0)
+        return buffer
+
+    @staticmethod
+    def windows(rows):
+        """
+        [(start, end)] merge windows of the rows: one covering all of them
+        for small batches, else the MERGE_WINDOW slices (from the earliest
+        timestamp) that actually contain rows, so a sparse backfill does not
+        scan staging for every empty month.
+        """
+        start = min(row[0] for row in rows)
+        if len(rows) <= PriceLoader.SINGLE_MERGE_ROWS:
+            return [(start, max(row[0] for row in rows) + timedelta(microseconds=1))]
+        window = PriceLoader.MERGE_WINDOW
+        slices = sorted({(row[0] - start) // window for row in rows})
+        return [(start + n * window, start + (n + 1) * window) for n in slices]
+
+    @staticmethod
+    def merge_sql():
+        """
+        Merges one window of the staging table. Of rows staged twice for the
+        same key, the last one wins (highest `seq`). Rows whose values did not
+        change are skipped; returns (inserted, written, staged) counts and
+        the ids of the tickers with written rows.
+        """
+        columns = ', '.join(PriceLoader.COLUMNS)
+        values = ('open', 'high', 'low', 'close', 'volume')
+        return text(f"""
+            WITH window_rows AS (
+                SELECT DISTINCT ON (ticker_id, timestamp) {columns}
+                FROM {PriceLoader.STAGING_TABLE}
+                WHERE timestamp >= :start AND timestamp < :end
+                ORDER BY ticker_id, timestamp, seq DESC
+            ), merged AS (
+                INSERT INTO stock_prices ({columns})
+                SELECT {columns} FROM window_rows
+                ON CONFLICT (ticker_id, timestamp) DO UPDATE SET
+                    open = EXCLUDED.open,
+                    high = EXCLUDED.high,
+                    low = EXCLUDED.low,
+                    close = EXCLUDED.close,
+                    volume = EXCLUDED.volume
+                WHERE ({', '.join(f'stock_prices.{col}' for col in values)})
+                    IS DISTINCT FROM ({', '.join(f'EXCLUDED.{col}' for col in values)})
+                RETURNING (xmax = 0) AS inserted, ticker_id
+            )
+            SELECT
+                (SELECT count(*) FROM merged WHERE inserted),
+                (SELECT count(*) FROM merged),
+                (SELECT count(*) FROM window_rows),
+                (SELECT array_agg(DISTINCT ticker_id) FROM merged)
+        """)
+
+    @staticmethod
+    def load(rows, written=None):
+        """
+        Upserts rows through COPY + merge. Runs in the caller's transaction
+        (the session's connection); the caller commits. Tickers with inserted
+        or updated rows are added to the `written` set, if given.
+        Returns the inserted/updated/unchanged counts.
+        """
+        counts = upsert_counts()
+        if not rows:
+            return counts
+
+        connection = db.session.connection()
+        # seq numbers the rows in COPY order, so duplicates resolve like a
+        # sequence of upserts would
+        connection.execute(text(
+            f"CREATE TEMP TABLE IF NOT EXISTS {PriceLoader.STAGING_TABLE} "
+            f"(LIKE stock_prices INCLUDING DEFAULTS, seq bigserial)"
+        ))
+        connection.execute(text(f"TRUNCATE {PriceLoader.STAGING_TABLE}"))
+
+        cursor = connection.connection.cursor()
+        copy_sql = (
+            f"COPY {PriceLoader.STAGING_TABLE} ({', '.join(PriceLoader.COLUMNS)}) "
+            f"FROM STDIN WITH (FORMAT csv)"
+        )
+        try:
+            step = PriceLoader.COPY_BUFFER_ROWS
+            for i in range(0, len(rows), step):
+                cursor.copy_expert(copy_sql, PriceLoader.to_csv(rows[i:i + step]))
+        finally:
+            cursor.close()
+
+        # Temp tables are not autovacuumed: without the index and fresh
+        # statistics every window merge would scan and sort all of staging
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {PriceLoader.STAGING_TABLE}_key "
+            f"ON {PriceLoader.STAGING_TABLE} (ticker_id, timestamp)"
+        ))
+        connection.execute(text(f"ANALYZE {PriceLoader.STAGING_TABLE}"))
+
+        merge = PriceLoader.merge_sql()
+        for window_start, window_end in PriceLoader.windows(rows):
+            inserted, merged, staged, ticker_ids = connection.execute(
+                merge, {'start': window_start, 'end': window_end}
+            ).one()
+            counts['inserted'] += inserted
+            counts['updated'] += merged - inserted
+            counts['unchanged'] += staged - merged
+            if written is not None and ticker_ids:
+                written.update(ticker_ids)
+
+        connection.execute(text(f"TRUNCATE {PriceLoader.STAGING_TABLE}"))
+        return counts
@@ -0,0 +1,360 @@
+import threading
+from abc import ABC, abstractmethod
+import time
+import zlib
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+import FinanceDataReader as fdr
+import yfinance as yf
+from pykrx import stock as krx_stock
+from flask import current_app
+from app.services.response_cache import cached_response
+
+class MarketDataProvider(ABC):
+    """
+    Source of raw market data for the collector services. Each method returns
+    data in the shape of the upstream library it stands for (Wikipedia table,
+    yfinance, FinanceDataReader, pykrx) so the services parse every provider
+    the same way. Methods raise on failure; the services log and skip.
+    A provider that misses a method fails when instantiated.
+    """
+
+    @abstractmethod
+    def us_tickers(self):
+        """S&P 500 constituents: Symbol, Security, GICS Sector, GICS Sub-Industry."""
+
+    @abstractmethod
+    def us_ohlcv(self, ticker, start_date, end_date=None):
+        """yfinance history(): DatetimeIndex, Open/High/Low/Close/Volume."""
+
+    @abstractmethod
+    def us_ohlcv_batch(self, tickers, start_date, end_date=None):
+        """yf.download(group_by='ticker'): (ticker, field) columns."""
+
+    @abstractmethod
+    def us_statements(self, ticker):
+        """yfinance financials: line items x fiscal dates."""
+
+    @abstractmethod
+    def us_info(self, ticker):
+        """yfinance info: dict of current/TTM stats."""
+
+    @abstractmethod
+    def kr_tickers(self, market_type='KRX'):
+        """FinanceDataReader StockListing: Code, Name, Market (Sector, Industry optional)."""
+
+    @abstractmethod
+    def kr_ohlcv(self, ticker, start_date, end_date=None):
+        """FinanceDataReader DataReader: DatetimeIndex, Open/High/Low/Close/Volume."""
+
+    @abstractmethod
+    def kr_market_ohlcv(self, date_str):
+        """pykrx get_market_ohlcv_by_ticker: 시가/고가/저가/종가/거래량 per 티커."""
+
+    @abstractmethod
+    def kr_fundamentals(self, date_str):
+        """pykrx get_market_fundamental_by_ticker: BPS/PER/PBR/EPS/DIV/DPS per 티커."""
+
+# yf.download collects its frames in module globals (yfinance.shared._DFS,
+# reset on every call, even with threads=False), so concurrent downloads
+# would wipe or mix each other's results
+_YF_DOWNLOAD_LOCK = threading.Lock()
+
+class LiveProvider(MarketDataProvider):
+    """
+    The real network sources, read through the response cache.
+
+    HTTP calls share one keep-alive session (yfinance and Wikipedia), so
+    concurrent fetches reuse pooled connections instead of opening a new
+    TLS connection per request.
+    """
+    POOL_SIZE = 32
+
+    def __init__(self, info_ttl=None):
+        self.info_ttl = info_ttl
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=LiveProvider.POOL_SIZE)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _ticker(self, ticker):
+        return yf.Ticker(ticker, session=self.session)
+
+    def us_tickers(self):
+        def load():
+            url = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
+            headers = {'User-Agent': 'Mozilla/5.0'}
+            # Use requests to avoid 403
+            r = self.session.get(url, headers=headers)
+            # Use pandas read_html on the response text
+            tables = pd.read_html(r.text)
+            return tables[0]
+
+        return cached_response('wikipedia', 'sp500', {}, load)
+
+    def us_ohlcv(self, ticker, start_date, end_date=None):
+        # yfinance expects start_date in 'YYYY-MM-DD' format
+        return cached_response(
+            'yfinance', 'history', {'ticker': ticker, 'start': start_date, 'end': end_date},
+            lambda: self._ticker(ticker).history(start=start_date, end=end_date, interval="1d")
+        )
+
+    def us_ohlcv_batch(self, tickers, start_date, end_date=None):
+        return cached_response(
+            'yfinance', 'download', {'tickers': sorted(tickers), 'start': start_date, 'end': end_date},
+            lambda: self._download(tickers, start_date, end_date)
+        )
+
+    def _download(self, tickers, start_date, end_date):
+        # One download at a time per process; other pool threads keep fetching single tickers
+        with _YF_DOWNLOAD_LOCK:
+            return yf.download(tickers, start=start_date, end=end_date, interval="1d",
+                               group_by='ticker', auto_adjust=True, threads=False, progress=False,
+                               session=self.session)
+
+    def us_statements(self, ticker):
+        # Cached transposed, since Parquet needs string column names
+        statements = cached_response('yfinance', 'financials', {'ticker': ticker},
+                                     lambda: self._ticker(ticker).financials.T)
+        return statements.T
+
+    def us_info(self, ticker):
+        def load():
+            info = self._ticker(ticker).info or {}
+            return pd.DataFrame([{
+                k: v for k, v in info.items() if v is None or isinstance(v, (str, int, float, bool))
+            }])
+
+        # Kept for info_ttl even with the response cache off, so intraday re-runs skip it
+        frame = cached_response('yfinance', 'info', {'ticker': ticker}, load, ttl=self.info_ttl)
+        if frame.empty:
+            return {}
+        # Back to plain Python values (numpy scalars do not bind as SQL parameters)
+        return {k: v.item() if hasattr(v, 'item') else v for k, v in frame.iloc[0].items()}
+
+    def kr_tickers(self, market_type='KRX'):
+        return cached_response('fdr', 'listing', {'market': market_type},
+                               lambda: fdr.StockListing(market_type))
+
+    def kr_ohlcv(self, ticker, start_date, end_date=None):
+        return cached_response(
+            'fdr', 'ohlcv', {'ticker': ticker, 'start': start_date, 'end': end_date},
+            lambda: fdr.DataReader(ticker, start_date, end_date)
+        )
+
+    def kr_market_ohlcv(self, date_str):
+        return cached_response('pykrx', 'market_ohlcv', {'date': date_str},
+                               lambda: krx_stock.get_market_ohlcv_by_ticker(date_str, market="ALL"))
+
+    def kr_fundamentals(self, date_str):
+        return cached_response('pykrx', 'fundamental', {'date': date_str},
+                               lambda: krx_stock.get_market_fundamental_by_ticker(date_str, market="ALL"))
+
+class SyntheticProvider(MarketDataProvider):
+    """
+    Deterministic local data for load tests: `tickers` US symbols (SYN0000...)
+    and as many KR codes (900000...) with `days` business days of OHLCV
+    ending at `end_date`, plus matching fundamentals.
+
+    Every series is derived from (seed, ticker) only, so runs are repeatable.
+    Each call sleeps `latency` seconds and fails with ConnectionError at
+    `error_rate`; whether a call fails depends on the request and how often
+    it was made before, not on thread timing.
+    """
+    SECTORS = ['Information Technology', 'Health Care', 'Financials', 'Consumer Discretionary',
+               'Communication Services', 'Industrials', 'Consumer Staples', 'Energy',
+               'Utilities', 'Real Estate', 'Materials']
+
+    def __init__(self, tickers=500, days=500, seed=42, latency=0.0, error_rate=0.0, end_date=None):
+        self.n_tickers = tickers
+        self.seed = seed
+        self.latency = latency
+        self.error_rate = error_rate
+        end = pd.Timestamp(end_date or date.today()).normalize()
+        self.calendar = pd.bdate_range(end=end, periods=days)
+        # Lookups go through numpy/dicts: pandas index engines are built
+        # lazily and not safe to initialize from several threads at once
+        self._days = self.calendar.values
+        self._positions = {day: i for i, day in enumerate(self.calendar)}
+        self.us_symbols = [f"SYN{i:04d}" for i in range(tickers)]
+        self.kr_codes = [f"{900000 + i:06d}" for i in range(tickers)]
+        self._paths = {}
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    # Determinism and fault injection
+
+    def _rng(self, *key):
+        return np.random.default_rng([self.seed, zlib.crc32(repr(key).encode('utf-8'))])
+
+    def _call(self, *request):
+        """
+        Simulates one network request: latency, then a possible injected failure.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate:
+            with self._lock:
+                attempt = self._attempts.get(request, 0)
+                self._attempts[request] = attempt + 1
+            if self._rng('error', request, attempt).random() < self.error_rate:
+                raise ConnectionError(f"Synthetic failure for {request}")
+
+    def _sector(self, i):
+        return self.SECTORS[i % len(self.SECTORS)]
+
+    def _path(self, ticker):
+        """
+        Full OHLCV history of a ticker over the calendar (cached).
+        """
+        with self._lock:
+            path = self._paths.get(ticker)
+        if path is not None:
+            return path
+
+        rng = self._rng('ohlcv', ticker)
+        n = len(self.calendar)
+        start = rng.uniform(10, 500)
+        drift = rng.normal(0.0003, 0.0005)
+        vol = rng.uniform(0.01, 0.03)
+        close = start * np.cumprod(1 + rng.normal(drift, vol, n))
+        open_ = np.concatenate([[start], close[:-1]]) * (1 + rng.normal(0, vol / 4, n))
+        high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, vol / 2, n)))
+        low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, vol / 2, n)))
+        volume = rng.lognormal(12, 1, n).astype('int64')
+        path = pd.DataFrame({
+            'Open': open_.round(2), 'High': high.round(2), 'Low': low.round(2),
+            'Close': close.round(2), 'Volume': volume
+        }, index=pd.DatetimeIndex(self.calendar, name='Date'))
+
+        with self._lock:
+            self._paths[ticker] = path
+        return path
+
+    def _slice(self, ticker, start_date, end_date):
+        start = np.searchsorted(self._days, pd.Timestamp(start_date).to_datetime64(), 'left')
+        end = np.searchsorted(self._days, pd.Timestamp(end_date).to_datetime64(), 'right') \
+            if end_date else len(self._days)
+        return self._path(ticker).iloc[start:end]
+
+    # US
+
+    def us_tickers(self):
+        self._call('us_tickers')
+        return pd.DataFrame({
+            'Symbol': self.us_symbols,
+            'Security': [f"Synthetic US {i}" for i in range(self.n_tickers)],
+            'GICS Sector': [self._sector(i) for i in range(self.n_tickers)],
+            'GICS Sub-Industry': [f"{self._sector(i)} {i % 3}" for i in range(self.n_tickers)]
+        })
+
+    def _us_frame(self, ticker, start_date, end_date):
+        df = self._slice(ticker, start_date, end_date).copy()
+        df.index = df.index.tz_localize('America/New_York')
+        df['Dividends'] = 0.0
+        df['Stock Splits'] = 0.0
+        return df
+
+    def us_ohlcv(self, ticker, start_date, end_date=None):
+        self._call('us_ohlcv', ticker, start_date, end_date)
+        return self._us_frame(ticker, start_date, end_date)
+
+    def us_ohlcv_batch(self, tickers, start_date, end_date=None):
+        self._call('us_ohlcv_batch', tuple(tickers), start_date, end_date)
+        frames = {t: self._us_frame(t, start_date, end_date)[['Open', 'High', 'Low', 'Close', 'Volume']]
+                  for t in tickers}
+        return pd.concat(frames, axis=1)
+
+    def us_statements(self, ticker):
+        self._call('us_statements', ticker)
+        rng = self._rng('statements', ticker)
+        year = self.calendar[-1].year
+        revenue = rng.uniform(1e9, 5e10) * np.cumprod(1 + rng.normal(0.05, 0.1, 4))
+        margin = rng.uniform(-0.05, 0.25)
+        dates = [pd.Timestamp(year - k, 12, 31) for k in range(1, 5)]
+        return pd.DataFrame(
+            [revenue[::-1].round(0), (revenue[::-1] * margin).round(0)],
+            index=['Total Revenue', 'Net Income'], columns=dates
+        )
+
+    def us_info(self, ticker):
+        self._call('us_info', ticker)
+        rng = self._rng('info', ticker)
+        return {
+            'trailingPE': float(rng.uniform(-10, 60)),
+            'priceToBook': float(rng.uniform(0.5, 15)),
+            'returnOnEquity': float(rng.uniform(-0.2, 0.5)),
+            'trailingEps': float(rng.uniform(-2, 20)),
+            'totalRevenue': int(rng.uniform(1e9, 5e10))
+        }
+
+    # KR
+
+    def kr_tickers(self, market_type='KRX'):
+        self._call('kr_tickers', market_type)
+        return pd.DataFrame({
+            'Code': self.kr_codes,
+            'Name': [f"합성 {i}" for i in range(self.n_tickers)],
+            'Market': ['KOSPI' if i % 3 else 'KOSDAQ' for i in range(self.n_tickers)],
+            'Sector': [self._sector(i) for i in range(self.n_tickers)],
+            'Industry': [f"{self._sector(i)} {i % 3}" for i in range(self.n_tickers)]
+        })
+
+    def kr_ohlcv(self, ticker, start_date, end_date=None):
+        self._call('kr_ohlcv', ticker, start_date, end_date)
+        df = self._slice(ticker, start_date, end_date).round(0)
+        df['Change'] = df['Close'].pct_change()
+        return df
+
+    def kr_market_ohlcv(self, date_str):
+        self._call('kr_market_ohlcv', date_str)
+        day = pd.Timestamp(datetime.strptime(date_str, "%Y%m%d"))
+        columns = ['시가', '고가', '저가', '종가', '거래량', '거래대금', '등락률']
+        index = pd.Index(self.kr_codes, name='티커')
+        if day not in self._positions:
+            # Holidays come back as all-zero rows, like KRX
+            return pd.DataFrame(0, index=index, columns=columns)
+
+        i = self._positions[day]
+        bars = [self._path(code).iloc[i] for code in self.kr_codes]
+        df = pd.DataFrame(bars, index=index)[['Open', 'High', 'Low', 'Close', 'Volume']].round(0)
+        df.columns = columns[:5]
+        df['거래대금'] = (df['종가'] * df['거래량']).astype('int64')
+        df['등락률'] = 0.0
+        return df
+
+    def kr_fundamentals(self, date_str):
+        self._call('kr_fundamentals', date_str)
+        day = pd.Timestamp(datetime.strptime(date_str, "%Y%m%d"))
+        if day not in self._positions:
+            return pd.DataFrame(0, index=pd.Index(self.kr_codes, name='티커'),
+                                columns=['BPS', 'PER', 'PBR', 'EPS', 'DIV', 'DPS'])
+        rows = []
+        for code in self.kr_codes:
+            rng = self._rng('fundamentals', code)
+            bps = rng.uniform(5000, 100000)
+            eps = bps * rng.uniform(-0.05, 0.2)
+            price = float(self._path(code)['Close'].iat[self._positions[day]])
+            rows.append({
+                'BPS': round(bps), 'PER': round(price / eps, 2) if eps > 0 else 0.0,
+                'PBR': round(price / bps, 2), 'EPS': round(eps), 'DIV': 0.0, 'DPS': 0
+            })
+        return pd.DataFrame(rows, index=pd.Index(self.kr_codes, name='티커'))
+
+def get_provider():
+    """
+    The app's market data provider (MARKET_DATA_PROVIDER: 'live' or
+    'synthetic'), created once per app so synthetic state persists across calls.
+    """
+    app = current_app._get_current_object()
+    provider = app.extensions.get('market_data_provider')
+    if provider is None:
+        if app.config.get('MARKET_DATA_PROVIDER', 'live') == 'synthetic':
+            provider = SyntheticProvider(**app.config.get('SYNTHETIC_PROVIDER', {}))
+        else:
+            provider = LiveProvider(info_ttl=app.config.get('US_INFO_CACHE_TTL'))
+        app.extensions['market_data_provider'] = provider
+    return provider
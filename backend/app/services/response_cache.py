@@ -0,0 +1,158 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import pandas as pd
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+class CacheMiss(Exception):
+    """Raised in replay mode when a response is not cached."""
+
+class ResponseCache:
+    """
+    On-disk cache of raw provider responses (DataFrames) stored as Parquet.
+
+    Entries are content-addressed: the file name is a hash of the source,
+    the request name and its parameters (ticker, date range, ...), so the
+    same request always maps to the same file. Each entry expires `ttl`
+    seconds after it was written, with the cache's ttl at write time (see
+    `cached_response`); the expiry is kept as the file's mtime, so readers
+    and `evict` honour it whatever ttl they run with. Expired entries are
+    treated as missing and deleted.
+
+    Modes (RESPONSE_CACHE_MODE):
+        'off'    -- always fetch, never cache
+        'on'     -- serve fresh entries, fetch and store the rest
+        'replay' -- serve only from the cache, at any age; a miss raises CacheMiss
+    """
+    MODES = ('off', 'on', 'replay')
+
+    def __init__(self, root, ttl, mode='on'):
+        if mode not in ResponseCache.MODES:
+            raise ValueError(f"Unknown response cache mode: {mode}")
+        self.root = root
+        self.ttl = ttl
+        self.mode = mode
+
+    @classmethod
+    def from_config(cls):
+        config = current_app.config
+        return cls(
+            config.get('RESPONSE_CACHE_DIR', '.response_cache'),
+            config.get('RESPONSE_CACHE_TTL', 6 * 3600),
+            config.get('RESPONSE_CACHE_MODE', 'off')
+        )
+
+    @staticmethod
+    def key(source, name, params):
+        payload = json.dumps([source, name, params], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path(self, source, key):
+        return os.path.join(self.root, source, key[:2], f"{key}.parquet")
+
+    def get(self, source, name, params):
+        """
+        The cached frame, or None if missing or (outside replay) expired.
+        """
+        path = self.path(source, self.key(source, name, params))
+        try:
+            expires = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        if self.mode != 'replay' and time.time() > expires:
+            self._remove(path)
+            return None
+        try:
+            return pd.read_parquet(path)
+        except Exception as e:
+            logger.warning(f"Dropping unreadable cache entry {path}: {e}")
+            self._remove(path)
+            return None
+
+    def put(self, source, name, params, df):
+        """
+        Stores a frame, expiring `ttl` seconds from now. Writes go to a
+        temporary file first so readers never see a partial entry.
+        """
+        path = self.path(source, self.key(source, name, params))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        os.close(fd)
+        try:
+            df.to_parquet(tmp_path)
+            expires = time.time() + self.ttl
+            os.utime(tmp_path, (expires, expires))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            self._remove(tmp_path)
+            logger.warning(f"Could not cache {source} {name} response: {e}")
+
+    def fetch(self, source, name, params, loader):
+        """
+        Returns the cached response for the request, calling `loader()` on a
+        miss (except in replay mode). Empty frames are not cached, since the
+        fetch functions return them on errors.
+        """
+        if self.mode == 'off':
+            return loader()
+
+        cached = self.get(source, name, params)
+        if cached is not None:
+            return cached
+        if self.mode == 'replay':
+            raise CacheMiss(f"{source} {name} {params} is not cached")
+
+        df = loader()
+        if df is not None and not df.empty:
+            self.put(source, name, params, df)
+        return df
+
+    def evict(self):
+        """
+        Deletes every expired entry, each by its own expiry. Temporary files
+        left by interrupted writes are deleted once older than `ttl`.
+        Returns the number of files removed. In replay mode entries never
+        expire, so nothing is deleted.
+        """
+        if self.mode == 'replay':
+            return 0
+        removed = 0
+        now = time.time()
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                # Temporary files still carry their creation time
+                cutoff = now - self.ttl if filename.endswith('.tmp') else now
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    continue
+        return removed
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def cached_response(source, name, params, loader, ttl=None):
+    """
+    Fetches a provider response through the configured ResponseCache.
+    A `ttl` (seconds) overrides the configured one for the entries it writes
+    and caches the response even when the cache is off.
+    """
+    cache = ResponseCache.from_config()
+    if ttl:
+        cache.ttl = ttl
+        if cache.mode == 'off':
+            cache.mode = 'on'
+    return cache.fetch(source, name, params, loader)
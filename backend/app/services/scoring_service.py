@@ -1,14 +1,30 @@
 from datetime import datetime, timedelta, date
+from flask import current_app
 from sqlalchemy import func
 from app import db
 from app.models.stock import Stock
 from app.models.financials import Financials
 from app.models.price import StockPrice
 from app.models.score import StockScore
+from app.models.dirty_ticker import DirtyTicker
+from app.models.latest_financials import LatestFinancials
+from app.services.upsert import dialect_insert
+from app.services.indicator_service import IndicatorService
 import pandas as pd
 import numpy as np
 
 class ScoringService:
+    COMPONENTS = ['valuation_score', 'profitability_score', 'growth_score', 'momentum_score']
+
+    WEIGHTS = {
+        'valuation': 0.30,
+        'profitability': 0.25,
+        'growth': 0.25,
+        'momentum': 0.20
+    }
+
+    SCORE_CHUNK_SIZE = 1000
+
     @staticmethod
     def calculate_valuation_score(ticker_id, date=None):
         """
@@ -22,50 +38,17 @@ class ScoringService:
         if not stock or not stock.sector:
             return None
             
-        # Get target stock financials
-        # We need the most recent financials relative to the date
-        target_fin = Financials.query.filter(
-            Financials.ticker_id == ticker_id,
-            Financials.fiscal_date <= date
-        ).order_by(Financials.fiscal_date.desc()).first()
-        
-        if not target_fin:
+        # Latest financials of every stock in the sector (the target included)
+        peers = ScoringService._load_latest_financials(ScoringService._sector_ticker_ids(stock.sector), date)
+        if ticker_id not in peers.index:
             return None
-            
-        # Get sector financials
-        # Join Stock and Financials to filter by sector
-        # We want the LATEST financials for each stock in the sector
-        # efficient query: Subquery to get max date per ticker
-        
-        subquery = db.session.query(
-            Financials.ticker_id,
-            func.max(Financials.fiscal_date).label('max_date')
-        ).join(Stock).filter(
-            Stock.sector == stock.sector,
-            Financials.fiscal_date <= date
-        ).group_by(Financials.ticker_id).subquery()
-        
-        sector_financials = db.session.query(Financials).join(
-            subquery,
-            (Financials.ticker_id == subquery.c.ticker_id) & 
-            (Financials.fiscal_date == subquery.c.max_date)
-        ).all()
-        
-        if not sector_financials:
-            return 50 # Default if no peers
-            
+        target_fin = ScoringService._target_financials(peers, ticker_id)
+
         # Extract metrics
-        pe_values = []
-        pb_values = []
-        
-        target_pe = float(target_fin.pe_ratio) if target_fin.pe_ratio is not None else None
-        target_pb = float(target_fin.pb_ratio) if target_fin.pb_ratio is not None else None
-        
-        for f in sector_financials:
-            if f.pe_ratio is not None:
-                pe_values.append(float(f.pe_ratio))
-            if f.pb_ratio is not None:
-                pb_values.append(float(f.pb_ratio))
+        target_pe = ScoringService._to_optional(target_fin['pe_ratio'])
+        target_pb = ScoringService._to_optional(target_fin['pb_ratio'])
+        pe_values = peers['pe_ratio'].dropna().tolist()
+        pb_values = peers['pb_ratio'].dropna().tolist()
                 
         # Calculate scores
         pe_score = ScoringService._calculate_relative_score(target_pe, pe_values, lower_is_better=True)
@@ -94,35 +77,14 @@ class ScoringService:
         if not stock or not stock.sector:
             return None
             
-        target_fin = Financials.query.filter(
-            Financials.ticker_id == ticker_id,
-            Financials.fiscal_date <= date
-        ).order_by(Financials.fiscal_date.desc()).first()
-        
-        if not target_fin:
-            return None
-            
         # Sector comparison logic (similar to valuation)
-        subquery = db.session.query(
-            Financials.ticker_id,
-            func.max(Financials.fiscal_date).label('max_date')
-        ).join(Stock).filter(
-            Stock.sector == stock.sector,
-            Financials.fiscal_date <= date
-        ).group_by(Financials.ticker_id).subquery()
-        
-        sector_financials = db.session.query(Financials).join(
-            subquery,
-            (Financials.ticker_id == subquery.c.ticker_id) & 
-            (Financials.fiscal_date == subquery.c.max_date)
-        ).all()
-        
-        roe_values = []
-        target_roe = float(target_fin.roe) if target_fin.roe is not None else None
-        
-        for f in sector_financials:
-            if f.roe is not None:
-                roe_values.append(float(f.roe))
+        peers = ScoringService._load_latest_financials(ScoringService._sector_ticker_ids(stock.sector), date)
+        if ticker_id not in peers.index:
+            return None
+        target_fin = ScoringService._target_financials(peers, ticker_id)
+
+        target_roe = ScoringService._to_optional(target_fin['roe'])
+        roe_values = peers['roe'].dropna().tolist()
                 
         return ScoringService._calculate_relative_score(target_roe, roe_values, lower_is_better=False)
 
@@ -139,70 +101,21 @@ class ScoringService:
         if not stock or not stock.sector:
             return None
             
-        # Get target stock financials (current and previous year)
-        # We need two most recent annual records or records separated by ~1 year
-        # Simplification: Get top 2 records sorted by date descending
-        
-        target_financials = Financials.query.filter(
-            Financials.ticker_id == ticker_id,
-            Financials.fiscal_date <= date
-        ).order_by(Financials.fiscal_date.desc()).limit(2).all()
-        
-        if len(target_financials) < 2:
+        # Current and previous financials (two most recent records) for the
+        # whole sector in one query
+        growth = ScoringService._load_growth(ScoringService._sector_ticker_ids(stock.sector), date)
+        if ticker_id not in growth.index:
             return None
-            
-        f_curr = target_financials[0]
-        f_prev = target_financials[1]
-        
-        # Calculate Growth for Target
-        def calculate_growth(curr, prev):
-            if prev is None or prev == 0:
-                return None
-            return float((curr - prev) / abs(prev))
-
-        target_rev_growth = calculate_growth(f_curr.revenue, f_prev.revenue) if f_curr.revenue is not None and f_prev.revenue is not None else None
-        target_eps_growth = calculate_growth(f_curr.eps, f_prev.eps) if f_curr.eps is not None and f_prev.eps is not None else None
+
+        target_rev_growth = ScoringService._to_optional(growth.at[ticker_id, 'rev_growth'])
+        target_eps_growth = ScoringService._to_optional(growth.at[ticker_id, 'eps_growth'])
         
         if target_rev_growth is None and target_eps_growth is None:
             return None
 
         # Get Sector Peers Growth
-        # Strategy: Get list of peers. For each peer, get top 2 financials. Calculate growth.
-        # Efficient query: We need a complex query to get prev/curr for all peers.
-        # Or just iterate? If sector has 50 stocks, 50 queries is okay-ish.
-        # Better: Fetch all financials for sector in date range, process in Python.
-        
-        # Get all financials for sector stocks <= date
-        # Maybe limit to last 2 years?
-        # Let's just iterate for now to be safe and clear, optimization later if needed.
-        
-        peers = Stock.query.filter(Stock.sector == stock.sector).all()
-        peer_rev_growths = []
-        peer_eps_growths = []
-        
-        for peer in peers:
-            # We already have target, but it's fine to re-calculate in loop or skip
-            if peer.id == ticker_id:
-                if target_rev_growth is not None: peer_rev_growths.append(target_rev_growth)
-                if target_eps_growth is not None: peer_eps_growths.append(target_eps_growth)
-                continue
-                
-            p_fins = Financials.query.filter(
-                Financials.ticker_id == peer.id,
-                Financials.fiscal_date <= date
-            ).order_by(Financials.fiscal_date.desc()).limit(2).all()
-            
-            if len(p_fins) < 2:
-                continue
-                
-            pf_curr = p_fins[0]
-            pf_prev = p_fins[1]
-            
-            g_rev = calculate_growth(pf_curr.revenue, pf_prev.revenue) if pf_curr.revenue is not None and pf_prev.revenue is not None else None
-            g_eps = calculate_growth(pf_curr.eps, pf_prev.eps) if pf_curr.eps is not None and pf_prev.eps is not None else None
-            
-            if g_rev is not None: peer_rev_growths.append(g_rev)
-            if g_eps is not None: peer_eps_growths.append(g_eps)
+        peer_rev_growths = growth['rev_growth'].dropna().tolist()
+        peer_eps_growths = growth['eps_growth'].dropna().tolist()
             
         # Calculate Scores
         rev_score = ScoringService._calculate_relative_score(target_rev_growth, peer_rev_growths, lower_is_better=False)
@@ -233,87 +146,21 @@ class ScoringService:
         if not stock or not stock.sector:
             return None
 
-        # Helper to get metrics
-        def get_momentum_metrics(tid, ref_date):
-            # Get price history (descending)
-            # Need enough for RSI (14) + some buffer -> 30 days?
-            # And need 6 months ago for Return.
-            # Efficient: Get 6 months + buffer worth of data?
-            # Or just get all data?
-            # Let's get last 200 records.
-            
-            prices = StockPrice.query.filter(
-                StockPrice.ticker_id == tid,
-                StockPrice.timestamp <= ref_date
-            ).order_by(StockPrice.timestamp.desc()).limit(200).all()
-            
-            if not prices:
-                return None, None
-                
-            # Convert to DataFrame for calculations
-            # prices is desc, need asc for pandas
-            data = [{'close': float(p.close), 'date': p.timestamp} for p in prices]
-            df = pd.DataFrame(data).sort_values('date')
-            
-            if df.empty:
-                return None, None
-                
-            # Calculate Return (6 month)
-            # Find price ~6 months ago
-            latest_price = df.iloc[-1]['close']
-            latest_date = df.iloc[-1]['date']
-            
-            # 6 months ago
-            target_prev_date = latest_date - pd.Timedelta(days=180)
-            
-            # Find closest date
-            # Filter df where date <= target_prev_date
-            # Take the last one (closest to 6 months ago)
-            past_df = df[df['date'] <= target_prev_date]
-            
-            six_mo_return = None
-            if not past_df.empty:
-                prev_price = past_df.iloc[-1]['close']
-                if prev_price > 0:
-                    six_mo_return = (latest_price - prev_price) / prev_price
-
-            # Calculate RSI (14)
-            rsi = None
-            if len(df) > 14:
-                delta = df['close'].diff()
-                gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-                loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-                
-                # Standard RSI uses EMA usually, but SMA is also used.
-                # Wilder's smoothing is standard but let's stick to simple rolling for robustness/simplicity if no lib.
-                # Actually, standard RSI formula:
-                # RS = Avg Gain / Avg Loss
-                # RSI = 100 - (100 / (1 + RS))
-                
-                rs = gain / loss
-                rsi_series = 100 - (100 / (1 + rs))
-                rsi = rsi_series.iloc[-1]
-                
-                # Handle division by zero or NaN
-                if pd.isna(rsi):
-                    rsi = 50 # Neutral? Or None
-                    
-            return rsi, six_mo_return
+        # One windowed query for the whole sector instead of one per peer
+        metrics = ScoringService._load_momentum(ScoringService._sector_ticker_ids(stock.sector), date)
+        if ticker_id not in metrics.index:
+            return None
 
-        target_rsi, target_return = get_momentum_metrics(ticker_id, date)
+        rsi = ScoringService._peer_rsi(metrics)
+        target_rsi = ScoringService._to_optional(rsi.at[ticker_id])
+        target_return = ScoringService._to_optional(metrics.at[ticker_id, 'return'])
         
         if target_rsi is None and target_return is None:
             return None
             
         # Get Peers Metrics
-        peers = Stock.query.filter(Stock.sector == stock.sector).all()
-        peer_rsis = []
-        peer_returns = []
-        
-        for peer in peers:
-            rsi, ret = get_momentum_metrics(peer.id, date)
-            if rsi is not None: peer_rsis.append(rsi)
-            if ret is not None: peer_returns.append(ret)
+        peer_rsis = rsi.dropna().tolist()
+        peer_returns = metrics['return'].dropna().tolist()
             
         # Calculate Scores
         rsi_score = ScoringService._calculate_relative_score(target_rsi, peer_rsis, lower_is_better=False)
@@ -328,10 +175,158 @@ class ScoringService:
             
         return int(sum(scores) / len(scores))
 
+    # Momentum inputs
+    #
+    # Prices for a whole set of tickers are fetched with one windowed query and
+    # laid out as a tickers x bars matrix, right-aligned on each ticker's most
+    # recent bar. RSI and the 6 month return are then computed for every row at once.
+
+    PRICE_WINDOW = 200
+    RSI_PERIOD = 14
+    RETURN_LOOKBACK = timedelta(days=180)
+
+    @staticmethod
+    def load_price_matrix(ticker_ids, ref_date, window=None):
+        """
+        Loads the last `window` closes (timestamp <= ref_date) for every ticker
+        in a single query.
+
+        Returns (ticker_ids, dates, closes): `closes` is a float array of shape
+        (len(ticker_ids), window) and `dates` the matching datetime64 array.
+        Row i belongs to ticker_ids[i]; the last column is each ticker's latest
+        bar and missing leading bars are NaN / NaT.
+        """
+        if window is None:
+            window = ScoringService.PRICE_WINDOW
+
+        ticker_ids = pd.Index(ticker_ids)
+        closes = np.full((len(ticker_ids), window), np.nan)
+        dates = np.full((len(ticker_ids), window), np.datetime64('NaT'), dtype='datetime64[ns]')
+        if len(ticker_ids) == 0:
+            return ticker_ids, dates, closes
+
+        ranked = db.session.query(
+            StockPrice.ticker_id.label('ticker_id'),
+            StockPrice.timestamp.label('timestamp'),
+            db.cast(StockPrice.close, db.Float).label('close'),
+            func.row_number().over(
+                partition_by=StockPrice.ticker_id,
+                order_by=StockPrice.timestamp.desc()
+            ).label('rn')
+        ).filter(
+            StockPrice.ticker_id.in_(ticker_ids.tolist()),
+            StockPrice.timestamp <= ref_date
+        ).subquery()
+
+        rows = db.session.query(
+            ranked.c.ticker_id, ranked.c.timestamp, ranked.c.close, ranked.c.rn
+        ).filter(ranked.c.rn <= window).all()
+        if not rows:
+            return ticker_ids, dates, closes
+
+        df = pd.DataFrame(rows, columns=['ticker_id', 'timestamp', 'close', 'rn'])
+        row_idx = ticker_ids.get_indexer(df['ticker_id'])
+        col_idx = window - df['rn'].to_numpy(dtype=int)
+        closes[row_idx, col_idx] = df['close'].to_numpy(dtype=float, na_value=np.nan)
+        dates[row_idx, col_idx] = pd.to_datetime(df['timestamp']).to_numpy(dtype='datetime64[ns]')
+        return ticker_ids, dates, closes
+
+    @staticmethod
+    def _rsi_method():
+        return current_app.config.get('RSI_METHOD', 'sma')
+
+    @staticmethod
+    def compute_momentum_metrics(dates, closes, rsi_method='sma'):
+        """
+        RSI(14) and 6 month return for every row of a price matrix from
+        `load_price_matrix`. RSI uses a simple rolling mean of gains/losses
+        ('sma') or Wilder smoothing over the window ('wilder').
+        Returns two float arrays, NaN where a metric is unavailable.
+        """
+        n_rows, window = closes.shape
+        has_bar = ~np.isnat(dates)
+        n_bars = has_bar.sum(axis=1)
+        rows = np.arange(n_rows)
+
+        # Return (6 month): last close on or before latest date - 180 days
+        six_mo_return = np.full(n_rows, np.nan)
+        latest_close = closes[:, -1]
+        cutoff = dates[:, -1] - np.timedelta64(ScoringService.RETURN_LOOKBACK)
+        with np.errstate(invalid='ignore'):
+            past = has_bar & (dates <= cutoff[:, None])
+        n_past = past.sum(axis=1)
+        has_past = n_past > 0
+        prev_idx = (window - n_bars) + n_past - 1
+        prev_close = closes[rows, np.clip(prev_idx, 0, window - 1)]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ok = has_past & (prev_close > 0)
+            six_mo_return[ok] = (latest_close[ok] - prev_close[ok]) / prev_close[ok]
+
+        if rsi_method == 'wilder':
+            return IndicatorService.wilder_rsi(closes), six_mo_return
+
+        # RSI (14): RS = avg gain / avg loss, RSI = 100 - 100 / (1 + RS)
+        period = ScoringService.RSI_PERIOD
+        rsi = np.full(n_rows, np.nan)
+        has_rsi = n_bars > period
+        if window > period and has_rsi.any():
+            delta = np.diff(closes[has_rsi, -(period + 1):], axis=1)
+            with np.errstate(invalid='ignore'):
+                gain = np.where(delta > 0, delta, 0).mean(axis=1)
+                loss = np.where(delta < 0, -delta, 0).mean(axis=1)
+            rsi[has_rsi] = IndicatorService.rsi_from_averages(gain, loss)
+
+        return rsi, six_mo_return
+
+    @staticmethod
+    def _to_optional(value):
+        return None if pd.isna(value) else float(value)
+
+    @staticmethod
+    def percentile_scores(values, peer_values=None, lower_is_better=True):
+        """
+        Percentile-based scores (0-100) for every value in `values` at once.
+
+        `peer_values` is the population to rank against and defaults to `values`
+        itself (a sector ranking all its members). The peers are sorted once and
+        each value is placed with a binary search, so ranking a sector is
+        O(n log n) instead of one list scan per member.
+
+        Rules (same as `_calculate_relative_score`):
+        - Higher is better: score = count(peers < value) / count(peers)
+        - Lower is better (P/E, P/B): values <= 0 score 0, positive values are
+          ranked against positive peers only: count(peers > value) / count(positive peers)
+        - Scores are truncated to ints. NaN marks a missing value, both in the
+          input and in the result.
+        """
+        values = np.asarray(values, dtype=float)
+        peers = values if peer_values is None else np.asarray(peer_values, dtype=float)
+        peers = np.sort(peers[~np.isnan(peers)])
+
+        scores = np.full(values.shape, np.nan)
+        if peers.size == 0:
+            return scores
+
+        valid = ~np.isnan(values)
+        if lower_is_better:
+            scores[valid] = 0
+            positive = peers[np.searchsorted(peers, 0, side='right'):]
+            if positive.size == 0:
+                return scores
+            ranked = valid & (values > 0)
+            better_than_count = positive.size - np.searchsorted(positive, values[ranked], side='right')
+            scores[ranked] = np.trunc((better_than_count / positive.size) * 100)
+        else:
+            better_than_count = np.searchsorted(peers, values[valid], side='left')
+            scores[valid] = np.trunc((better_than_count / peers.size) * 100)
+
+        return scores
+
     @staticmethod
     def _calculate_relative_score(target_value, peer_values, lower_is_better=True):
         """
-        Calculates a percentile-based score (0-100).
+        Calculates a percentile-based score (0-100) for a single value.
+        See `percentile_scores` for the ranking rules.
         """
         if target_value is None or not peer_values:
             return None
@@ -340,56 +335,60 @@ class ScoringService:
         peer_values = [v for v in peer_values if v is not None]
         if not peer_values:
             return None
-            
-        # Percentile rank
-        # pandas rank(pct=True) returns 0.0 to 1.0
-        # We can implement a simple percentile calculation
-        # sum(v < target) / total for "higher is better"
-        # sum(v > target) / total for "lower is better"
-        
-        if lower_is_better:
-            # For P/E: Lower is better. 
-            # If target is 10, and peers are [5, 10, 15, 20]
-            # We want high score for 10.
-            # It is better than 15 and 20.
-            # Percentile of "better than" = count(peers > target) / total
-            
-            # Handle negative P/E: usually treated as bad. 
-            # If target < 0: score = 0?
-            # Or just rank normally? 
-            # Let's rank normally but filter: 
-            # Common practice: Only positive P/E is ranked for valuation. Negatives are penalized.
-            # For simplicity here: just rank all values numerically.
-            # 10 is better than 20. -5 is "lower" than 10 but actually bad.
-            # Let's stick to numerical rank for now, maybe add a check later if needed.
-            # But the prompt says "Low P/E ... higher score". 
-            # Mathematically -10 < 10. So -10 gets better score? That's wrong for P/E.
-            # I should filter positive P/Es only?
-            # Or maybe just use absolute value? No.
-            
-            # Let's assume standard P/E logic:
-            # If P/E <= 0: Score 0.
-            # If P/E > 0: Compare against other positive P/Es.
-            
-            if target_value <= 0:
-                return 0
-                
-            positive_peers = [p for p in peer_values if p > 0]
-            if not positive_peers:
-                return 0 # No positive peers to compare to
-                
-            # Count how many peers have HIGHER P/E (worse) than target
-            better_than_count = sum(1 for p in positive_peers if p > target_value)
-            score = (better_than_count / len(positive_peers)) * 100
-            
-        else:
-            # Higher is better (e.g. ROE)
-            # Count how many peers have LOWER ROE than target
-            better_than_count = sum(1 for p in peer_values if p < target_value)
-            score = (better_than_count / len(peer_values)) * 100
-            
+
+        score = ScoringService.percentile_scores([target_value], peer_values, lower_is_better)[0]
         return int(score)
 
+    @staticmethod
+    def _end_of_day(value):
+        """
+        Momentum needs a datetime (end of day) when a plain date is given.
+        """
+        if isinstance(value, datetime):
+            return value
+        return datetime(value.year, value.month, value.day, 23, 59, 59)
+
+    @staticmethod
+    def _weighted_total(val_score, prof_score, growth_score, mom_score):
+        """
+        Weighted average of the available component scores.
+        Missing components have their weight redistributed.
+        """
+        weights = ScoringService.WEIGHTS
+
+        weighted_sum = 0
+        total_weight = 0
+
+        if val_score is not None:
+            weighted_sum += val_score * weights['valuation']
+            total_weight += weights['valuation']
+
+        if prof_score is not None:
+            weighted_sum += prof_score * weights['profitability']
+            total_weight += weights['profitability']
+
+        if growth_score is not None:
+            weighted_sum += growth_score * weights['growth']
+            total_weight += weights['growth']
+
+        if mom_score is not None:
+            weighted_sum += mom_score * weights['momentum']
+            total_weight += weights['momentum']
+
+        if total_weight > 0:
+            return int(weighted_sum / total_weight)
+        return None
+
+    @staticmethod
+    def _grade(final_score):
+        if final_score >= 85:
+            return 'Strong Buy'
+        elif final_score >= 70:
+            return 'Buy'
+        elif final_score >= 40:
+            return 'Hold'
+        return 'Sell'
+
     @staticmethod
     def calculate_score(ticker_id, date=None):
         if date is None:
@@ -398,17 +397,7 @@ class ScoringService:
         val_score = ScoringService.calculate_valuation_score(ticker_id, date)
         prof_score = ScoringService.calculate_profitability_score(ticker_id, date)
         growth_score = ScoringService.calculate_growth_score(ticker_id, date)
-        
-        # Momentum needs datetime (end of day) if date is provided
-        mom_date = date
-        if type(date) is date:
-            mom_date = datetime(date.year, date.month, date.day, 23, 59, 59)
-        elif isinstance(date, datetime):
-            mom_date = date
-        else:
-            mom_date = datetime.utcnow()
-            
-        mom_score = ScoringService.calculate_momentum_score(ticker_id, mom_date)
+        mom_score = ScoringService.calculate_momentum_score(ticker_id, ScoringService._end_of_day(date))
         
         # Save to DB
         score = StockScore.query.filter_by(ticker_id=ticker_id, date=date).first()
@@ -420,72 +409,816 @@ class ScoringService:
         score.growth_score = growth_score
         score.momentum_score = mom_score
         
-        # Weighted Average
-        weights = {
-            'valuation': 0.30,
-            'profitability': 0.25,
-            'growth': 0.25,
-            'momentum': 0.20
-        }
-        
-        weighted_sum = 0
-        total_weight = 0
-        
-        if val_score is not None:
-            weighted_sum += val_score * weights['valuation']
-            total_weight += weights['valuation']
-            
-        if prof_score is not None:
-            weighted_sum += prof_score * weights['profitability']
-            total_weight += weights['profitability']
-            
-        if growth_score is not None:
-            weighted_sum += growth_score * weights['growth']
-            total_weight += weights['growth']
-            
-        if mom_score is not None:
-            weighted_sum += mom_score * weights['momentum']
-            total_weight += weights['momentum']
-            
-        if total_weight > 0:
-            final_score = int(weighted_sum / total_weight)
+        final_score = ScoringService._weighted_total(val_score, prof_score, growth_score, mom_score)
+        if final_score is not None:
             score.total_score = final_score
-            
-            # Assign Grade
-            if final_score >= 85:
-                score.grade = 'Strong Buy'
-            elif final_score >= 70:
-                score.grade = 'Buy'
-            elif final_score >= 40:
-                score.grade = 'Hold'
-            else:
-                score.grade = 'Sell'
+            score.grade = ScoringService._grade(final_score)
         
         db.session.add(score)
         db.session.commit()
         return score
 
+    # Sector batch scoring
+    #
+    # The per-ticker calculate_* functions each rebuild the whole sector to rank
+    # one stock. The batch path loads a sector's inputs once, computes every
+    # component for all members as columns and writes the sector in bulk.
+    # Results are identical to the per-ticker functions.
+    #
+    # Loading (load_scoring_inputs) and ranking (rank_scoring_inputs) are
+    # separate steps so a large sector can be loaded in shards in parallel and
+    # ranked once the shards are merged.
+
+    SCORING_SHARD_SIZE = 500
+
+    @staticmethod
+    def _to_float(values):
+        """
+        Converts a column of Decimal/int/None values to a float array (None -> NaN).
+        """
+        return np.array([np.nan if pd.isna(v) else float(v) for v in values], dtype=float)
+
+    @staticmethod
+    def _mean_scores(*score_arrays):
+        """
+        int(mean) of the available (non-NaN) scores per row, NaN if none.
+        """
+        stacked = np.vstack(score_arrays)
+        counts = (~np.isnan(stacked)).sum(axis=0)
+        sums = np.nansum(stacked, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, np.trunc(sums / counts), np.nan)
+
+    @staticmethod
+    def _sector_ticker_ids(sector):
+        query = db.session.query(Stock.id)
+        if sector is None:
+            query = query.filter(Stock.sector.is_(None))
+        else:
+            query = query.filter(Stock.sector == sector)
+        return [tid for (tid,) in query.order_by(Stock.id)]
+
+    @staticmethod
+    def _load_latest_financials(ticker_ids, date):
+        """
+        Every financials row at each ticker's latest fiscal date (as of `date`),
+        indexed by ticker_id. This is the peer set the per-ticker
+        valuation/profitability scores rank against.
+
+        Read from the `latest_financials` snapshot; tickers missing from it or
+        whose snapshot is newer than `date` (historical runs) fall back to
+        aggregating `financials`.
+        """
+        columns = ['id', 'ticker_id', 'pe_ratio', 'pb_ratio', 'roe']
+        rows = db.session.query(
+            LatestFinancials.financials_id,
+            LatestFinancials.ticker_id,
+            LatestFinancials.pe_ratio,
+            LatestFinancials.pb_ratio,
+            LatestFinancials.roe,
+            LatestFinancials.fiscal_date
+        ).filter(
+            LatestFinancials.ticker_id.in_(ticker_ids)
+        ).all()
+
+        current = [row[:5] for row in rows if row.fiscal_date <= date]
+        covered = {row.ticker_id for row in rows if row.fiscal_date <= date}
+        missing = [tid for tid in ticker_ids if tid not in covered]
+        if missing:
+            current += ScoringService._query_latest_financials(missing, date)
+
+        peers = pd.DataFrame(current, columns=columns).sort_values(['ticker_id', 'id'])
+        for col in ['pe_ratio', 'pb_ratio', 'roe']:
+            peers[col] = ScoringService._to_float(peers[col])
+        return peers.set_index('ticker_id')
+
+    @staticmethod
+    def _query_latest_financials(ticker_ids, date):
+        """
+        `_load_latest_financials` rows computed from the financials history.
+        """
+        subquery = db.session.query(
+            Financials.ticker_id,
+            func.max(Financials.fiscal_date).label('max_date')
+        ).filter(
+            Financials.ticker_id.in_(ticker_ids),
+            Financials.fiscal_date <= date
+        ).group_by(Financials.ticker_id).subquery()
+
+        return db.session.query(
+            Financials.id,
+            Financials.ticker_id,
+            Financials.pe_ratio,
+            Financials.pb_ratio,
+            Financials.roe
+        ).join(
+            subquery,
+            (Financials.ticker_id == subquery.c.ticker_id) &
+            (Financials.fiscal_date == subquery.c.max_date)
+        ).all()
+
+    @staticmethod
+    def _target_financials(peers, ticker_id):
+        """
+        A ticker's own row from `_load_latest_financials` peers: the highest
+        id on its latest fiscal date.
+        """
+        return peers.loc[[ticker_id]].sort_values('id').iloc[-1]
+
+    @staticmethod
+    def _growth_rates(curr, prev):
+        """
+        Vectorized (curr - prev) / |prev|. Works on object arrays so int and
+        Decimal columns keep the exact arithmetic of the per-ticker path.
+        """
+        curr = np.asarray(curr, dtype=object)
+        prev = np.asarray(prev, dtype=object)
+        rates = np.full(len(curr), np.nan)
+
+        valid = ~(pd.isna(curr) | pd.isna(prev))
+        valid[valid] = prev[valid] != 0
+        if valid.any():
+            rates[valid] = ((curr[valid] - prev[valid]) / np.abs(prev[valid])).astype(float)
+        return rates
+
+    @staticmethod
+    def _load_growth(ticker_ids, date):
+        """
+        Revenue and EPS growth between each ticker's two most recent financials,
+        for every ticker with at least two records. Indexed by ticker_id.
+        """
+        # ROW_NUMBER() keeps only the current (rn=1) and previous (rn=2) record per ticker
+        ranked = db.session.query(
+            Financials.ticker_id.label('ticker_id'),
+            Financials.revenue.label('revenue'),
+            Financials.eps.label('eps'),
+            func.row_number().over(
+                partition_by=Financials.ticker_id,
+                order_by=(Financials.fiscal_date.desc(), Financials.id.desc())
+            ).label('rn')
+        ).filter(
+            Financials.ticker_id.in_(ticker_ids),
+            Financials.fiscal_date <= date
+        ).subquery()
+
+        rows = db.session.query(
+            ranked.c.ticker_id, ranked.c.revenue, ranked.c.eps, ranked.c.rn
+        ).filter(ranked.c.rn <= 2).all()
+        df = pd.DataFrame(rows, columns=['ticker_id', 'revenue', 'eps', 'rn'], dtype=object)
+
+        curr = df[df['rn'] == 1].set_index('ticker_id')[['revenue', 'eps']]
+        prev = df[df['rn'] == 2].set_index('ticker_id')[['revenue', 'eps']]
+        pairs = curr.join(prev, how='inner', lsuffix='_curr', rsuffix='_prev')
+
+        return pd.DataFrame({
+            'rev_growth': ScoringService._growth_rates(pairs['revenue_curr'], pairs['revenue_prev']),
+            'eps_growth': ScoringService._growth_rates(pairs['eps_curr'], pairs['eps_prev'])
+        }, index=pd.Index(pairs.index.astype(int), name='ticker_id'))
+
+    @staticmethod
+    def _load_momentum(ticker_ids, ref_date):
+        """
+        RSI(14) and 6 month return per ticker from its last 200 closes.
+        Tickers without any price are left out. Indexed by ticker_id.
+        """
+        ticker_ids, dates, closes = ScoringService.load_price_matrix(ticker_ids, ref_date)
+        return ScoringService._momentum_frame(ticker_ids, dates, closes)
+
+    @staticmethod
+    def _momentum_frame(ticker_ids, dates, closes):
+        """
+        Momentum inputs of a price matrix: RSI over the window and the 6 month
+        return. With RSI_METHOD 'wilder' a 'state_rsi' column holds the
+        persisted indicator state's RSI where the state ends at the ticker's
+        latest bar (NaN elsewhere); see `_peer_rsi`.
+        """
+        rsi_method = ScoringService._rsi_method()
+        rsi, six_mo_return = ScoringService.compute_momentum_metrics(dates, closes, rsi_method)
+
+        has_prices = ~np.isnat(dates[:, -1])
+        columns = {'rsi': rsi[has_prices], 'return': six_mo_return[has_prices]}
+        if rsi_method == 'wilder':
+            state_rsi = np.full(len(ticker_ids), np.nan)
+            if has_prices.any():
+                stored = IndicatorService.load_rsi(ticker_ids[has_prices], dates[has_prices, -1])
+                if stored:
+                    state_rsi[ticker_ids.get_indexer(list(stored))] = list(stored.values())
+            columns['state_rsi'] = state_rsi[has_prices]
+
+        return pd.DataFrame(columns, index=pd.Index(ticker_ids[has_prices], name='ticker_id'))
+
+    @staticmethod
+    def _peer_rsi(momentum):
+        """
+        The RSI a peer group is ranked on. Stored states smooth the full
+        history while the window RSI only sees the last 200 bars, so the two
+        are never mixed: the stored values are used only if every peer with
+        an RSI has one, otherwise the whole group falls back to the window
+        until rebuild_indicator_states seeds the missing states.
+        """
+        if 'state_rsi' not in momentum:
+            return momentum['rsi']
+        stored = momentum['state_rsi']
+        if stored[momentum['rsi'].notna()].notna().all():
+            return stored
+        return momentum['rsi']
+
     @staticmethod
-    def run_daily_scoring(date=None):
+    def load_scoring_inputs(ticker_ids, date):
+        """
+        Loads the raw scoring inputs for a set of tickers (a sector or a shard
+        of one): latest financials, growth rates and momentum metrics.
+        """
+        return {
+            'financials': ScoringService._load_latest_financials(ticker_ids, date),
+            'growth': ScoringService._load_growth(ticker_ids, date),
+            'momentum': ScoringService._load_momentum(ticker_ids, ScoringService._end_of_day(date))
+        }
+
+    @staticmethod
+    def dump_scoring_inputs(inputs):
+        """
+        JSON-serializable form of `load_scoring_inputs` (for Celery results).
+        """
+        return {name: frame.reset_index().to_dict('list') for name, frame in inputs.items()}
+
+    @staticmethod
+    def merge_scoring_inputs(dumps):
+        """
+        Rebuilds and concatenates inputs from `dump_scoring_inputs`, e.g. the
+        shards of one sector.
+        """
+        merged = {}
+        for name in ['financials', 'growth', 'momentum']:
+            frames = [pd.DataFrame(dump[name]).set_index('ticker_id') for dump in dumps]
+            merged[name] = pd.concat(frames) if frames else pd.DataFrame()
+        return merged
+
+    @staticmethod
+    def rank_scoring_inputs(ticker_ids, inputs):
+        """
+        Ranks a whole sector from its inputs and returns component scores,
+        total and grade as a DataFrame indexed by ticker_id. `inputs` may be
+        None (no peers), in which case every component is None.
+        """
+        index = pd.Index(ticker_ids, name='ticker_id')
+        scores = pd.DataFrame(np.nan, index=index, columns=ScoringService.COMPONENTS)
+
+        if inputs is not None:
+            peers = inputs['financials']
+            # Same tie-break as the per-ticker query (fiscal_date desc, id desc)
+            latest = peers.sort_values('id')
+            latest = latest[~latest.index.duplicated(keep='last')]
+            pe_scores = ScoringService.percentile_scores(latest['pe_ratio'], peers['pe_ratio'], lower_is_better=True)
+            pb_scores = ScoringService.percentile_scores(latest['pb_ratio'], peers['pb_ratio'], lower_is_better=True)
+            roe_scores = ScoringService.percentile_scores(latest['roe'], peers['roe'], lower_is_better=False)
+            scores.loc[latest.index, 'valuation_score'] = ScoringService._mean_scores(pe_scores, pb_scores)
+            scores.loc[latest.index, 'profitability_score'] = roe_scores
+
+            growth = inputs['growth']
+            rev_scores = ScoringService.percentile_scores(growth['rev_growth'], lower_is_better=False)
+            eps_scores = ScoringService.percentile_scores(growth['eps_growth'], lower_is_better=False)
+            scores.loc[growth.index, 'growth_score'] = ScoringService._mean_scores(rev_scores, eps_scores)
+
+            momentum = inputs['momentum']
+            rsi_scores = ScoringService.percentile_scores(ScoringService._peer_rsi(momentum), lower_is_better=False)
+            ret_scores = ScoringService.percentile_scores(momentum['return'], lower_is_better=False)
+            scores.loc[momentum.index, 'momentum_score'] = ScoringService._mean_scores(rsi_scores, ret_scores)
+
+        scores = scores.astype(object)
+        for col in ScoringService.COMPONENTS:
+            scores[col] = pd.Series(
+                [None if pd.isna(v) else int(v) for v in scores[col]], index=index, dtype=object
+            )
+        scores['total_score'] = pd.Series([
+            ScoringService._weighted_total(*components)
+            for components in scores[ScoringService.COMPONENTS].itertuples(index=False)
+        ], index=index, dtype=object)
+        scores['grade'] = pd.Series([
+            ScoringService._grade(total) if total is not None else None
+            for total in scores['total_score']
+        ], index=index, dtype=object)
+        return scores
+
+    @staticmethod
+    def compute_sector_scores(sector, date=None):
+        """
+        Computes component scores, total and grade for every stock in a sector.
+        Returns a DataFrame indexed by ticker_id. Nothing is written.
+        """
+        if date is None:
+            date = datetime.utcnow().date()
+
+        ticker_ids = ScoringService._sector_ticker_ids(sector)
+
+        # Stocks without a sector have no peers to rank against
+        inputs = None
+        if sector and ticker_ids:
+            inputs = ScoringService.load_scoring_inputs(ticker_ids, date)
+        return ScoringService.rank_scoring_inputs(ticker_ids, inputs)
+
+    @staticmethod
+    def _sector_members():
+        """
+        {sector: [ticker_ids]} for the whole universe in one query.
+        """
+        rows = db.session.query(Stock.sector, Stock.id).order_by(Stock.sector, Stock.id).all()
+        members = {}
+        for sector, ticker_id in rows:
+            members.setdefault(sector, []).append(ticker_id)
+        return members
+
+    @staticmethod
+    def plan_scoring_shards(shard_size=None, members=None):
+        """
+        Splits the universe (or `members`, {sector: ticker_ids}) into scoring
+        units: one per sector, or several shards of at most `shard_size`
+        tickers for very large sectors.
+        Returns a list of (sector, ticker_ids).
+        """
+        if shard_size is None:
+            shard_size = ScoringService.SCORING_SHARD_SIZE
+        if members is None:
+            members = ScoringService._sector_members()
+
+        shards = []
+        for sector, ticker_ids in members.items():
+            for i in range(0, len(ticker_ids), shard_size):
+                shards.append((sector, ticker_ids[i:i+shard_size]))
+        return shards
+
+    @staticmethod
+    def _upsert_scores(records):
+        stmt = dialect_insert(StockScore).values(records)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['ticker_id', 'date'],
+            set_={
+                'valuation_score': stmt.excluded.valuation_score,
+                'profitability_score': stmt.excluded.profitability_score,
+                'growth_score': stmt.excluded.growth_score,
+                'momentum_score': stmt.excluded.momentum_score,
+                # Like calculate_score, keep the previous total if nothing could be scored
+                'total_score': func.coalesce(stmt.excluded.total_score, StockScore.total_score),
+                'grade': func.coalesce(stmt.excluded.grade, StockScore.grade),
+                'updated_at': stmt.excluded.updated_at
+            }
+        )
+        db.session.execute(stmt)
+
+    @staticmethod
+    def save_scores(scores, date, chunk_size=None):
+        """
+        Bulk upserts scores from `compute_sector_scores` as StockScore rows for `date`.
+
+        Rows are written with chunked INSERT ... ON CONFLICT (ticker_id, date)
+        DO UPDATE, one transaction per chunk. If a chunk fails it is retried row
+        by row so a single bad ticker does not lose the rest of the chunk.
+        Returns (saved_count, failed_ticker_ids).
+        """
+        if chunk_size is None:
+            chunk_size = ScoringService.SCORE_CHUNK_SIZE
+
+        now = datetime.utcnow()
+        records = [{
+            'ticker_id': int(ticker_id),
+            'date': date,
+            'valuation_score': row.valuation_score,
+            'profitability_score': row.profitability_score,
+            'growth_score': row.growth_score,
+            'momentum_score': row.momentum_score,
+            'total_score': row.total_score,
+            'grade': row.grade,
+            'created_at': now,
+            'updated_at': now
+        } for ticker_id, row in zip(scores.index, scores.itertuples(index=False))]
+
+        saved = 0
+        failed = []
+        for i in range(0, len(records), chunk_size):
+            chunk = records[i:i+chunk_size]
+            try:
+                ScoringService._upsert_scores(chunk)
+                db.session.commit()
+                saved += len(chunk)
+                continue
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error saving score chunk, retrying row by row: {e}")
+
+            for record in chunk:
+                try:
+                    ScoringService._upsert_scores([record])
+                    db.session.commit()
+                    saved += 1
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Error saving score for stock {record['ticker_id']}: {e}")
+                    failed.append(record['ticker_id'])
+
+        return saved, failed
+
+    @staticmethod
+    def score_sector(sector, date=None):
+        """
+        Scores every stock in a sector and bulk saves the results.
+        Returns (saved_count, failed_ticker_ids).
+        """
+        if date is None:
+            date = datetime.utcnow().date()
+
+        scores = ScoringService.compute_sector_scores(sector, date)
+        return ScoringService.save_scores(scores, date)
+
+    @staticmethod
+    def _save_day(frames, failed, date, dirty_before=None):
+        """
+        Bulk saves a day's sector score frames and reports failed tickers.
+        If `dirty_before` is given, dirty markers set before it are cleared for
+        every ticker that was saved.
+        Returns {'scored': count, 'failed': [tickers]}.
+        """
+        count = 0
+        if frames:
+            scores = pd.concat(frames)
+            count, failed_saves = ScoringService.save_scores(scores, date)
+            failed = failed + failed_saves
+            if dirty_before is not None:
+                saved_ids = set(scores.index.tolist()) - set(failed)
+                ScoringService.clear_dirty(saved_ids, dirty_before)
+
+        failed_tickers = []
+        if failed:
+            failed_tickers = sorted(t for (t,) in db.session.query(Stock.ticker).filter(Stock.id.in_(failed)))
+            print(f"Failed to score {len(failed_tickers)} stocks: {', '.join(failed_tickers)}")
+
+        return {'scored': count, 'failed': failed_tickers}
+
+    @staticmethod
+    def score_shard_results(results, date, dirty_before=None):
+        """
+        Ranks and saves the output of parallel shard loads (see
+        `plan_scoring_shards`). Each result is a dict with 'sector',
+        'ticker_ids' and either 'inputs' (from `dump_scoring_inputs`) or 'error'.
+        A sector with a failed shard is not ranked, since its peer set is
+        incomplete; its tickers are reported as failed.
+        """
+        sectors = {}
+        failed_sectors = set()
+        for result in results:
+            entry = sectors.setdefault(result['sector'], {'ticker_ids': [], 'dumps': []})
+            entry['ticker_ids'].extend(result['ticker_ids'])
+            if result.get('error'):
+                failed_sectors.add(result['sector'])
+            elif result.get('inputs') is not None:
+                entry['dumps'].append(result['inputs'])
+
+        frames = []
+        failed = []
+        for sector, entry in sectors.items():
+            ticker_ids = sorted(entry['ticker_ids'])
+            if sector in failed_sectors:
+                failed.extend(ticker_ids)
+                continue
+            inputs = ScoringService.merge_scoring_inputs(entry['dumps']) if entry['dumps'] else None
+            frames.append(ScoringService.rank_scoring_inputs(ticker_ids, inputs))
+
+        summary = ScoringService._save_day(frames, failed, date, dirty_before)
+        summary['sectors'] = len(sectors)
+        return summary
+
+    @staticmethod
+    def run_daily_scoring(date=None, full=False):
         """
         Runs scoring for all stocks in the database for the given date.
+
+        By default only sectors whose data changed since the previous scored
+        date are rescored (see `plan_daily_scoring`); the other sectors' scores
+        are copied forward. `full=True` rescores every sector.
+
+        Scores are computed sector by sector, collected for the whole day and
+        bulk saved. Stocks that could not be scored or saved are reported
+        separately instead of aborting the run.
+        Returns {'scored': count, 'copied': count, 'failed': [tickers]}.
         """
         if date is None:
             date = datetime.utcnow().date()
-            
-        stocks = Stock.query.all()
-        print(f"Starting daily scoring for {len(stocks)} stocks on {date}")
+
+        run_started = datetime.utcnow()
+        members, prev_date, to_copy = ScoringService.plan_daily_scoring(date, full)
+        mode = 'full' if prev_date is None else f'incremental since {prev_date}'
+        print(f"Starting daily scoring ({mode}) for {sum(len(ids) for ids in members.values())} stocks "
+              f"in {len(members)} sectors on {date}")
+
+        copied = 0
+        if to_copy:
+            copied = ScoringService.copy_forward_scores(prev_date, date, to_copy)
+            print(f"Copied forward {copied} unchanged scores")
         
-        count = 0
-        for stock in stocks:
+        frames = []
+        failed = []
+        for sector in members:
             try:
-                ScoringService.calculate_score(stock.id, date)
-                count += 1
-                if count % 100 == 0:
-                    print(f"Processed {count} stocks...")
+                frames.append(ScoringService.compute_sector_scores(sector, date))
             except Exception as e:
-                print(f"Error scoring stock {stock.symbol}: {e}")
+                db.session.rollback()
+                print(f"Error scoring sector {sector}: {e}")
+                failed.extend(members[sector])
                 continue
-                
-        print(f"Daily scoring completed. Processed {count} stocks.")
 
+        summary = ScoringService._save_day(frames, failed, date, dirty_before=run_started)
+        summary['copied'] = copied
+        print(f"Daily scoring completed. Processed {summary['scored']} stocks.")
+        return summary
+
+    # Incremental scoring
+    #
+    # Price and financial upserts mark their tickers dirty (mark_dirty) in the
+    # same transaction. A daily run rescores only sectors containing a dirty
+    # ticker and copies every other sector's scores forward, since with
+    # unchanged inputs the scores are unchanged too.
+
+    @staticmethod
+    def mark_dirty(ticker_ids):
+        """
+        Records that tickers received new price or financial rows.
+        Runs in the caller's transaction; the caller commits.
+        """
+        ticker_ids = sorted(set(int(tid) for tid in ticker_ids))
+        if not ticker_ids:
+            return
+
+        now = datetime.utcnow()
+        stmt = dialect_insert(DirtyTicker).values([{'ticker_id': tid, 'marked_at': now} for tid in ticker_ids])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['ticker_id'],
+            set_={'marked_at': stmt.excluded.marked_at}
+        )
+        db.session.execute(stmt)
+
+    @staticmethod
+    def clear_dirty(ticker_ids, before):
+        """
+        Clears dirty markers set before `before` (the start of a scoring run),
+        so rows ingested while the run was going stay marked.
+        """
+        ticker_ids = list(ticker_ids)
+        if not ticker_ids:
+            return
+        DirtyTicker.query.filter(
+            DirtyTicker.ticker_id.in_(ticker_ids),
+            DirtyTicker.marked_at <= before
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+    @staticmethod
+    def plan_daily_scoring(date, full=False):
+        """
+        Decides which sectors a daily run for `date` must rescore.
+
+        Rescored: sectors with a dirty ticker, and sectors with a stock that has
+        no score on the previous scored date (new listings, sector changes).
+        Everything is rescored when `full` is set or there is no previous date.
+
+        Returns ({sector: ticker_ids} to rescore, previous scored date or None,
+        ticker_ids whose scores are copied forward from it). Stocks already
+        scored on `date` are never copied over, so rerunning a day is safe.
+        """
+        members = ScoringService._sector_members()
+        if full:
+            return members, None, []
+
+        prev_date = db.session.query(func.max(StockScore.date)).filter(StockScore.date < date).scalar()
+        if prev_date is None:
+            return members, None, []
+
+        changed = {
+            sector for (sector,) in db.session.query(Stock.sector).join(
+                DirtyTicker, DirtyTicker.ticker_id == Stock.id
+            ).distinct()
+        }
+        unscored = db.session.query(Stock.sector).outerjoin(
+            StockScore,
+            (StockScore.ticker_id == Stock.id) & (StockScore.date == prev_date)
+        ).filter(StockScore.id.is_(None)).distinct()
+        changed.update(sector for (sector,) in unscored)
+
+        # A rerun of the day keeps the scores it already has: the first run
+        # cleared the dirty markers, so its rescored sectors look unchanged now
+        scored = {
+            tid for (tid,) in db.session.query(StockScore.ticker_id).filter(StockScore.date == date)
+        }
+        to_score = {sector: ids for sector, ids in members.items() if sector in changed}
+        to_copy = [
+            tid for sector, ids in members.items() if sector not in changed
+            for tid in ids if tid not in scored
+        ]
+        return to_score, prev_date, to_copy
+
+    @staticmethod
+    def copy_forward_scores(from_date, to_date, ticker_ids):
+        """
+        Copies the scores of `ticker_ids` on `from_date` to `to_date`.
+        Returns the number of scores saved.
+        """
+        rows = db.session.query(
+            StockScore.ticker_id,
+            StockScore.valuation_score,
+            StockScore.profitability_score,
+            StockScore.growth_score,
+            StockScore.momentum_score,
+            StockScore.total_score,
+            StockScore.grade
+        ).filter(
+            StockScore.date == from_date,
+            StockScore.ticker_id.in_(ticker_ids)
+        ).all()
+        if not rows:
+            return 0
+
+        columns = ['ticker_id'] + ScoringService.COMPONENTS + ['total_score', 'grade']
+        scores = pd.DataFrame(rows, columns=columns, dtype=object).set_index('ticker_id')
+        saved, failed = ScoringService.save_scores(scores, to_date)
+        if failed:
+            print(f"Failed to copy forward scores for {len(failed)} stocks")
+        return saved
+
+    # Historical backfill
+    #
+    # run_scoring_range loads each sector's financials and prices for the whole
+    # range once, then advances an as-of cursor day by day and ranks every
+    # date from in-memory arrays with the same rank_scoring_inputs step as the
+    # daily run.
+
+    @staticmethod
+    def _iter_financial_snapshots(ticker_ids, dates):
+        """
+        Yields (financials, growth) inputs as of each date in `dates` (ascending),
+        equivalent to `_load_latest_financials` / `_load_growth` on that date.
+        """
+        rows = db.session.query(
+            Financials.id,
+            Financials.ticker_id,
+            Financials.fiscal_date,
+            Financials.pe_ratio,
+            Financials.pb_ratio,
+            Financials.roe,
+            Financials.revenue,
+            Financials.eps
+        ).filter(
+            Financials.ticker_id.in_(ticker_ids),
+            Financials.fiscal_date <= dates[-1]
+        ).order_by(Financials.fiscal_date, Financials.id).all()
+
+        latest_date = {}
+        latest_rows = {}  # every row at the ticker's latest fiscal date
+        curr = {}
+        prev = {}
+        cursor = 0
+        financials = growth = None
+
+        for as_of in dates:
+            changed = False
+            # Rows arrive in (fiscal_date, id) order, so the last two applied per
+            # ticker are its top 2 by (fiscal_date desc, id desc)
+            while cursor < len(rows) and rows[cursor].fiscal_date <= as_of:
+                row = rows[cursor]
+                cursor += 1
+                changed = True
+                if latest_date.get(row.ticker_id) == row.fiscal_date:
+                    latest_rows[row.ticker_id].append(row)
+                else:
+                    latest_date[row.ticker_id] = row.fiscal_date
+                    latest_rows[row.ticker_id] = [row]
+                prev[row.ticker_id] = curr.get(row.ticker_id)
+                curr[row.ticker_id] = row
+
+            if changed or financials is None:
+                peer_rows = [r for tid in sorted(latest_rows) for r in latest_rows[tid]]
+                financials = pd.DataFrame({
+                    'id': [r.id for r in peer_rows],
+                    'pe_ratio': ScoringService._to_float([r.pe_ratio for r in peer_rows]),
+                    'pb_ratio': ScoringService._to_float([r.pb_ratio for r in peer_rows]),
+                    'roe': ScoringService._to_float([r.roe for r in peer_rows])
+                }, index=pd.Index([r.ticker_id for r in peer_rows], name='ticker_id'))
+
+                pairs = [tid for tid in sorted(curr) if prev[tid] is not None]
+                growth = pd.DataFrame({
+                    'rev_growth': ScoringService._growth_rates(
+                        [curr[t].revenue for t in pairs], [prev[t].revenue for t in pairs]),
+                    'eps_growth': ScoringService._growth_rates(
+                        [curr[t].eps for t in pairs], [prev[t].eps for t in pairs])
+                }, index=pd.Index(pairs, dtype=int, name='ticker_id'))
+
+            yield financials, growth
+
+    @staticmethod
+    def _iter_momentum_snapshots(ticker_ids, dates):
+        """
+        Yields momentum inputs as of the end of each date in `dates` (ascending),
+        equivalent to `_load_momentum` on that date.
+        """
+        window = ScoringService.PRICE_WINDOW
+        first_ref = ScoringService._end_of_day(dates[0])
+        last_ref = ScoringService._end_of_day(dates[-1])
+
+        # Last 200 bars before the range, then every bar inside it
+        ticker_ids, base_dates, base_closes = ScoringService.load_price_matrix(ticker_ids, first_ref)
+        rows = db.session.query(
+            StockPrice.ticker_id,
+            StockPrice.timestamp,
+            db.cast(StockPrice.close, db.Float)
+        ).filter(
+            StockPrice.ticker_id.in_(ticker_ids.tolist()),
+            StockPrice.timestamp > first_ref,
+            StockPrice.timestamp <= last_ref
+        ).order_by(StockPrice.ticker_id, StockPrice.timestamp).all()
+
+        df = pd.DataFrame(rows, columns=['ticker_id', 'timestamp', 'close'])
+        position = df.groupby('ticker_id').cumcount().to_numpy(dtype=int)
+        n_range = int(position.max()) + 1 if len(df) else 0
+
+        # Row layout: [left padding | bars up to the range | bars in the range | NaT]
+        closes = np.full((len(ticker_ids), window + n_range), np.nan)
+        bar_dates = np.full(closes.shape, np.datetime64('NaT'), dtype='datetime64[ns]')
+        closes[:, :window] = base_closes
+        bar_dates[:, :window] = base_dates
+        if len(df):
+            row_idx = ticker_ids.get_indexer(df['ticker_id'])
+            closes[row_idx, window + position] = df['close'].to_numpy(dtype=float, na_value=np.nan)
+            bar_dates[row_idx, window + position] = pd.to_datetime(df['timestamp']).to_numpy(dtype='datetime64[ns]')
+
+        rows_idx = np.arange(len(ticker_ids))
+        # cursor[i] = number of columns of row i at or before the as-of time
+        cursor = np.full(len(ticker_ids), window)
+        offsets = np.arange(-window, 0)
+        for as_of in dates:
+            ref = np.datetime64(ScoringService._end_of_day(as_of))
+            while True:
+                nxt = np.minimum(cursor, closes.shape[1] - 1)
+                advance = (cursor < closes.shape[1]) & (bar_dates[rows_idx, nxt] <= ref)
+                if not advance.any():
+                    break
+                cursor += advance
+
+            cols = cursor[:, None] + offsets
+            window_closes = np.where(cols >= 0, closes[rows_idx[:, None], np.maximum(cols, 0)], np.nan)
+            window_dates = np.where(cols >= 0, bar_dates[rows_idx[:, None], np.maximum(cols, 0)], np.datetime64('NaT'))
+            yield ScoringService._momentum_frame(ticker_ids, window_dates, window_closes)
+
+    @staticmethod
+    def run_scoring_range(start, end):
+        """
+        Backfills scores for every weekday from `start` to `end` (inclusive).
+        Financials and prices for the range are loaded once per sector instead
+        of once per date; results match run_daily_scoring on each date.
+        Returns {'dates': count, 'scored': count, 'failed': [tickers]}.
+        """
+        dates = [ts.date() for ts in pd.bdate_range(start, end)]
+        if not dates:
+            return {'dates': 0, 'scored': 0, 'failed': []}
+
+        members = ScoringService._sector_members()
+        print(f"Starting scoring backfill for {len(dates)} dates ({dates[0]} - {dates[-1]}) over {len(members)} sectors")
+
+        frames = {as_of: [] for as_of in dates}
+        failed = set()
+        for sector, ticker_ids in members.items():
+            try:
+                # Stocks without a sector have no peers to rank against
+                if not sector:
+                    empty = ScoringService.rank_scoring_inputs(ticker_ids, None)
+                    for as_of in dates:
+                        frames[as_of].append(empty)
+                    continue
+
+                snapshots = zip(
+                    dates,
+                    ScoringService._iter_financial_snapshots(ticker_ids, dates),
+                    ScoringService._iter_momentum_snapshots(ticker_ids, dates)
+                )
+                for as_of, (financials, growth), momentum in snapshots:
+                    inputs = {'financials': financials, 'growth': growth, 'momentum': momentum}
+                    frames[as_of].append(ScoringService.rank_scoring_inputs(ticker_ids, inputs))
+                print(f"Scored sector {sector} ({len(ticker_ids)} stocks)")
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error scoring sector {sector}: {e}")
+                failed.update(ticker_ids)
+                for as_of in dates:
+                    frames[as_of] = [f for f in frames[as_of] if not f.index.isin(ticker_ids).any()]
+
+        count = 0
+        for as_of in dates:
+            if not frames[as_of]:
+                continue
+            saved, failed_saves = ScoringService.save_scores(pd.concat(frames[as_of]), as_of)
+            count += saved
+            failed.update(failed_saves)
+
+        failed_tickers = []
+        if failed:
+            failed_tickers = sorted(t for (t,) in db.session.query(Stock.ticker).filter(Stock.id.in_(failed)))
+            print(f"Failed to score {len(failed_tickers)} stocks: {', '.join(failed_tickers)}")
+
+        print(f"Scoring backfill completed. Saved {count} scores.")
+        return {'dates': len(dates), 'scored': count, 'failed': failed_tickers}
@@ -0,0 +1,60 @@
+from sqlalchemy import func, literal_column, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+
+
+def dialect_insert(model):
+    """
+    Returns an `insert()` for the model that supports `on_conflict_do_update`
+    on the bound database: PostgreSQL in production, SQLite in tests.
+    """
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return sqlite.insert(model)
+    return postgresql.insert(model)
+
+
+def changed(stmt, columns):
+    """
+    WHERE clause for `on_conflict_do_update`: only rows where one of
+    `columns` differs from the incoming value (NULL-safe) are updated, so
+    re-upserting identical data leaves the rows alone (no dead tuples or WAL).
+    """
+    return or_(*(stmt.table.c[col].is_distinct_from(stmt.excluded[col]) for col in columns))
+
+
+def upsert_counts():
+    return {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+
+def execute_upsert(stmt, count, counts=None, written=None, key='ticker_id'):
+    """
+    Executes an INSERT ... ON CONFLICT DO UPDATE ... WHERE changed(...) of
+    `count` rows and adds its outcome to `counts` (see upsert_counts).
+    Rows skipped by the WHERE clause are unchanged. With a `written` set, the
+    `key` column of every inserted or updated row is added to it.
+    Returns `counts`.
+    """
+    if counts is None:
+        counts = upsert_counts()
+
+    # Written rows' keys, or a constant when nobody asked for them
+    returned = stmt.table.c[key] if written is not None else literal_column('1')
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # xmax is 0 on a row version created by an INSERT
+        rows = db.session.execute(stmt.returning(literal_column('xmax = 0'), returned)).all()
+        inserted = sum(1 for flag, _ in rows if flag)
+        keys = [value for _, value in rows]
+    else:
+        # SQLite reports inserts and updates together; tell them apart by the row count
+        total = select(func.count()).select_from(stmt.table)
+        before = db.session.execute(total).scalar()
+        keys = db.session.execute(stmt.returning(returned)).scalars().all()
+        inserted = db.session.execute(total).scalar() - before
+    updated = len(keys) - inserted
+
+    if written is not None:
+        written.update(keys)
+    counts['inserted'] += inserted
+    counts['updated'] += updated
+    counts['unchanged'] += count - inserted - updated
+    return counts
@@ -1,22 +1,86 @@
 import logging
 import time
-from app import celery
+from datetime import datetime, date, timedelta
+import pandas as pd
+from celery import chord, group
+from flask import current_app
+from app import celery, db
 from app.services.market_data import KoreanMarketService, USMarketService
 from app.services.financial_service import KoreanFinancialService, USFinancialService
 from app.services.scoring_service import ScoringService
+from app.services.indicator_service import IndicatorService
+from app.services.ingestion import PricePipeline
+from app.services.checkpoint import CheckpointService
+from app.services.price_gaps import PriceGapService
+from app.services.response_cache import ResponseCache
 
 @celery.task
-def update_stock_scores():
+def update_stock_scores(score_date=None, full=False):
     """
     Task to update daily stock scores for all stocks.
+    Only sectors with new prices or financials are rescored unless `full` is
+    set; unchanged sectors have their previous scores copied forward.
+    Fans out one subtask per sector (or per shard of a very large sector) as a
+    Celery chord; the callback ranks each sector, saves the scores and records
+    the totals.
     """
     logger.info("Starting update_stock_scores task")
     try:
-        ScoringService.run_daily_scoring()
-        logger.info("Completed update_stock_scores task")
+        if score_date is None:
+            score_date = datetime.utcnow().date().isoformat()
+
+        run_started = datetime.utcnow().isoformat()
+        members, prev_date, to_copy = ScoringService.plan_daily_scoring(date.fromisoformat(score_date), full)
+        if to_copy:
+            copied = ScoringService.copy_forward_scores(prev_date, date.fromisoformat(score_date), to_copy)
+            logger.info(f"Copied forward {copied} unchanged scores from {prev_date}")
+
+        shards = ScoringService.plan_scoring_shards(members=members)
+        if not shards:
+            logger.info(f"No sectors changed since {prev_date}; nothing to rescore")
+            return
+
+        header = group(
+            load_scoring_shard.s(sector, ticker_ids, score_date)
+            for sector, ticker_ids in shards
+        )
+        chord(header)(finalize_stock_scores.s(score_date, run_started))
+        logger.info(f"Dispatched {len(shards)} scoring shards for {score_date}")
     except Exception as e:
         logger.error(f"Error in update_stock_scores task: {e}")
 
+@celery.task
+def load_scoring_shard(sector, ticker_ids, score_date):
+    """
+    Loads the scoring inputs of one sector shard.
+    Errors are returned instead of raised so the chord callback still runs.
+    """
+    try:
+        inputs = None
+        # Stocks without a sector have no peers to rank against
+        if sector:
+            inputs = ScoringService.dump_scoring_inputs(
+                ScoringService.load_scoring_inputs(ticker_ids, date.fromisoformat(score_date))
+            )
+        return {'sector': sector, 'ticker_ids': ticker_ids, 'inputs': inputs}
+    except Exception as e:
+        logger.error(f"Error loading scoring shard for sector {sector}: {e}")
+        return {'sector': sector, 'ticker_ids': ticker_ids, 'error': str(e)}
+
+@celery.task
+def finalize_stock_scores(results, score_date, run_started=None):
+    """
+    Chord callback: ranks every sector from its shards and bulk saves the scores.
+    Dirty markers set before `run_started` are cleared for the saved tickers.
+    """
+    dirty_before = datetime.fromisoformat(run_started) if run_started else None
+    summary = ScoringService.score_shard_results(results, date.fromisoformat(score_date), dirty_before)
+    logger.info(
+        f"Completed update_stock_scores task for {score_date}: "
+        f"{summary['scored']} scored, {len(summary['failed'])} failed, {summary['sectors']} sectors"
+    )
+    return summary
+
 from app.models.stock import Stock
 
 logger = logging.getLogger(__name__)
@@ -34,36 +98,151 @@ def update_kr_stocks():
     except Exception as e:
         logger.error(f"Error in update_kr_stocks task: {e}")
 
+# Seconds between PROGRESS state updates of a price chunk
+PROGRESS_INTERVAL = 1.0
+
+# Market -> (price service, Celery queue). Each market's collectors run on
+# their own queue so a long KRX backfill never holds up the US updates.
+MARKETS = {
+    'kr': (KoreanMarketService, 'kr_io'),
+    'us': (USMarketService, 'us_io'),
+}
+
+def chunked(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def dispatch_chunks(task, chunks, queue, callback):
+    """
+    Runs `task` once per chunk as a Celery chord on `queue`; `callback`
+    receives the list of chunk results. Returns the number of chunks.
+    """
+    if not chunks:
+        return 0
+    header = group(task.s(*args).set(queue=queue) for args in chunks)
+    chord(header)(callback)
+    return len(chunks)
+
+def merge_chunk_summaries(results):
+    """
+    Adds up chunk summaries: counts are summed, lists concatenated, and
+    chunks that failed outright are counted in 'errors'.
+    """
+    summary = {'chunks': len(results), 'errors': 0}
+    for result in results:
+        for key, value in result.items():
+            if key == 'error':
+                summary['errors'] += 1
+            elif isinstance(value, list):
+                summary.setdefault(key, []).extend(value)
+            else:
+                summary[key] = summary.get(key, 0) + value
+    return summary
+
+def dispatch_price_chunks(market, stocks):
+    """
+    Fans the price update of `stocks` ((stock_id, ticker) pairs) out as
+    COLLECTOR_CHUNK_SIZE-stock subtasks on the market's queue. All chunks
+    share the market's run id for the day, so a rerun skips finished stocks.
+    """
+    _, queue = MARKETS[market]
+    run_id = CheckpointService.run_id(f"{market}_prices")
+    chunks = [(market, chunk, run_id) for chunk in chunked([list(s) for s in stocks],
+                                                            current_app.config['COLLECTOR_CHUNK_SIZE'])]
+    count = dispatch_chunks(update_prices_chunk, chunks, queue, finalize_price_chunks.s(market, run_id))
+    logger.info(f"Dispatched {count} {market} price chunks for {len(stocks)} stocks")
+    return count
+
 @celery.task
 def update_kr_prices():
     """
     Task to update OHLCV for all Korean stocks.
+    Stocks that are up to date get the missing days from whole-market daily
+    snapshots; new listings and long gaps are fetched per ticker in chunked
+    subtasks on the kr_io queue.
     """
     logger.info("Starting update_kr_prices task")
     try:
-        # Filter for relevant markets
-        stocks = Stock.query.filter(Stock.market.in_(['KOSPI', 'KOSDAQ', 'KRX', 'KONEX'])).all()
+        stocks = Stock.query.filter(Stock.market.in_(KoreanMarketService.MARKETS)).all()
         logger.info(f"Found {len(stocks)} stocks to update.")
-        
-        count = 0
-        for stock in stocks:
-            try:
-                KoreanMarketService.update_prices(stock.id, stock.ticker)
-                count += 1
-                if count % 100 == 0:
-                    logger.info(f"Updated {count} stocks...")
-                
-                # Small delay to be polite to data sources
-                time.sleep(0.1)
-                
-            except Exception as e:
-                logger.error(f"Failed to update prices for {stock.ticker}: {e}")
-                continue
-        
-        logger.info("Completed update_kr_prices task")
+
+        daily = KoreanMarketService.update_prices_by_date([(s.id, s.ticker) for s in stocks])
+        logger.info(
+            f"Loaded {daily['rows']} rows ({daily['inserted']} new, {daily['updated']} changed) "
+            f"from {daily['dates']} KR market snapshots; "
+            f"{len(daily['backfill'])} stocks need a per-ticker backfill"
+        )
+
+        dispatch_price_chunks('kr', daily['backfill'])
     except Exception as e:
         logger.error(f"Error in update_kr_prices task: {e}")
 
+@celery.task(bind=True, acks_late=True)
+def update_prices_chunk(self, market, stocks, run_id=None):
+    """
+    Updates prices for one chunk of (stock_id, ticker) pairs, fetching
+    concurrently within the source's rate limit.
+    Acknowledged only once finished, so a chunk lost with its worker is
+    redelivered; stocks checkpointed under `run_id` are then skipped.
+    Reports {'run_id', 'done', 'failed', 'remaining'} as PROGRESS state.
+    Errors are returned instead of raised so the chord callback still runs.
+    """
+    last_report = [0.0]
+
+    def progress(counts):
+        # At most one result backend write per second; the last one always goes out
+        now = time.monotonic()
+        if self.request.id and (now - last_report[0] >= PROGRESS_INTERVAL or not counts['remaining']):
+            last_report[0] = now
+            self.update_state(state='PROGRESS', meta=dict(counts, run_id=run_id))
+
+    try:
+        service, _ = MARKETS[market]
+        return PricePipeline.for_service(service).run(stocks, run_id=run_id, progress=progress)
+    except Exception as e:
+        logger.error(f"Error updating a chunk of {len(stocks)} {market} stocks: {e}")
+        return {'stocks': len(stocks), 'rows': 0, 'failed': [ticker for _, ticker in stocks], 'error': str(e)}
+
+@celery.task
+def finalize_price_chunks(results, market, run_id=None):
+    """
+    Chord callback: totals of a chunked price update. With a `run_id`, the
+    run's checkpoint counts (including earlier attempts of the day) are
+    reported as 'run'.
+    """
+    summary = merge_chunk_summaries(results)
+    if run_id:
+        summary['run'] = dict(CheckpointService.progress(run_id), run_id=run_id)
+        logger.info(f"Run {run_id}: {summary['run']['done']} stocks done, {summary['run']['failed']} failed")
+    logger.info(
+        f"Completed {market} price update: {summary.get('stocks', 0)} stocks, "
+        f"{summary.get('rows', 0)} rows ({summary.get('inserted', 0)} new, {summary.get('updated', 0)} changed, "
+        f"{summary.get('unchanged', 0)} unchanged), {len(summary.get('failed', []))} failed, "
+        f"{summary.get('skipped', 0)} already done, {summary['errors']}/{summary['chunks']} chunks errored"
+    )
+    return summary
+
+@celery.task
+def repair_price_gaps(market, since=None):
+    """
+    Task to refetch the trading days missing in the middle of a market's
+    price series (see PriceGapService). Looks back PRICE_GAP_LOOKBACK_DAYS
+    unless `since` (ISO date) is given.
+    """
+    logger.info(f"Starting repair_price_gaps task for {market}")
+    try:
+        service, _ = MARKETS[market]
+        if since is None:
+            start = datetime.utcnow() - timedelta(days=current_app.config['PRICE_GAP_LOOKBACK_DAYS'])
+        else:
+            start = datetime.fromisoformat(since)
+        summary = PriceGapService.repair_gaps(service, start)
+        logger.info(
+            f"Completed repair_price_gaps task for {market}: {summary['gaps']} gaps "
+            f"({summary['days']} days), {summary['inserted']} rows filled, {len(summary['failed'])} failed"
+        )
+        return summary
+    except Exception as e:
+        logger.error(f"Error in repair_price_gaps task: {e}")
 
 @celery.task
 def update_us_stocks():
@@ -76,26 +255,16 @@ def update_us_stocks():
 
 @celery.task
 def update_us_prices():
+    """
+    Task to update OHLCV for S&P 500 stocks.
+    Fans out chunked subtasks on the us_io queue.
+    """
     logger.info("Starting update_us_prices task")
     try:
-        stocks = Stock.query.filter(Stock.market == 'S&P 500').all()
+        stocks = Stock.query.filter(Stock.market.in_(USMarketService.MARKETS)).all()
         logger.info(f"Found {len(stocks)} US stocks to update.")
-        
-        count = 0
-        for stock in stocks:
-            try:
-                USMarketService.update_prices(stock.id, stock.ticker)
-                count += 1
-                if count % 50 == 0:
-                    logger.info(f"Updated {count} US stocks...")
-                
-                time.sleep(0.5)
-                
-            except Exception as e:
-                logger.error(f"Failed to update prices for {stock.ticker}: {e}")
-                continue
-        
-        logger.info("Completed update_us_prices task")
+
+        dispatch_price_chunks('us', [(s.id, s.ticker) for s in stocks])
     except Exception as e:
         logger.error(f"Error in update_us_prices task: {e}")
 
@@ -111,30 +280,109 @@ def update_kr_financials():
     except Exception as e:
         logger.error(f"Error in update_kr_financials task: {e}")
 
+@celery.task
+def backfill_kr_financials(start_date, end_date):
+    """
+    Task to load point-in-time KR fundamentals for every weekday from
+    `start_date` to `end_date` (ISO dates), e.g. for backtests.
+    """
+    logger.info(f"Starting backfill_kr_financials task for {start_date} - {end_date}")
+    try:
+        dates = pd.bdate_range(start_date, end_date).date
+        summary = KoreanFinancialService.backfill_financials(list(dates))
+        logger.info(
+            f"Completed backfill_kr_financials task: {summary['dates']} dates, "
+            f"{summary['rows']} rows, {len(summary['failed'])} failed dates"
+        )
+        return summary
+    except Exception as e:
+        logger.error(f"Error in backfill_kr_financials task: {e}")
+
 @celery.task
 def update_us_financials():
     """
     Task to update financials for US stocks.
+    Fans out chunked subtasks on the us_io queue.
     """
     logger.info("Starting update_us_financials task")
     try:
         stocks = Stock.query.filter(Stock.market == 'S&P 500').all()
         logger.info(f"Found {len(stocks)} US stocks to update financials.")
-        
-        count = 0
-        for stock in stocks:
-            try:
-                USFinancialService.update_financials(stock.id, stock.ticker)
-                count += 1
-                if count % 50 == 0:
-                    logger.info(f"Updated financials for {count} US stocks...")
-                
-                time.sleep(1.0)
-                
-            except Exception as e:
-                logger.error(f"Failed to update financials for {stock.ticker}: {e}")
-                continue
-        
-        logger.info("Completed update_us_financials task")
+
+        _, queue = MARKETS['us']
+        chunks = [(chunk,) for chunk in chunked([[s.id, s.ticker] for s in stocks],
+                                                current_app.config['COLLECTOR_CHUNK_SIZE'])]
+        count = dispatch_chunks(update_us_financials_chunk, chunks, queue, finalize_financial_chunks.s('us'))
+        logger.info(f"Dispatched {count} us financials chunks for {len(stocks)} stocks")
     except Exception as e:
         logger.error(f"Error in update_us_financials task: {e}")
+
+@celery.task
+def update_us_financials_chunk(stocks):
+    """
+    Updates financials for one chunk of (stock_id, ticker) pairs, fetching
+    concurrently within the yfinance rate limit.
+    Returns {'stocks': count, 'failed': [tickers]}.
+    """
+    try:
+        return USFinancialService.update_financials_batch(stocks)
+    except Exception as e:
+        logger.error(f"Error updating financials for a chunk of {len(stocks)} US stocks: {e}")
+        return {'stocks': len(stocks), 'failed': [ticker for _, ticker in stocks], 'error': str(e)}
+
+@celery.task
+def finalize_financial_chunks(results, market):
+    """
+    Chord callback: totals of a chunked financials update.
+    """
+    summary = merge_chunk_summaries(results)
+    logger.info(
+        f"Completed {market} financials update: {summary.get('stocks', 0)} stocks "
+        f"({summary.get('inserted', 0)} rows new, {summary.get('updated', 0)} changed, "
+        f"{summary.get('unchanged', 0)} unchanged), {len(summary.get('failed', []))} failed"
+    )
+    return summary
+
+@celery.task
+def rebuild_indicator_states(missing_only=False):
+    """
+    Task to rebuild the Wilder RSI state of every stock from its price history.
+    Run once right after switching RSI_METHOD to 'wilder' (price writes only
+    advance existing states while it is set). With `missing_only`, as
+    scheduled nightly, only stocks without a state (new listings, and states dropped
+    by backfills or corrections of older bars) are seeded,
+    and only while RSI_METHOD is 'wilder'.
+    """
+    logger.info("Starting rebuild_indicator_states task")
+    try:
+        if missing_only:
+            if not IndicatorService.enabled():
+                return
+            ticker_ids = IndicatorService.missing_states()
+        else:
+            ticker_ids = [stock_id for (stock_id,) in db.session.query(Stock.id).order_by(Stock.id)]
+        count = IndicatorService.rebuild_states(ticker_ids)
+        logger.info(f"Completed rebuild_indicator_states task: {count}/{len(ticker_ids)} stocks")
+    except Exception as e:
+        logger.error(f"Error in rebuild_indicator_states task: {e}")
+
+@celery.task
+def evict_response_cache():
+    """
+    Task to delete expired entries from the raw provider response cache.
+    Recorded responses are kept in replay mode. Runs when the cache is off
+    too, for the entries cached with their own TTL (e.g. US_INFO_CACHE_TTL).
+    """
+    cache = ResponseCache.from_config()
+    if cache.mode == 'replay':
+        return
+    removed = cache.evict()
+    logger.info(f"Evicted {removed} expired response cache entries")
+
+@celery.task
+def purge_collector_checkpoints():
+    """
+    Task to delete collector checkpoints of past runs.
+    """
+    removed = CheckpointService.purge()
+    logger.info(f"Purged {removed} collector checkpoints")
@@ -0,0 +1,79 @@
+"""
+End-to-end price ingestion throughput against the synthetic provider: no
+network, deterministic data, optional per-request latency and failures.
+
+Runs on an in-memory SQLite database unless DATABASE_URL is set:
+
+    python benchmarks/bench_ingestion.py --tickers 500 --days 500 --latency 0.05 --error-rate 0.02
+
+Stocks are created for the synthetic KR tickers (900000...) and, on a real
+database, removed again.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import create_app, db
+from app.models.stock import Stock
+from app.models.price import StockPrice
+from app.models.dirty_ticker import DirtyTicker
+from app.models.indicator_state import IndicatorState
+from app.models.collector_checkpoint import CollectorCheckpoint
+from app.services.ingestion import PricePipeline
+from app.services.market_data import KoreanMarketService
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=500)
+    parser.add_argument('--days', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--rate', type=float, default=1000)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    app = create_app('production' if os.environ.get('DATABASE_URL') else 'testing')
+    app.config.update({
+        'MARKET_DATA_PROVIDER': 'synthetic',
+        'SYNTHETIC_PROVIDER': {
+            'tickers': args.tickers, 'days': args.days, 'seed': args.seed,
+            'latency': args.latency, 'error_rate': args.error_rate, 'end_date': None
+        }
+    })
+    with app.app_context():
+        if not os.environ.get('DATABASE_URL'):
+            db.create_all()
+
+        listing = KoreanMarketService.fetch_tickers()
+        stocks = [Stock(ticker=row.Code, name=row.Name, market=row.Market) for row in listing.itertuples()]
+        db.session.add_all(stocks)
+        db.session.commit()
+        ids = [s.id for s in stocks]
+        jobs = [(s.id, s.ticker, '2000-01-01') for s in stocks]
+
+        pipeline = PricePipeline(KoreanMarketService, rate=args.rate, workers=args.workers,
+                                 batch_size=args.batch_size)
+        try:
+            started = time.perf_counter()
+            summary = pipeline.run(jobs)
+            elapsed = time.perf_counter() - started
+            print(f"{summary['stocks']} stocks, {len(summary['failed'])} failed, {summary['rows']} rows "
+                  f"in {elapsed:.2f}s: {summary['stocks'] / elapsed:,.1f} stocks/s, "
+                  f"{summary['rows'] / elapsed:,.0f} rows/s")
+        finally:
+            db.session.rollback()
+            # Everything the writes left behind that references the stocks
+            for model in (StockPrice, DirtyTicker, IndicatorState, CollectorCheckpoint):
+                model.query.filter(model.ticker_id.in_(ids)).delete(synchronize_session=False)
+            Stock.query.filter(Stock.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Compares stock_prices upsert throughput: multi-row INSERT ... ON CONFLICT
+(the pre-COPY path) against PriceLoader (COPY into a staging table + merge).
+
+Needs a PostgreSQL/TimescaleDB database with the schema migrated:
+
+    DATABASE_URL=postgresql://... python benchmarks/bench_price_loader.py --tickers 50 --days 2500
+
+Synthetic stocks BENCH0000... are created and removed again.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import create_app, db
+from app.models.stock import Stock
+from app.models.price import StockPrice
+from app.services.market_data import insert_prices
+from app.services.price_loader import PriceLoader
+
+
+def make_rows(ticker_ids, days, seed):
+    rng = np.random.default_rng(seed)
+    start = datetime(2000, 1, 3)
+    rows = []
+    for ticker_id in ticker_ids:
+        closes = np.round(100 * np.cumprod(1 + rng.normal(0, 0.02, days)), 2)
+        for d, close in enumerate(closes.tolist()):
+            rows.append((start + timedelta(days=d), ticker_id, close, close, close, close, 1000))
+    return rows
+
+
+def timed(label, load, rows):
+    started = time.perf_counter()
+    load(rows)
+    db.session.commit()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {len(rows):>9} rows {elapsed:>8.2f}s {len(rows) / elapsed:>12,.0f} rows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=50)
+    parser.add_argument('--days', type=int, default=2500)
+    args = parser.parse_args()
+
+    app = create_app('production')
+    with app.app_context():
+        if not PriceLoader.supported():
+            sys.exit("PriceLoader needs PostgreSQL; set DATABASE_URL")
+
+        stocks = [Stock(ticker=f"BENCH{i:04d}", name="Benchmark", market="BENCH") for i in range(args.tickers)]
+        db.session.add_all(stocks)
+        db.session.commit()
+        ids = [s.id for s in stocks]
+        half = len(ids) // 2
+        try:
+            # Fresh rows (first-time backfill), then the same rows again (all conflicts)
+            for label, seed in [("insert", 1), ("upsert existing", 2)]:
+                timed(f"INSERT ... VALUES {label}", insert_prices, make_rows(ids[:half], args.days, seed))
+                timed(f"COPY + merge {label}", PriceLoader.load, make_rows(ids[half:], args.days, seed))
+        finally:
+            db.session.rollback()
+            StockPrice.query.filter(StockPrice.ticker_id.in_(ids)).delete(synchronize_session=False)
+            Stock.query.filter(Stock.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
@@ -22,6 +22,16 @@ accept_content = ['json']
 timezone = 'UTC'
 enable_utc = True
 
+# Collector queues: network-bound KRX and US tasks run on their own workers
+# (kr_io, us_io) so one market's backfill cannot starve the other. Chunked
+# price subtasks are sent to their market's queue when dispatched. Scoring
+# and maintenance tasks stay on the default queue.
+task_routes = {
+    'app.tasks.collector.update_kr_*': {'queue': 'kr_io'},
+    'app.tasks.collector.backfill_kr_*': {'queue': 'kr_io'},
+    'app.tasks.collector.update_us_*': {'queue': 'us_io'},
+}
+
 # Beat Schedule - Run daily at 00:00 UTC
 beat_schedule = {
     # Stock list updates (run first - fast)
@@ -44,6 +54,20 @@ beat_schedule = {
         'schedule': crontab(hour=0, minute=10),
     },
     
+    # Price gap repair (weekly, Sunday, after the daily price updates)
+    'repair-kr-price-gaps': {
+        'task': 'app.tasks.collector.repair_price_gaps',
+        'schedule': crontab(hour=0, minute=20, day_of_week='sun'),
+        'args': ('kr',),
+        'options': {'queue': 'kr_io'},
+    },
+    'repair-us-price-gaps': {
+        'task': 'app.tasks.collector.repair_price_gaps',
+        'schedule': crontab(hour=0, minute=25, day_of_week='sun'),
+        'args': ('us',),
+        'options': {'queue': 'us_io'},
+    },
+
     # Financial updates (run after prices - medium)
     'update-kr-financials': {
         'task': 'app.tasks.collector.update_kr_financials',
@@ -54,9 +78,26 @@ beat_schedule = {
         'schedule': crontab(hour=0, minute=45),
     },
     
+    # RSI states of new listings (no-op unless RSI_METHOD is 'wilder')
+    'seed-indicator-states': {
+        'task': 'app.tasks.collector.rebuild_indicator_states',
+        'schedule': crontab(hour=0, minute=55),
+        'kwargs': {'missing_only': True},
+    },
+
     # Score calculation (run last - depends on all data being updated)
     'update-stock-scores': {
         'task': 'app.tasks.collector.update_stock_scores',
         'schedule': crontab(hour=1, minute=0),
     },
+
+    # Response cache cleanup (no-op unless RESPONSE_CACHE_MODE is set)
+    'evict-response-cache': {
+        'task': 'app.tasks.collector.evict_response_cache',
+        'schedule': crontab(hour=23, minute=30),
+    },
+    'purge-collector-checkpoints': {
+        'task': 'app.tasks.collector.purge_collector_checkpoints',
+        'schedule': crontab(hour=23, minute=40),
+    },
 }
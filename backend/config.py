@@ -17,6 +17,76 @@ class Config:
     CACHE_TYPE = "RedisCache"
     CACHE_REDIS_URL = REDIS_URL
 
+    # RSI used by momentum scoring: 'sma' (rolling mean over the last 14 bars)
+    # or 'wilder' (persisted incremental state, see IndicatorService)
+    RSI_METHOD = os.environ.get('RSI_METHOD', 'sma')
+
+    # Raw provider response cache (see ResponseCache): 'off', 'on' or 'replay'
+    RESPONSE_CACHE_MODE = os.environ.get('RESPONSE_CACHE_MODE', 'off')
+    RESPONSE_CACHE_DIR = os.environ.get('RESPONSE_CACHE_DIR', os.path.join(os.getcwd(), '.response_cache'))
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 6 * 3600))
+
+    # Market data source (see app.services.providers): 'live' or 'synthetic'.
+    # The synthetic provider serves deterministic local data for load tests,
+    # with optional per-request latency (seconds) and failure rate.
+    MARKET_DATA_PROVIDER = os.environ.get('MARKET_DATA_PROVIDER', 'live')
+    SYNTHETIC_PROVIDER = {
+        'tickers': int(os.environ.get('SYNTHETIC_TICKERS', 500)),
+        'days': int(os.environ.get('SYNTHETIC_DAYS', 500)),
+        'seed': int(os.environ.get('SYNTHETIC_SEED', 42)),
+        'latency': float(os.environ.get('SYNTHETIC_LATENCY', 0.0)),
+        'error_rate': float(os.environ.get('SYNTHETIC_ERROR_RATE', 0.0)),
+        'end_date': os.environ.get('SYNTHETIC_END_DATE'),
+    }
+
+    # Price ingestion throughput per data source: requests per second (the
+    # ceiling; the rate backs off to min_rate under throttling), burst size,
+    # concurrent fetches, rows per database write batch, tickers per request
+    # for sources with a multi-ticker download, seconds without requests once
+    # throttling persists, and retries per throttled stock. Limits apply per
+    # worker process, so the source sees them times the kr_io/us_io concurrency.
+    INGESTION_LIMITS = {
+        'fdr': {
+            'rate': float(os.environ.get('FDR_RATE', 10)),
+            'burst': int(os.environ.get('FDR_BURST', 10)),
+            'workers': int(os.environ.get('FDR_WORKERS', 8)),
+            'batch_size': int(os.environ.get('FDR_BATCH_SIZE', 5000)),
+            'group_size': 1,
+            'min_rate': float(os.environ.get('FDR_MIN_RATE', 1)),
+            'cooldown': float(os.environ.get('FDR_COOLDOWN', 30)),
+            'max_retries': int(os.environ.get('FDR_MAX_RETRIES', 2)),
+        },
+        'yfinance': {
+            'rate': float(os.environ.get('YFINANCE_RATE', 2)),
+            'burst': int(os.environ.get('YFINANCE_BURST', 4)),
+            'workers': int(os.environ.get('YFINANCE_WORKERS', 4)),
+            'batch_size': int(os.environ.get('YFINANCE_BATCH_SIZE', 5000)),
+            'group_size': int(os.environ.get('YFINANCE_GROUP_SIZE', 50)),
+            'min_rate': float(os.environ.get('YFINANCE_MIN_RATE', 0.2)),
+            'cooldown': float(os.environ.get('YFINANCE_COOLDOWN', 60)),
+            'max_retries': int(os.environ.get('YFINANCE_MAX_RETRIES', 2)),
+        },
+        # Whole-market KRX calls (fundamentals backfill)
+        'pykrx': {
+            'rate': float(os.environ.get('PYKRX_RATE', 2)),
+            'burst': int(os.environ.get('PYKRX_BURST', 2)),
+            'workers': int(os.environ.get('PYKRX_WORKERS', 4)),
+            'min_rate': float(os.environ.get('PYKRX_MIN_RATE', 0.2)),
+            'cooldown': float(os.environ.get('PYKRX_COOLDOWN', 60)),
+        },
+    }
+
+    # US fundamentals: stocks fetched concurrently (statements and info in
+    # parallel for each), and how long a ticker's info is reused (seconds, 0 = always refetch)
+    US_FINANCIALS_WORKERS = int(os.environ.get('US_FINANCIALS_WORKERS', 4))
+    US_INFO_CACHE_TTL = int(os.environ.get('US_INFO_CACHE_TTL', 6 * 3600))
+
+    # Stocks per collector subtask (price and financials fan-out)
+    COLLECTOR_CHUNK_SIZE = int(os.environ.get('COLLECTOR_CHUNK_SIZE', 100))
+
+    # Days of price history the weekly gap repair scans (see PriceGapService)
+    PRICE_GAP_LOOKBACK_DAYS = int(os.environ.get('PRICE_GAP_LOOKBACK_DAYS', 365))
+
 class DevelopmentConfig(Config):
     DEBUG = True
 
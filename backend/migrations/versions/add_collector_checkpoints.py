@@ -0,0 +1,32 @@
+"""add collector_checkpoints for resumable collector runs
+
+Revision ID: add_collector_checkpoints
+Revises: add_latest_financials
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'add_collector_checkpoints'
+down_revision = 'add_latest_financials'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('collector_checkpoints',
+    sa.Column('run_id', sa.String(length=64), nullable=False),
+    sa.Column('ticker_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['ticker_id'], ['stocks.id'], ),
+    sa.PrimaryKeyConstraint('run_id', 'ticker_id')
+    )
+    op.create_index('ix_collector_checkpoints_updated_at', 'collector_checkpoints', ['updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_collector_checkpoints_updated_at', table_name='collector_checkpoints')
+    op.drop_table('collector_checkpoints')
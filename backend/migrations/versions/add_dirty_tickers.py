@@ -0,0 +1,30 @@
+"""add dirty_tickers for incremental scoring
+
+Revision ID: add_dirty_tickers
+Revises: add_username
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'add_dirty_tickers'
+down_revision = 'add_username'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('dirty_tickers',
+    sa.Column('ticker_id', sa.Integer(), nullable=False),
+    sa.Column('marked_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['ticker_id'], ['stocks.id'], ),
+    sa.PrimaryKeyConstraint('ticker_id')
+    )
+    op.create_index('ix_dirty_tickers_marked_at', 'dirty_tickers', ['marked_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_dirty_tickers_marked_at', table_name='dirty_tickers')
+    op.drop_table('dirty_tickers')
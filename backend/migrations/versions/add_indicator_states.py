@@ -0,0 +1,33 @@
+"""add indicator_states for incremental Wilder RSI
+
+Revision ID: add_indicator_states
+Revises: add_dirty_tickers
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'add_indicator_states'
+down_revision = 'add_dirty_tickers'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('indicator_states',
+    sa.Column('ticker_id', sa.Integer(), nullable=False),
+    sa.Column('avg_gain', sa.Float(), nullable=False),
+    sa.Column('avg_loss', sa.Float(), nullable=False),
+    sa.Column('bars', sa.Integer(), nullable=False),
+    sa.Column('last_close', sa.Float(), nullable=True),
+    sa.Column('last_timestamp', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['ticker_id'], ['stocks.id'], ),
+    sa.PrimaryKeyConstraint('ticker_id')
+    )
+
+
+def downgrade():
+    op.drop_table('indicator_states')
@@ -0,0 +1,52 @@
+"""add latest_financials snapshot
+
+Revision ID: add_latest_financials
+Revises: add_indicator_states
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'add_latest_financials'
+down_revision = 'add_indicator_states'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('latest_financials',
+    sa.Column('ticker_id', sa.Integer(), nullable=False),
+    sa.Column('financials_id', sa.Integer(), nullable=False),
+    sa.Column('fiscal_date', sa.Date(), nullable=False),
+    sa.Column('period', sa.String(length=20), nullable=True),
+    sa.Column('pe_ratio', sa.Numeric(precision=10, scale=2), nullable=True),
+    sa.Column('pb_ratio', sa.Numeric(precision=10, scale=2), nullable=True),
+    sa.Column('roe', sa.Numeric(precision=10, scale=4), nullable=True),
+    sa.Column('eps', sa.Numeric(precision=10, scale=2), nullable=True),
+    sa.Column('revenue', sa.BigInteger(), nullable=True),
+    sa.Column('net_income', sa.BigInteger(), nullable=True),
+    sa.Column('refreshed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['ticker_id'], ['stocks.id'], ),
+    sa.ForeignKeyConstraint(['financials_id'], ['financials.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('ticker_id', 'financials_id')
+    )
+
+    # Seed the snapshot from the existing history
+    op.execute("""
+        INSERT INTO latest_financials (ticker_id, financials_id, fiscal_date, period, pe_ratio, pb_ratio,
+                                       roe, eps, revenue, net_income, refreshed_at)
+        SELECT f.ticker_id, f.id, f.fiscal_date, f.period, f.pe_ratio, f.pb_ratio,
+               f.roe, f.eps, f.revenue, f.net_income, now()
+        FROM financials f
+        JOIN (
+            SELECT ticker_id, max(fiscal_date) AS max_date
+            FROM financials
+            GROUP BY ticker_id
+        ) latest ON latest.ticker_id = f.ticker_id AND latest.max_date = f.fiscal_date
+    """)
+
+
+def downgrade():
+    op.drop_table('latest_financials')
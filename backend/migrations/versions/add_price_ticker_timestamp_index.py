@@ -0,0 +1,23 @@
+"""add (ticker_id, timestamp) index on stock_prices
+
+Revision ID: add_price_ticker_timestamp_index
+Revises: add_collector_checkpoints
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'add_price_ticker_timestamp_index'
+down_revision = 'add_collector_checkpoints'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_stock_prices_ticker_id_timestamp', 'stock_prices', ['ticker_id', 'timestamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_stock_prices_ticker_id_timestamp', table_name='stock_prices')
@@ -0,0 +1,232 @@
+import json
+from datetime import datetime
+import pytest
+from unittest.mock import patch
+from app import create_app, db
+from app.models.stock import Stock
+from app.models.price import StockPrice
+from app.services.ingestion import AdaptiveLimiter
+from app.tasks import collector
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    app.config.update({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+        "MARKET_DATA_PROVIDER": 'synthetic',
+        "SYNTHETIC_PROVIDER": {'tickers': 7, 'days': 10, 'seed': 3, 'end_date': '2024-03-29'},
+        "COLLECTOR_CHUNK_SIZE": 3
+    })
+
+    # Fresh, unthrottled per-source limiters
+    limits = {'rate': 1000, 'burst': 100, 'workers': 4, 'batch_size': 5000}
+    app.config['INGESTION_LIMITS'] = {'fdr': dict(limits), 'yfinance': dict(limits, group_size=50)}
+    with app.app_context(), patch.dict(AdaptiveLimiter._shared, clear=True):
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+def _us_stocks(count=7):
+    stocks = [Stock(ticker=f"SYN{i:04d}", name=f"S{i}", market='S&P 500') for i in range(count)]
+    db.session.add_all(stocks)
+    db.session.commit()
+    return stocks
+
+def test_us_prices_fan_out_in_chunks(app):
+    """The collector dispatches one subtask per chunk on the market queue; the callback adds them up"""
+    stocks = _us_stocks()
+    dispatched = []
+    with patch.object(collector, 'chord', lambda header: lambda callback: dispatched.append((header, callback))):
+        collector.update_us_prices.run()
+
+    (header, callback), = dispatched
+    tasks = list(header.tasks)
+    assert [len(t.args[1]) for t in tasks] == [3, 3, 1]
+    assert {t.options['queue'] for t in tasks} == {'us_io'}
+    run_id = f"us_prices:{datetime.utcnow().date().isoformat()}"
+    assert callback.args == ('us', run_id)
+    assert {t.args[2] for t in tasks} == {run_id}
+
+    # Run the chunks like the workers would, results round-tripped through JSON
+    results = [json.loads(json.dumps(collector.update_prices_chunk.run(*t.args))) for t in tasks]
+    summary = collector.finalize_price_chunks.run(results, *callback.args)
+    assert summary == {'chunks': 3, 'errors': 0, 'stocks': 7, 'rows': 70, 'failed': [], 'retried': 0, 'skipped': 0,
+                       'inserted': 70, 'updated': 0, 'unchanged': 0,
+                       'run': {'run_id': run_id, 'done': 7, 'failed': 0}}
+    assert StockPrice.query.count() == 70
+    assert {p.ticker_id for p in StockPrice.query} == {s.id for s in stocks}
+
+def test_failed_chunk_is_reported(app):
+    """A chunk that errors out still reports its stocks to the callback"""
+    stocks = _us_stocks(2)
+    pairs = [[s.id, s.ticker] for s in stocks]
+    with patch.object(collector.PricePipeline, 'run', side_effect=RuntimeError("worker lost")):
+        failed = collector.update_prices_chunk.run('us', pairs)
+    ok = collector.update_prices_chunk.run('us', pairs[:1])
+
+    summary = collector.finalize_price_chunks.run([failed, ok], 'us')
+    assert summary['errors'] == 1 and summary['chunks'] == 2
+    assert summary['failed'] == ["SYN0000", "SYN0001"]
+    assert summary['rows'] == 10
+
+def test_us_financials_chunk_fetches_concurrently(app):
+    """Statement and info calls overlap across stocks; every stock gets annual and TTM rows"""
+    import threading
+    from app.models.financials import Financials
+    from app.models.latest_financials import LatestFinancials
+    from app.services.providers import get_provider
+
+    stocks = _us_stocks(4)
+    app.config['US_FINANCIALS_WORKERS'] = 4
+    provider = get_provider()
+    provider.latency = 0.05
+
+    lock = threading.Lock()
+    active = {'now': 0, 'max': 0}
+    call = provider._call
+    def tracked_call(*request):
+        with lock:
+            active['now'] += 1
+            active['max'] = max(active['max'], active['now'])
+        try:
+            return call(*request)
+        finally:
+            with lock:
+                active['now'] -= 1
+
+    with patch.object(provider, '_call', tracked_call):
+        summary = collector.update_us_financials_chunk.run([[s.id, s.ticker] for s in stocks])
+
+    assert summary == {'stocks': 4, 'failed': [], 'inserted': 20, 'updated': 0, 'unchanged': 0}
+    # Calls of several stocks were in flight at once
+    assert active['max'] > 2
+    assert Financials.query.filter_by(period='Annual').count() == 16
+    assert Financials.query.filter_by(period='TTM').count() == 4
+    assert LatestFinancials.query.count() == 4
+
+def test_kr_fundamental_records_vectorized(app):
+    """Only tracked tickers with numeric values become rows; ratios are masked like before"""
+    import pandas as pd
+    from datetime import date
+    from app.services.financial_service import KoreanFinancialService
+
+    df = pd.DataFrame({
+        'BPS': [50000, 0, 20000, 10000, 0, 30000],
+        'PER': [10.0, 5.0, -3.0, 'n/a', 0, 8.0],
+        'PBR': [1.2, 0.0, 0.8, 1.0, 0, 1.5],
+        'EPS': [5000, 100, 0, 500, 0, 2000],
+        'DIV': 0.0
+    }, index=pd.Index(["005930", "000660", "035720", "051910", "005380", "999999"], name='티커'))
+    tickers = pd.DataFrame({'ticker': ["005930", "000660", "035720", "051910", "005380"],
+                            'ticker_id': [1, 2, 3, 4, 5]})
+
+    records = KoreanFinancialService.fundamental_records(df, tickers, date(2024, 3, 28))
+    base = {'fiscal_date': date(2024, 3, 28), 'period': 'Daily', 'revenue': None, 'net_income': None}
+    assert records == [
+        dict(base, ticker_id=1, pe_ratio=10.0, pb_ratio=1.2, roe=0.1, eps=5000),
+        dict(base, ticker_id=2, pe_ratio=5.0, pb_ratio=None, roe=None, eps=100),
+        dict(base, ticker_id=3, pe_ratio=None, pb_ratio=0.8, roe=0.0, eps=None),
+    ]
+    assert type(records[0]['ticker_id']) is int
+
+def test_kr_financials_backfill(app):
+    """A range of dates is fetched concurrently and written in bulk; weekends are skipped"""
+    from datetime import date
+    from app.models.financials import Financials
+    from app.models.latest_financials import LatestFinancials
+    from app.services.financial_service import KoreanFinancialService
+    from app.services.providers import get_provider
+
+    app.config['INGESTION_LIMITS']['pykrx'] = {'rate': 1000, 'burst': 100, 'workers': 4}
+    stocks = [Stock(ticker=code, name=code, market='KOSPI') for code in get_provider().kr_codes[:5]]
+    db.session.add_all(stocks)
+    db.session.commit()
+
+    days = [date(2024, 3, d) for d in range(20, 31)]
+    summary = KoreanFinancialService.backfill_financials(days)
+
+    assert summary == {'dates': 11, 'rows': 5 * 8, 'failed': [], 'inserted': 40, 'updated': 0, 'unchanged': 0}
+    assert Financials.query.count() == 40
+    assert {f.fiscal_date for f in LatestFinancials.query} == {date(2024, 3, 29)}
+
+    # The daily update writes the same rows
+    KoreanFinancialService.update_financials(datetime(2024, 3, 29))
+    assert Financials.query.count() == 40
+
+def test_price_chunk_resumes_from_checkpoints(app):
+    """A redelivered chunk skips the stocks its run already finished"""
+    from app.services.checkpoint import CheckpointService
+
+    stocks = _us_stocks()
+    pairs = [[s.id, s.ticker] for s in stocks]
+    run_id = CheckpointService.run_id('us_prices')
+
+    # The first delivery got through 4 stocks before the worker was lost
+    first = collector.update_prices_chunk.run('us', pairs[:4], run_id)
+    assert first['stocks'] == 4 and first['skipped'] == 0
+    assert CheckpointService.progress(run_id) == {'done': 4, 'failed': 0}
+
+    second = collector.update_prices_chunk.run('us', pairs, run_id)
+    assert second['skipped'] == 4
+    assert second['stocks'] == 3 and second['rows'] == 30
+    assert CheckpointService.progress(run_id) == {'done': 7, 'failed': 0}
+    assert StockPrice.query.count() == 70
+
+    # A new run starts from scratch
+    other_day = CheckpointService.run_id('us_prices', datetime(2000, 1, 3).date())
+    third = collector.update_prices_chunk.run('us', pairs, other_day)
+    assert third['skipped'] == 0 and third['stocks'] == 7
+
+def test_price_chunk_reports_progress(app):
+    """Done/failed/remaining counts are published as the task's PROGRESS state"""
+    stocks = _us_stocks()
+    pairs = [[s.id, s.ticker] for s in stocks]
+    task = collector.update_prices_chunk
+
+    task.push_request(id='chunk-1')
+    try:
+        with patch.object(task, 'update_state') as update_state, patch.object(collector, 'PROGRESS_INTERVAL', 0):
+            task.run('us', pairs, 'us_prices:2024-03-29')
+    finally:
+        task.pop_request()
+
+    states = [call.kwargs for call in update_state.call_args_list]
+    assert {state['state'] for state in states} == {'PROGRESS'}
+    remaining = [state['meta']['remaining'] for state in states]
+    assert remaining == sorted(remaining, reverse=True)
+    assert states[-1]['meta'] == {'run_id': 'us_prices:2024-03-29', 'done': 7, 'failed': 0, 'remaining': 0}
+
+def test_price_gaps_found_and_repaired(app):
+    """Holes against the peer calendar are refetched; market holidays and the trailing edge are not gaps"""
+    from app.services.market_data import USMarketService
+    from app.services.price_gaps import PriceGapService
+
+    stocks = _us_stocks(5)
+    collector.update_prices_chunk.run('us', [[s.id, s.ticker] for s in stocks])
+    assert StockPrice.query.count() == 50
+
+    def drop(stock_ids, *days):
+        StockPrice.query.filter(StockPrice.ticker_id.in_(stock_ids),
+                                StockPrice.timestamp.in_([datetime(2024, 3, d) for d in days])
+                                ).delete(synchronize_session=False)
+        db.session.commit()
+
+    drop([stocks[0].id], 20, 21)           # two consecutive days
+    drop([stocks[0].id], 26)               # and one more
+    drop([stocks[1].id], 25)
+    drop([s.id for s in stocks], 19)       # nobody traded: not a trading day
+    drop([stocks[2].id], 29)               # latest bar: the incremental update's job
+
+    gaps = PriceGapService.find_gaps(USMarketService, datetime(2024, 1, 1))
+    assert gaps == [
+        (stocks[0].id, "SYN0000", datetime(2024, 3, 20), datetime(2024, 3, 21), 2),
+        (stocks[0].id, "SYN0000", datetime(2024, 3, 26), datetime(2024, 3, 26), 1),
+        (stocks[1].id, "SYN0001", datetime(2024, 3, 25), datetime(2024, 3, 25), 1),
+    ]
+
+    summary = PriceGapService.repair_gaps(USMarketService, datetime(2024, 1, 1))
+    assert summary['gaps'] == 3 and summary['days'] == 4
+    assert summary['inserted'] == 4 and summary['failed'] == []
+    assert PriceGapService.find_gaps(USMarketService, datetime(2024, 1, 1)) == []
@@ -0,0 +1,467 @@
+import pytest
+from unittest.mock import patch
+import threading
+import time
+from datetime import datetime, date
+import pandas as pd
+from app import create_app, db
+from app.models.stock import Stock
+from app.models.price import StockPrice
+from app.models.dirty_ticker import DirtyTicker
+from app.services.ingestion import AdaptiveLimiter, PricePipeline, TokenBucket, classify_failure
+from app.services.market_data import KoreanMarketService, USMarketService, ohlcv_records, price_watermarks, start_after
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    app.config.update({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"
+    })
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+class FakeSource(KoreanMarketService):
+    """Serves a few daily bars per ticker after a short network delay"""
+    SOURCE = 'fake'
+
+    def __init__(self, delay=0.05, failing=()):
+        self.delay = delay
+        self.failing = set(failing)
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def fetch_ohlcv(self, ticker, start_date, end_date=None):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        if ticker in self.failing:
+            raise ConnectionError("connection reset")
+        index = pd.date_range(start_date, periods=3, freq='D')
+        return pd.DataFrame({'Open': 1.0, 'High': 2.0, 'Low': 0.5, 'Close': [1.0, 1.5, 1.2], 'Volume': 100},
+                            index=index)
+
+def test_token_bucket_limits_rate():
+    """After the burst, acquisitions are spaced by 1 / rate"""
+    clock = [0.0]
+    bucket = TokenBucket(rate=2, capacity=2, clock=lambda: clock[0],
+                         sleep=lambda s: clock.__setitem__(0, clock[0] + s))
+    for _ in range(6):
+        bucket.acquire()
+    # 2 from the burst, then 4 more at 2 per second
+    assert clock[0] == pytest.approx(2.0)
+
+def test_price_pipeline_fetches_concurrently_and_batches_writes(app):
+    """Fetches overlap, writes are batched and a failing ticker is reported"""
+    stocks = [Stock(ticker=f"{i:06d}", name=f"S{i}", market='KOSPI') for i in range(12)]
+    db.session.add_all(stocks)
+    db.session.commit()
+
+    source = FakeSource(failing={"000003"})
+    pipeline = PricePipeline(source, rate=1000, workers=4, batch_size=9)
+    summary = pipeline.run([(s.id, s.ticker, '2024-01-01') for s in stocks])
+
+    assert summary == {'stocks': 12, 'rows': 33, 'failed': ["000003"], 'retried': 2, 'skipped': 0,
+                       'inserted': 33, 'updated': 0, 'unchanged': 0}
+    # All 4 workers were fetching at once
+    assert source.max_active == 4
+    assert StockPrice.query.count() == 33
+    assert DirtyTicker.query.count() == 11
+
+    # Next run resumes after the stored bars
+    summary = pipeline.run([(s.id, s.ticker) for s in stocks[:2]])
+    assert StockPrice.query.filter_by(ticker_id=stocks[0].id).order_by(StockPrice.timestamp).all()[-1].timestamp \
+        == datetime(2024, 1, 6)
+
+def test_split_batch_into_ticker_frames():
+    """A wide yf.download frame splits into per-ticker frames without empty dates"""
+    index = pd.date_range('2024-01-02', periods=3, freq='D')
+    fields = ['Open', 'High', 'Low', 'Close', 'Volume']
+    wide = pd.concat({
+        'AAPL': pd.DataFrame({f: [1.0, 2.0, 3.0] for f in fields}, index=index),
+        'NEWCO': pd.DataFrame({f: [float('nan'), float('nan'), 5.0] for f in fields}, index=index),
+        'DEAD': pd.DataFrame({f: [float('nan')] * 3 for f in fields}, index=index),
+    }, axis=1)
+
+    frames = USMarketService.split_batch(wide, ['AAPL', 'NEWCO', 'DEAD', 'MISSING'])
+    assert sorted(frames) == ['AAPL', 'NEWCO']
+    assert len(frames['AAPL']) == 3 and list(frames['NEWCO'].index) == [index[2]]
+
+    # Single symbol downloads have no ticker level
+    single = USMarketService.split_batch(wide['AAPL'], ['AAPL'])
+    assert single['AAPL'].equals(wide['AAPL'])
+
+class FakeBatchSource(FakeSource):
+    """Bulk download that silently drops one symbol"""
+
+    def __init__(self, dropped):
+        super().__init__(delay=0)
+        self.dropped = dropped
+        self.batches = []
+        self.single = []
+
+    def fetch_ohlcv_batch(self, tickers, start_date, end_date=None):
+        self.batches.append(list(tickers))
+        return {t: FakeSource.fetch_ohlcv(self, t, start_date) for t in tickers if t != self.dropped}
+
+    def fetch_ohlcv(self, ticker, start_date, end_date=None):
+        self.single.append(ticker)
+        return super().fetch_ohlcv(ticker, start_date, end_date)
+
+def test_price_pipeline_batch_mode_falls_back_per_ticker(app):
+    """Stocks are fetched in groups per start date; symbols missing from a group are fetched alone"""
+    stocks = [Stock(ticker=f"US{i}", name=f"US{i}", market='S&P 500') for i in range(7)]
+    db.session.add_all(stocks)
+    db.session.commit()
+
+    source = FakeBatchSource(dropped="US1")
+    pipeline = PricePipeline(source, rate=1000, workers=2, group_size=3)
+    jobs = [(s.id, s.ticker, '2024-01-01') for s in stocks[:5]] + [(s.id, s.ticker, '2024-02-01') for s in stocks[5:]]
+    with patch.object(pipeline.limiter, 'acquire', wraps=pipeline.limiter.acquire) as acquire:
+        summary = pipeline.run(jobs)
+    # One token per request: 3 batch downloads and 1 single fetch
+    assert acquire.call_count == 4 and all(call.args in ((), (1,)) for call in acquire.call_args_list)
+
+    assert summary == {'stocks': 7, 'rows': 21, 'failed': [], 'retried': 0, 'skipped': 0,
+                       'inserted': 21, 'updated': 0, 'unchanged': 0}
+    assert sorted(map(sorted, source.batches)) == [["US0", "US1", "US2"], ["US3", "US4"], ["US5", "US6"]]
+    assert source.single == ["US1"]
+    assert StockPrice.query.filter_by(ticker_id=stocks[1].id).count() == 3
+
+def test_ohlcv_records_vectorized(caplog):
+    """Frames convert to naive-timestamp tuples; invalid rows are dropped and logged once"""
+    index = pd.date_range('2024-01-02', periods=4, freq='D', tz='America/New_York')
+    df = pd.DataFrame({
+        'Open': [1.0, 2.0, None, 4.0],
+        'High': [1.5, 2.5, 3.5, 4.5],
+        'Low': [0.5, 1.5, 2.5, 3.5],
+        'Close': [1.2, 2.2, 3.2, 'n/a'],
+        'Volume': [100, 200, 300, 400],
+        'Dividends': 0.0
+    }, index=index)
+
+    with caplog.at_level('WARNING'):
+        records = ohlcv_records(7, "AAPL", df)
+
+    assert records == [
+        (datetime(2024, 1, 2), 7, 1.0, 1.5, 0.5, 1.2, 100),
+        (datetime(2024, 1, 3), 7, 2.0, 2.5, 1.5, 2.2, 200),
+    ]
+    assert all(type(r[6]) is int for r in records)
+    assert len([r for r in caplog.records if 'invalid price rows' in r.getMessage()]) == 1
+    assert ohlcv_records(7, "AAPL", pd.DataFrame()) == []
+
+def test_price_loader_copy_buffer():
+    """COPY rows are CSV in stock_prices column order, windows cover every staged row"""
+    from app.services.price_loader import PriceLoader
+
+    rows = [(datetime(2024, 1, 2), 7, 1.0, 1.5, 0.5, 1.25, 100),
+            (datetime(2024, 1, 3, 15, 30), 7, 2.0, 2.5, 1.5, None, 200)]
+    assert PriceLoader.to_csv(rows).read().splitlines() == [
+        "2024-01-02 00:00:00,7,1.0,1.5,0.5,1.25,100",
+        "2024-01-03 15:30:00,7,2.0,2.5,1.5,,200",
+    ]
+    sql = str(PriceLoader.merge_sql())
+    assert "ON CONFLICT (ticker_id, timestamp) DO UPDATE" in sql
+    assert "timestamp >= :start AND timestamp < :end" in sql
+    # Unchanged rows are skipped
+    assert "IS DISTINCT FROM (EXCLUDED.open, EXCLUDED.high" in sql
+    # The last staged row of a duplicated key wins
+    assert "ORDER BY ticker_id, timestamp, seq DESC" in sql
+
+    # Small batches merge in one statement that includes the last bar
+    assert PriceLoader.windows(rows) == [(datetime(2024, 1, 2), datetime(2024, 1, 3, 15, 30, 0, 1))]
+    # Large sparse batches only merge the windows that have rows
+    with patch.object(PriceLoader, 'SINGLE_MERGE_ROWS', 1):
+        sparse = rows[:1] + [(datetime(2024, 12, 30), 7, 1.0, 1.0, 1.0, 1.0, 1)]
+        assert PriceLoader.windows(sparse) == [
+            (datetime(2024, 1, 2), datetime(2024, 2, 1)),
+            (datetime(2024, 12, 27), datetime(2025, 1, 26)),
+        ]
+
+def test_price_watermarks_single_query(app):
+    """Latest timestamps for the whole universe come from one query of per-stock index probes"""
+    from sqlalchemy import event
+
+    stocks = [Stock(ticker=f"W{i}", name=f"W{i}", market='KOSPI') for i in range(5)]
+    db.session.add_all(stocks)
+    db.session.commit()
+    for i, stock in enumerate(stocks[:4]):
+        for d in range(i + 1):
+            db.session.add(StockPrice(ticker_id=stock.id, timestamp=datetime(2024, 1, 1 + d), close=1))
+    db.session.commit()
+
+    ids = [s.id for s in stocks]
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        watermarks = price_watermarks(ids)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+    assert len(statements) == 1
+    # A correlated max per stock, not a GROUP BY over all their bars
+    assert "GROUP BY" not in statements[0]
+    assert watermarks == {s.id: datetime(2024, 1, 1 + i) for i, s in enumerate(stocks[:4])}
+    assert start_after(watermarks[stocks[3].id]) == '2024-01-05'
+    assert start_after(watermarks.get(stocks[4].id)) == '2000-01-01'
+
+def test_kr_daily_snapshots_by_date(app):
+    """Up-to-date stocks are filled from one market snapshot per day; the rest are left for backfill"""
+    stocks = [Stock(ticker=t, name=t, market='KOSPI') for t in ["005930", "000660", "035720", "373220"]]
+    db.session.add_all(stocks)
+    db.session.commit()
+    # 005930 current to Jan 3, 000660 to Jan 4, 035720 stale since December, 373220 new listing
+    for stock, last in zip(stocks[:3], [datetime(2024, 1, 3), datetime(2024, 1, 4), datetime(2023, 12, 1)]):
+        db.session.add(StockPrice(ticker_id=stock.id, timestamp=last, close=100))
+    db.session.commit()
+
+    calls = []
+    def market_ohlcv(day, market):
+        calls.append(day)
+        if day == "20240105":
+            # Holiday: every ticker comes back with zeros
+            values = [[0, 0, 0, 0, 0, 0, 0.0]] * 3
+        else:
+            values = [[10, 12, 9, 11, 1000, 11000, 1.0], [20, 22, 19, 21, 2000, 42000, 1.0],
+                      [30, 32, 29, 31, 3000, 93000, 1.0]]
+        return pd.DataFrame(values, columns=['시가', '고가', '저가', '종가', '거래량', '거래대금', '등락률'],
+                            index=pd.Index(["005930", "000660", "999999"], name='티커'))
+
+    with patch('app.services.providers.krx_stock.get_market_ohlcv_by_ticker', side_effect=market_ohlcv):
+        summary = KoreanMarketService.update_prices_by_date([(s.id, s.ticker) for s in stocks], date(2024, 1, 8))
+
+    # Jan 4, 5 (holiday) and 8; the weekend is skipped
+    assert calls == ["20240104", "20240105", "20240108"]
+    assert summary == {'dates': 3, 'rows': 3, 'backfill': [(stocks[2].id, "035720"), (stocks[3].id, "373220")],
+                       'inserted': 3, 'updated': 0, 'unchanged': 0}
+    samsung = StockPrice.query.filter_by(ticker_id=stocks[0].id).order_by(StockPrice.timestamp).all()
+    assert [p.timestamp for p in samsung] == [datetime(2024, 1, 3), datetime(2024, 1, 4), datetime(2024, 1, 8)]
+    assert float(samsung[-1].close) == 11 and samsung[-1].volume == 1000
+    assert StockPrice.query.filter_by(ticker_id=stocks[1].id).count() == 2
+
+def test_upserts_skip_unchanged_rows(app):
+    """Re-loading identical data rewrites nothing and is reported as unchanged"""
+    app.config.update(MARKET_DATA_PROVIDER='synthetic',
+                      SYNTHETIC_PROVIDER={'tickers': 20, 'days': 30, 'seed': 7, 'end_date': '2024-03-29'})
+    counts = USMarketService.update_stocks()
+    assert counts == {'inserted': 20, 'updated': 0, 'unchanged': 0}
+    first = {s.ticker: s.updated_at for s in Stock.query}
+
+    assert USMarketService.update_stocks() == {'inserted': 0, 'updated': 0, 'unchanged': 20}
+    db.session.expire_all()
+    assert {s.ticker: s.updated_at for s in Stock.query} == first
+
+    stocks = Stock.query.order_by(Stock.id).all()
+    jobs = [(s.id, s.ticker, '2024-03-25') for s in stocks[:3]]
+    pipeline = PricePipeline(USMarketService, rate=1000, workers=2)
+    summary = pipeline.run(jobs)
+    assert (summary['inserted'], summary['updated'], summary['unchanged']) == (15, 0, 0)
+
+    # Identical bars mark nothing for rescoring; a corrected bar marks its stock
+    DirtyTicker.query.delete()
+    db.session.commit()
+    summary = pipeline.run(jobs)
+    assert (summary['inserted'], summary['updated'], summary['unchanged']) == (0, 0, 15)
+    assert DirtyTicker.query.count() == 0
+
+    bar = StockPrice.query.filter_by(ticker_id=stocks[0].id).order_by(StockPrice.timestamp).first()
+    bar.close = 0.01
+    db.session.commit()
+    summary = pipeline.run(jobs)
+    assert (summary['inserted'], summary['updated'], summary['unchanged']) == (0, 1, 14)
+    assert [d.ticker_id for d in DirtyTicker.query] == [stocks[0].id]
+
+def test_response_cache_ttl_and_replay(app, tmp_path):
+    """Responses are served from disk within the TTL; replay mode never fetches"""
+    import os
+    from app.services.response_cache import ResponseCache, CacheMiss
+
+    cache = ResponseCache(str(tmp_path), ttl=60, mode='on')
+    frame = pd.DataFrame({'Close': [1.0, 2.0]}, index=pd.date_range('2024-01-01', periods=2, tz='Asia/Seoul'))
+    calls = []
+    def load():
+        calls.append(1)
+        return frame
+
+    params = {'ticker': '005930', 'start': '2024-01-01', 'end': None}
+    assert cache.fetch('fdr', 'ohlcv', params, load).equals(frame)
+    assert cache.fetch('fdr', 'ohlcv', dict(reversed(params.items())), load).equals(frame)
+    assert len(calls) == 1
+    # Failed fetches (empty frames) are not cached
+    assert cache.fetch('fdr', 'ohlcv', {'ticker': 'X'}, pd.DataFrame).empty
+    assert cache.get('fdr', 'ohlcv', {'ticker': 'X'}) is None
+
+    # Expired: refetched outside replay, still served in replay
+    path = cache.path('fdr', cache.key('fdr', 'ohlcv', params))
+    os.utime(path, (0, 0))
+    replay = ResponseCache(str(tmp_path), ttl=60, mode='replay')
+    assert replay.fetch('fdr', 'ohlcv', params, load).equals(frame)
+    with pytest.raises(CacheMiss):
+        replay.fetch('fdr', 'ohlcv', {'ticker': '000660'}, load)
+    assert len(calls) == 1
+
+    # Replay keeps its recorded responses at any age
+    assert replay.evict() == 0
+    assert cache.evict() == 1
+    assert cache.fetch('fdr', 'ohlcv', params, load).equals(frame)
+    assert len(calls) == 2
+
+def test_response_cache_entries_keep_their_own_ttl(app, tmp_path):
+    """Entries expire by the ttl they were written with, whatever ttl reads or evicts them"""
+    from app.services.response_cache import ResponseCache, cached_response
+
+    app.config.update(RESPONSE_CACHE_DIR=str(tmp_path), RESPONSE_CACHE_MODE='on', RESPONSE_CACHE_TTL=60)
+    frame = pd.DataFrame({'Close': [1.0]})
+    cached_response('yfinance', 'download', {'ticker': 'SHORT'}, lambda: frame)
+    cached_response('yfinance', 'info', {'ticker': 'LONG'}, lambda: frame, ttl=7 * 86400)
+
+    cache = ResponseCache.from_config()
+    # Two hours later only the entry written with the 60 second ttl has expired
+    with patch('app.services.response_cache.time.time', return_value=time.time() + 7200):
+        assert cache.evict() == 1
+        assert cache.get('yfinance', 'download', {'ticker': 'SHORT'}) is None
+        assert cache.get('yfinance', 'info', {'ticker': 'LONG'}).equals(frame)
+    with patch('app.services.response_cache.time.time', return_value=time.time() + 8 * 86400):
+        assert cache.evict() == 1
+        assert cache.get('yfinance', 'info', {'ticker': 'LONG'}) is None
+
+def test_market_snapshot_replay(app, tmp_path):
+    """A captured pykrx snapshot replays offline through the service"""
+    app.config.update(RESPONSE_CACHE_DIR=str(tmp_path), RESPONSE_CACHE_MODE='on')
+    snapshot = pd.DataFrame([[10, 12, 9, 11, 1000, 11000, 1.0]],
+                            columns=['시가', '고가', '저가', '종가', '거래량', '거래대금', '등락률'],
+                            index=pd.Index(["005930"], name='티커'))
+    with patch('app.services.providers.krx_stock.get_market_ohlcv_by_ticker', return_value=snapshot):
+        live = KoreanMarketService.fetch_market_ohlcv(date(2024, 1, 4))
+
+    app.config['RESPONSE_CACHE_MODE'] = 'replay'
+    with patch('app.services.providers.krx_stock.get_market_ohlcv_by_ticker', side_effect=AssertionError):
+        assert KoreanMarketService.fetch_market_ohlcv(date(2024, 1, 4)).equals(live)
+        # Not captured: logged and treated like a failed fetch
+        assert KoreanMarketService.fetch_market_ohlcv(date(2024, 1, 5)).empty
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def test_adaptive_limiter_backs_off_and_opens_circuit():
+    """Throttling halves the rate, successes add it back, sustained failures open the circuit"""
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(rate=10, min_rate=1, increase=1, failure_threshold=3, cooldown=30,
+                              clock=clock, sleep=clock.sleep)
+
+    assert limiter.record('throttled') and limiter.rate == 5
+    limiter.record('ok')
+    assert limiter.rate == 6
+    assert not limiter.record('error') and limiter.rate == 6
+
+    for _ in range(3):
+        limiter.record('timeout')
+    assert limiter.state == 'open' and limiter.rate == 1
+
+    # No requests until the cooldown ends, then one probe
+    limiter.acquire()
+    assert clock.now >= 30 and limiter.state == 'half_open'
+    limiter.record('throttled')
+    assert limiter.state == 'open'
+    started = clock.now
+    limiter.acquire()
+    # A failed probe doubles the cooldown
+    assert clock.now - started >= 60
+    limiter.record('ok')
+    assert limiter.state == 'closed' and limiter.rate == 2
+
+def test_adaptive_limiter_empty_frames():
+    """Occasional empty frames are normal; mostly empty responses mean throttling"""
+    limiter = AdaptiveLimiter(rate=10, min_rate=1, window=10)
+    for _ in range(8):
+        limiter.record('ok')
+    assert not limiter.record('empty') and limiter.rate == 10
+
+    throttled = [limiter.record('empty') for _ in range(6)]
+    assert throttled[-1] and limiter.rate < 10
+    assert limiter.state == 'closed'
+
+def test_adaptive_limiter_empty_probe_reopens_circuit():
+    """A half-open probe that comes back empty (throttled) reopens the circuit instead of wedging it"""
+    clock = FakeClock()
+    sleeps = []
+    def sleep(seconds):
+        sleeps.append(seconds)
+        assert len(sleeps) < 1000, "acquire() never returned"
+        clock.sleep(seconds)
+
+    limiter = AdaptiveLimiter(rate=10, min_rate=1, failure_threshold=5, cooldown=30, window=10,
+                              clock=clock, sleep=sleep)
+    for _ in range(5):
+        limiter.record('timeout')
+    assert limiter.state == 'open'
+
+    limiter.acquire()
+    assert limiter.state == 'half_open'
+    # Mostly failures in the window, so an empty frame counts as throttling
+    assert limiter.record('empty')
+    assert limiter.state == 'open'
+
+    started = clock.now
+    limiter.acquire()
+    assert clock.now - started >= 60 and limiter.state == 'half_open'
+    limiter.record('ok')
+    assert limiter.state == 'closed'
+
+def test_classify_failure():
+    import requests
+
+    response = requests.Response()
+    response.status_code = 429
+    assert classify_failure(requests.HTTPError("429 Client Error", response=response)) == 'throttled'
+    assert classify_failure(Exception("Too Many Requests. Rate limited. Try after a while.")) == 'throttled'
+    assert classify_failure(requests.exceptions.ReadTimeout()) == 'timeout'
+    assert classify_failure(ConnectionResetError()) == 'connection'
+    assert classify_failure(KeyError('Close')) == 'error'
+
+class ThrottlingSource(FakeSource):
+    """Answers 429 to the first request of some tickers"""
+
+    def __init__(self, throttled):
+        super().__init__(delay=0)
+        self.throttled = set(throttled)
+        self.calls = []
+
+    def fetch_ohlcv(self, ticker, start_date, end_date=None):
+        self.calls.append(ticker)
+        if ticker in self.throttled:
+            self.throttled.discard(ticker)
+            raise Exception("429 Too Many Requests")
+        return super().fetch_ohlcv(ticker, start_date, end_date)
+
+def test_price_pipeline_retries_throttled_stocks_later(app):
+    """Throttled stocks are retried after the rest of the run and their prices still land"""
+    stocks = [Stock(ticker=f"{i:06d}", name=f"S{i}", market='KOSPI') for i in range(6)]
+    db.session.add_all(stocks)
+    db.session.commit()
+
+    source = ThrottlingSource(throttled={"000001", "000002"})
+    pipeline = PricePipeline(source, rate=1000, workers=1)
+    summary = pipeline.run([(s.id, s.ticker, '2024-01-01') for s in stocks])
+
+    assert summary == {'stocks': 6, 'rows': 18, 'failed': [], 'retried': 2, 'skipped': 0,
+                       'inserted': 18, 'updated': 0, 'unchanged': 0}
+    assert source.calls[-2:] == ["000001", "000002"]
+    assert pipeline.limiter.rate < 1000
@@ -0,0 +1,173 @@
+import pytest
+from datetime import date
+from app import create_app, db
+from app.models.stock import Stock
+from app.models.price import StockPrice
+from app.services.ingestion import PricePipeline
+from app.services.market_data import KoreanMarketService, USMarketService
+from app.services.providers import LiveProvider, SyntheticProvider, get_provider
+from app.services.financial_service import USFinancialService
+
+SYNTHETIC = {'tickers': 20, 'days': 30, 'seed': 7, 'end_date': '2024-03-29'}
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    app.config.update({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+        "MARKET_DATA_PROVIDER": 'synthetic',
+        "SYNTHETIC_PROVIDER": SYNTHETIC
+    })
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+def test_synthetic_provider_is_deterministic():
+    """Same seed, same data; bars are consistent OHLC"""
+    first = SyntheticProvider(**SYNTHETIC).us_ohlcv('SYN0003', '2024-03-01')
+    second = SyntheticProvider(**SYNTHETIC).us_ohlcv('SYN0003', '2024-03-01')
+    other = SyntheticProvider(**dict(SYNTHETIC, seed=8)).us_ohlcv('SYN0003', '2024-03-01')
+
+    assert first.equals(second)
+    assert not first.equals(other)
+    assert len(first) == 21 and str(first.index.tz) == 'America/New_York'
+    assert (first['Low'] <= first[['Open', 'Close']].min(axis=1)).all()
+    assert (first['High'] >= first[['Open', 'Close']].max(axis=1)).all()
+
+def test_synthetic_snapshot_matches_per_ticker_bars():
+    """The whole-market snapshot carries the same bar as the per-ticker series"""
+    provider = SyntheticProvider(**SYNTHETIC)
+    snapshot = provider.kr_market_ohlcv('20240328')
+    series = provider.kr_ohlcv('900004', '2024-03-28', '2024-03-28')
+
+    assert len(snapshot) == 20
+    assert snapshot.loc['900004', '종가'] == series['Close'].iloc[0]
+    # Weekends come back as zero rows
+    assert (provider.kr_market_ohlcv('20240330')['종가'] == 0).all()
+
+def test_synthetic_errors_are_reproducible():
+    """Injected failures depend on the request and attempt, and retries can succeed"""
+    def failures(provider):
+        failed = []
+        for i in range(20):
+            for _ in range(3):
+                try:
+                    provider.kr_ohlcv(f"{900000 + i:06d}", '2024-03-01')
+                    break
+                except ConnectionError:
+                    failed.append(i)
+        return failed
+
+    config = dict(SYNTHETIC, error_rate=0.3)
+    failed = failures(SyntheticProvider(**config))
+    assert failed and failed == failures(SyntheticProvider(**config))
+    assert len(set(failed)) < 20
+
+def test_get_provider_follows_config(app):
+    """The app's provider is built once from MARKET_DATA_PROVIDER"""
+    provider = get_provider()
+    assert isinstance(provider, SyntheticProvider) and provider is get_provider()
+    assert provider.us_symbols[:2] == ['SYN0000', 'SYN0001']
+
+    app.extensions.pop('market_data_provider')
+    app.config['MARKET_DATA_PROVIDER'] = 'live'
+    assert isinstance(get_provider(), LiveProvider)
+
+def test_ingestion_against_synthetic_provider(app):
+    """Collectors run end to end on synthetic data: per-ticker backfill, then daily snapshots"""
+    listing = KoreanMarketService.fetch_tickers()
+    stocks = [Stock(ticker=row.Code, name=row.Name, market=row.Market) for row in listing.itertuples()]
+    db.session.add_all(stocks)
+    db.session.commit()
+
+    jobs = [(s.id, s.ticker, '2024-02-19') for s in stocks]
+    summary = PricePipeline(KoreanMarketService, rate=1000, workers=4).run(jobs)
+    assert summary == {'stocks': 20, 'rows': 20 * 30, 'failed': [], 'retried': 0, 'skipped': 0,
+                       'inserted': 600, 'updated': 0, 'unchanged': 0}
+
+    daily = KoreanMarketService.update_prices_by_date([(s.id, s.ticker) for s in stocks],
+                                                      end_date=date(2024, 3, 29))
+    assert daily['backfill'] == [] and daily['rows'] == 0
+
+    StockPrice.query.filter(StockPrice.timestamp >= '2024-03-27').delete(synchronize_session=False)
+    db.session.commit()
+    daily = KoreanMarketService.update_prices_by_date([(s.id, s.ticker) for s in stocks],
+                                                      end_date=date(2024, 3, 29))
+    assert daily['rows'] == 20 * 3
+    assert StockPrice.query.count() == 20 * 30
+
+def test_us_services_read_synthetic_provider(app):
+    """US batch downloads and fundamentals come from the provider"""
+    frames = USMarketService.fetch_ohlcv_batch(['SYN0000', 'SYN0001'], '2024-03-25')
+    assert sorted(frames) == ['SYN0000', 'SYN0001'] and len(frames['SYN0000']) == 5
+
+    statements = USFinancialService.fetch_statements('SYN0000')
+    assert list(statements.index) == ['Total Revenue', 'Net Income'] and len(statements.columns) == 4
+    assert USFinancialService.fetch_info('SYN0000') == USFinancialService.fetch_info('SYN0000')
+
+def test_live_info_is_cached_for_its_ttl(app, tmp_path):
+    """Ticker info is reused within US_INFO_CACHE_TTL even with the response cache off"""
+    from unittest.mock import MagicMock, patch
+
+    app.config.update(RESPONSE_CACHE_DIR=str(tmp_path), RESPONSE_CACHE_MODE='off')
+    ticker = MagicMock(info={'trailingPE': 21.5, 'sector': 'Technology', 'officers': [{}]})
+    with patch('app.services.providers.yf.Ticker', return_value=ticker) as factory:
+        provider = LiveProvider(info_ttl=60)
+        assert provider.us_info('AAPL') == {'trailingPE': 21.5, 'sector': 'Technology'}
+        assert provider.us_info('AAPL') == {'trailingPE': 21.5, 'sector': 'Technology'}
+        assert factory.call_count == 1
+        # Requests share the provider's keep-alive session
+        assert factory.call_args.kwargs['session'] is provider.session
+
+        LiveProvider().us_info('AAPL')
+        assert factory.call_count == 2
+
+def test_live_batch_downloads_do_not_share_results(app):
+    """yf.download keeps its frames in module globals; concurrent batches must not mix them"""
+    import threading
+    import time
+    import pandas as pd
+    from unittest.mock import patch
+
+    app.config.update(RESPONSE_CACHE_MODE='off')
+    shared = {}
+
+    def download(tickers, **kwargs):
+        # Like yfinance.multi.download: reset the globals, fill them, build the result from them
+        shared.clear()
+        for ticker in tickers:
+            time.sleep(0.01)
+            shared[ticker] = pd.DataFrame({'Close': [1.0]}, index=pd.DatetimeIndex(['2024-01-02']))
+        return pd.concat(list(shared.values()), keys=list(shared.keys()), axis=1)
+
+    provider = LiveProvider()
+    results = {}
+    def fetch(tickers):
+        with app.app_context():
+            results[tickers[0]] = provider.us_ohlcv_batch(tickers, '2024-01-01')
+
+    with patch('app.services.providers.yf.download', side_effect=download):
+        threads = [threading.Thread(target=fetch, args=(batch,))
+                   for batch in (['A1', 'A2', 'A3'], ['B1', 'B2', 'B3'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert sorted(set(results['A1'].columns.get_level_values(0))) == ['A1', 'A2', 'A3']
+    assert sorted(set(results['B1'].columns.get_level_values(0))) == ['B1', 'B2', 'B3']
+
+def test_incomplete_provider_cannot_be_instantiated():
+    """A provider missing a method fails up front, not halfway through a run"""
+    from app.services.providers import MarketDataProvider
+
+    class USOnly(MarketDataProvider):
+        def us_tickers(self):
+            return None
+
+    with pytest.raises(TypeError):
+        USOnly()
@@ -7,7 +7,14 @@ from app.models.financials import Financials
 from app.services.scoring_service import ScoringService
 from app.models.price import StockPrice
 from app.models.score import StockScore
+from app.models.dirty_ticker import DirtyTicker
+from app.models.indicator_state import IndicatorState
+from app.services.indicator_service import IndicatorService
+from app.services.financial_snapshot import FinancialSnapshotService
+from app.models.latest_financials import LatestFinancials
 from datetime import timedelta
+import numpy as np
+import pandas as pd
 
 @pytest.fixture
 def app():
@@ -253,21 +260,491 @@ def test_calculate_score_aggregation(app):
         score = ScoringService.calculate_score(stock.id, date(2024, 1, 3))
         assert score.total_score == 90
 
-def test_run_daily_scoring(app):
-    """Test run_daily_scoring iterates over stocks"""
-    s1 = Stock(ticker="S1", name="Stock1", sector="Tech")
-    s2 = Stock(ticker="S2", name="Stock2", sector="Tech")
-    db.session.add_all([s1, s2])
+def _seed_sectors():
+    """Two sectors plus an unclassified stock with mixed/missing data"""
+    rng = np.random.default_rng(7)
+    stocks = [Stock(ticker=f"T{i}", name=f"Tech{i}", sector="Tech") for i in range(6)]
+    stocks += [Stock(ticker=f"E{i}", name=f"Energy{i}", sector="Energy") for i in range(2)]
+    stocks.append(Stock(ticker="NOSEC", name="No Sector"))
+    db.session.add_all(stocks)
     db.session.commit()
-    
-    # Mock calculate_score to avoid complex setup
+
+    pes = [20.0, -5.0, 15.0, None, 30.0, 15.0, 8.0, 12.0, 10.0]
+    pbs = [3.0, 1.0, None, 2.0, 4.5, 3.0, 1.2, 0.9, 1.0]
+    roes = [0.15, -0.02, 0.30, 0.10, None, 0.15, 0.08, 0.12, 0.2]
+    # Growth: T0 and T5 tie at 10% (Decimal exact), T2 has zero previous EPS
+    prev_eps = [1.10, 2.00, 0.00, 1.50, 3.00, 2.20, 1.00, 1.00, 1.00]
+    curr_eps = [1.21, 1.50, 0.50, 1.80, 2.70, 2.42, 1.20, 0.90, 1.10]
+    for i, stock in enumerate(stocks):
+        if i == 3:
+            # Only one year of history -> no growth
+            db.session.add(Financials(ticker_id=stock.id, fiscal_date=date(2023, 12, 31),
+                                      pe_ratio=pes[i], pb_ratio=pbs[i], roe=roes[i], revenue=100, eps=1.0))
+            continue
+        db.session.add(Financials(ticker_id=stock.id, fiscal_date=date(2022, 12, 31), period='Annual',
+                                  pe_ratio=10.0, revenue=1000 + i, eps=prev_eps[i]))
+        db.session.add(Financials(ticker_id=stock.id, fiscal_date=date(2023, 12, 31), period='Annual',
+                                  pe_ratio=pes[i], pb_ratio=pbs[i], roe=roes[i],
+                                  revenue=int(1000 * (1.1 + 0.05 * i)), eps=curr_eps[i]))
+
+    base = datetime(2024, 1, 1)
+    for i, stock in enumerate(stocks):
+        n_days = {4: 10, 5: 0}.get(i, 250)
+        closes = 100 * np.cumprod(1 + rng.normal(0, 0.02, n_days))
+        for d, close in enumerate(closes):
+            db.session.add(StockPrice(ticker_id=stock.id, timestamp=base - timedelta(days=n_days - 1 - d),
+                                      close=round(float(close), 2)))
+    db.session.commit()
+    return stocks
+
+def test_sector_scores_match_per_ticker(app):
+    """Batch sector scoring must reproduce the per-ticker calculate_* functions"""
+    stocks = _seed_sectors()
+    day = date(2024, 1, 1)
+
+    for sector in ["Tech", "Energy", None]:
+        batch = ScoringService.compute_sector_scores(sector, day)
+        members = [s for s in stocks if s.sector == sector]
+        assert sorted(batch.index) == sorted(s.id for s in members)
+
+        for stock in members:
+            row = batch.loc[stock.id]
+            assert row['valuation_score'] == ScoringService.calculate_valuation_score(stock.id, day)
+            assert row['profitability_score'] == ScoringService.calculate_profitability_score(stock.id, day)
+            assert row['growth_score'] == ScoringService.calculate_growth_score(stock.id, day)
+            assert row['momentum_score'] == ScoringService.calculate_momentum_score(
+                stock.id, datetime(2024, 1, 1, 23, 59, 59))
+
+            expected = ScoringService.calculate_score(stock.id, day)
+            assert row['total_score'] == expected.total_score
+            assert row['grade'] == expected.grade
+
+def test_run_daily_scoring(app):
+    """Test run_daily_scoring scores every stock sector by sector"""
+    stocks = _seed_sectors()
+
     with patch('app.services.scoring_service.ScoringService.calculate_score') as mock_calc:
         ScoringService.run_daily_scoring(date(2024, 1, 1))
-        
-        # Should be called twice
-        assert mock_calc.call_count == 2
-        mock_calc.assert_any_call(s1.id, date(2024, 1, 1))
-        mock_calc.assert_any_call(s2.id, date(2024, 1, 1))
+        # The batch path never falls back to per-ticker scoring
+        assert mock_calc.call_count == 0
+
+    saved = StockScore.query.filter_by(date=date(2024, 1, 1)).all()
+    assert sorted(s.ticker_id for s in saved) == sorted(s.id for s in stocks)
+
+    by_ticker = {s.ticker_id: s for s in saved}
+    assert by_ticker[stocks[-1].id].total_score is None
+    assert by_ticker[stocks[0].id].total_score is not None
+
+    # Re-running updates the same rows instead of inserting duplicates
+    ScoringService.run_daily_scoring(date(2024, 1, 1))
+    assert StockScore.query.filter_by(date=date(2024, 1, 1)).count() == len(stocks)
+
+def test_price_matrix_loader(app):
+    """One query loads a right-aligned tickers x bars matrix for momentum"""
+    s1 = Stock(ticker="P1", name="Price1", sector="Tech")
+    s2 = Stock(ticker="P2", name="Price2", sector="Tech")
+    s3 = Stock(ticker="P3", name="Price3", sector="Tech")
+    db.session.add_all([s1, s2, s3])
+    db.session.commit()
+
+    base = datetime(2024, 1, 1)
+    # P1: 20 rising bars with one drop, P2: 3 bars, P3: no prices
+    closes = [100 + i for i in range(20)]
+    closes[10] = 95
+    for i, close in enumerate(closes):
+        db.session.add(StockPrice(ticker_id=s1.id, timestamp=base - timedelta(days=19 - i), close=close))
+    for i, close in enumerate([10, 11, 12]):
+        db.session.add(StockPrice(ticker_id=s2.id, timestamp=base - timedelta(days=2 - i), close=close))
+    # Bars after the reference date are ignored
+    db.session.add(StockPrice(ticker_id=s2.id, timestamp=base + timedelta(days=1), close=99))
+    db.session.commit()
+
+    ids, dates, matrix = ScoringService.load_price_matrix([s1.id, s2.id, s3.id], base, window=16)
+    assert matrix.shape == (3, 16)
+    assert list(ids) == [s1.id, s2.id, s3.id]
+    assert matrix[0].tolist() == [float(c) for c in closes[-16:]]
+    assert np.isnan(matrix[1, :13]).all() and matrix[1, 13:].tolist() == [10.0, 11.0, 12.0]
+    assert np.isnan(matrix[2]).all()
+
+    rsi, six_mo_return = ScoringService.compute_momentum_metrics(dates, matrix)
+    # Last 14 moves of P1: +1 x 12, -14 into the drop, +16 out of it -> RS = 2
+    assert rsi[0] == pytest.approx(100 - 100 / 3)
+    assert np.isnan(rsi[1]) and np.isnan(rsi[2])
+    assert np.isnan(six_mo_return).all()
+
+def test_growth_query_pairs_latest_two_records(app):
+    """ROW_NUMBER() pairs each ticker's two most recent financials"""
+    _seed_sectors()
+
+    tech_ids = ScoringService._sector_ticker_ids("Tech")
+    growth = ScoringService._load_growth(tech_ids, date(2024, 1, 1))
+
+    # Five Tech stocks have two years of financials; T2 has no EPS growth (zero base)
+    assert len(growth) == 5
+    assert growth['eps_growth'].isna().sum() == 1
+
+def test_percentile_scores_match_list_scan(app):
+    """Sorted-array ranking keeps the list-scan rules, including ties and non-positive values"""
+    def list_scan(target, peers, lower_is_better):
+        if lower_is_better:
+            if target <= 0:
+                return 0
+            positive = [p for p in peers if p > 0]
+            if not positive:
+                return 0
+            return int(sum(1 for p in positive if p > target) / len(positive) * 100)
+        return int(sum(1 for p in peers if p < target) / len(peers) * 100)
+
+    rng = np.random.default_rng(3)
+    values = np.round(rng.normal(10, 8, 300), 1)
+    values[::17] = np.nan
+
+    peers = [v for v in values if not np.isnan(v)]
+    for lower_is_better in (True, False):
+        scores = ScoringService.percentile_scores(values, lower_is_better=lower_is_better)
+        for value, score in zip(values, scores):
+            if np.isnan(value):
+                assert np.isnan(score)
+            else:
+                assert score == list_scan(value, peers, lower_is_better)
+
+    # Only non-positive peers: every P/E scores 0
+    assert ScoringService.percentile_scores([-1.0, 0.0], lower_is_better=True).tolist() == [0, 0]
+    assert ScoringService._calculate_relative_score(None, [1.0]) is None
+    assert ScoringService._calculate_relative_score(5.0, []) is None
+
+def test_save_scores_bulk_upsert_isolates_failures(app):
+    """Scores are upserted in chunks; a failing row is reported without losing the chunk"""
+    stocks = _seed_sectors()
+    day = date(2024, 1, 1)
+
+    # An existing total is kept when the new row has nothing to score (like calculate_score)
+    nosec = stocks[-1]
+    db.session.add(StockScore(ticker_id=nosec.id, date=day, total_score=70, grade='Buy'))
+    db.session.commit()
+
+    scores = ScoringService.compute_sector_scores("Tech", day)
+    bad_id = int(scores.index[2])
+    upsert = ScoringService._upsert_scores
+
+    def failing_upsert(records):
+        if any(r['ticker_id'] == bad_id for r in records):
+            raise ValueError("boom")
+        upsert(records)
+
+    with patch('app.services.scoring_service.ScoringService._upsert_scores', side_effect=failing_upsert):
+        saved, failed = ScoringService.save_scores(scores, day, chunk_size=4)
+
+    assert failed == [bad_id]
+    assert saved == len(scores) - 1
+    assert StockScore.query.filter_by(date=day, ticker_id=bad_id).first() is None
+    assert StockScore.query.filter_by(date=day).count() == len(scores)  # 5 Tech + existing NOSEC row
+
+    result = ScoringService.run_daily_scoring(day)
+    assert result == {'scored': len(stocks), 'copied': 0, 'failed': []}
+    kept = StockScore.query.filter_by(date=day, ticker_id=nosec.id).one()
+    db.session.refresh(kept)
+    assert kept.total_score == 70 and kept.grade == 'Buy'
+    assert kept.valuation_score is None
+
+def test_sharded_scoring_matches_serial_run(app):
+    """Sector shards loaded separately (as Celery subtasks) rank the same as a serial run"""
+    import json
+    from app.tasks.collector import load_scoring_shard, finalize_stock_scores
+
+    stocks = _seed_sectors()
+    day = date(2024, 1, 1)
+
+    shards = ScoringService.plan_scoring_shards(shard_size=4)
+    # Tech (6) is split in two, Energy and the unclassified stock get one shard each
+    assert len(shards) == 4
+    assert sorted(tid for _, ids in shards for tid in ids) == sorted(s.id for s in stocks)
+
+    # Round-trip through JSON like the Celery result backend
+    results = [json.loads(json.dumps(load_scoring_shard.run(sector, ids, day.isoformat())))
+               for sector, ids in shards]
+    summary = finalize_stock_scores.run(results, day.isoformat())
+    assert summary == {'scored': len(stocks), 'failed': [], 'sectors': 3}
+    sharded = {s.ticker_id: (s.total_score, s.grade, s.momentum_score)
+               for s in StockScore.query.filter_by(date=day)}
+
+    StockScore.query.delete()
+    db.session.commit()
+    ScoringService.run_daily_scoring(day)
+    serial = {s.ticker_id: (s.total_score, s.grade, s.momentum_score)
+              for s in StockScore.query.filter_by(date=day)}
+    assert sharded == serial
+
+    # A failed shard leaves its whole sector unscored and reported
+    i = next(i for i, r in enumerate(results) if r['sector'] == "Tech")
+    results[i] = {'sector': "Tech", 'ticker_ids': results[i]['ticker_ids'], 'error': 'boom'}
+    summary = ScoringService.score_shard_results(results, date(2024, 1, 2))
+    assert summary['failed'] == sorted(s.ticker for s in stocks if s.sector == "Tech")
+    assert summary['scored'] == 3
+
+def test_run_scoring_range_matches_daily_runs(app):
+    """A range backfill reproduces run_daily_scoring on every date"""
+    stocks = _seed_sectors()
+
+    # New data arriving inside the range: more bars and a fresh TTM snapshot
+    rng = np.random.default_rng(11)
+    for stock in stocks[:4] + stocks[6:7]:
+        for d in range(1, 9):
+            db.session.add(StockPrice(ticker_id=stock.id, timestamp=datetime(2024, 1, 1 + d),
+                                      close=round(float(rng.uniform(80, 120)), 2)))
+    db.session.add(Financials(ticker_id=stocks[1].id, fiscal_date=date(2024, 1, 4), period='TTM',
+                              pe_ratio=9.0, pb_ratio=0.8, roe=0.2, revenue=1500, eps=2.5))
+    db.session.add(Financials(ticker_id=stocks[1].id, fiscal_date=date(2024, 1, 4), period='Daily',
+                              pe_ratio=11.0))
+    db.session.commit()
+
+    result = ScoringService.run_scoring_range(date(2023, 12, 28), date(2024, 1, 8))
+    # 28, 29 Dec and 1-5, 8 Jan
+    assert result == {'dates': 8, 'scored': 8 * len(stocks), 'failed': []}
+
+    backfilled = {(s.ticker_id, s.date): (s.valuation_score, s.profitability_score, s.growth_score,
+                                          s.momentum_score, s.total_score, s.grade)
+                  for s in StockScore.query.all()}
+
+    for day in sorted({d for _, d in backfilled}):
+        for sector in ["Tech", "Energy", None]:
+            expected = ScoringService.compute_sector_scores(sector, day)
+            for ticker_id, row in expected.iterrows():
+                assert backfilled[(ticker_id, day)] == tuple(row[ScoringService.COMPONENTS + ['total_score', 'grade']])
 
+def test_incremental_daily_scoring_rescores_dirty_sectors(app):
+    """Only sectors with new data are rescored; the rest are copied forward"""
+    stocks = _seed_sectors()
+    ScoringService.run_daily_scoring(date(2024, 1, 1), full=True)
 
+    # Energy gets a new bar; the Tech and unclassified scores carry over
+    energy = next(s for s in stocks if s.sector == "Energy")
+    db.session.add(StockPrice(ticker_id=energy.id, timestamp=datetime(2024, 1, 2), close=150.0))
+    ScoringService.mark_dirty([energy.id])
+    db.session.commit()
+
+    day = date(2024, 1, 2)
+    members, prev_date, to_copy = ScoringService.plan_daily_scoring(day)
+    assert list(members) == ["Energy"] and prev_date == date(2024, 1, 1)
+
+    result = ScoringService.run_daily_scoring(day)
+    energy_count = sum(1 for s in stocks if s.sector == "Energy")
+    assert result == {'scored': energy_count, 'copied': len(stocks) - energy_count, 'failed': []}
+    assert DirtyTicker.query.count() == 0
+
+    # Same scores as a full rescore of the day
+    incremental = {s.ticker_id: (s.total_score, s.grade, s.momentum_score)
+                   for s in StockScore.query.filter_by(date=day)}
+    result = ScoringService.run_daily_scoring(day, full=True)
+    assert result['scored'] == len(stocks) and result['copied'] == 0
+    full = {s.ticker_id: (s.total_score, s.grade, s.momentum_score)
+            for s in StockScore.query.filter_by(date=day)}
+    assert incremental == full
+
+def test_daily_scoring_rerun_keeps_rescored_sectors(app):
+    """Rerunning a scored day does not copy the previous day's scores over fresh ones"""
+    stocks = _seed_sectors()
+    ScoringService.run_daily_scoring(date(2024, 1, 1), full=True)
+
+    energy = next(s for s in stocks if s.sector == "Energy")
+    db.session.add(StockPrice(ticker_id=energy.id, timestamp=datetime(2024, 1, 2), close=150.0))
+    ScoringService.mark_dirty([energy.id])
+    db.session.commit()
+
+    day = date(2024, 1, 2)
+    ScoringService.run_daily_scoring(day)
+    first = {s.ticker_id: (s.total_score, s.grade, s.momentum_score)
+             for s in StockScore.query.filter_by(date=day)}
+
+    # e.g. a Celery retry: nothing is dirty any more and every stock has a score
+    members, prev_date, to_copy = ScoringService.plan_daily_scoring(day)
+    assert members == {} and to_copy == []
+    result = ScoringService.run_daily_scoring(day)
+    assert result == {'scored': 0, 'copied': 0, 'failed': []}
+    rerun = {s.ticker_id: (s.total_score, s.grade, s.momentum_score)
+             for s in StockScore.query.filter_by(date=day)}
+    assert rerun == first
+
+def test_sector_change_marks_both_sectors(app):
+    """A stock moving sector dirties itself and its old sector, so neither is copied forward"""
+    from app.services.market_data import upsert_stocks
+
+    stocks = _seed_sectors()
+    DirtyTicker.query.delete()
+    db.session.commit()
+
+    mover = next(s for s in reversed(stocks) if s.sector == "Energy")
+    old_sector = mover.sector
+    record = {'ticker': mover.ticker, 'name': mover.name, 'market': mover.market, 'sector': "Moved",
+              'industry': mover.industry, 'updated_at': datetime.utcnow()}
+    assert upsert_stocks([record]) == {'inserted': 0, 'updated': 1, 'unchanged': 0}
+    db.session.commit()
+
+    dirty_sectors = {db.session.get(Stock, d.ticker_id).sector for d in DirtyTicker.query}
+    assert dirty_sectors == {"Moved", old_sector}
+
+    # Unchanged stock list: nothing marked
+    DirtyTicker.query.delete()
+    upsert_stocks([record])
+    db.session.commit()
+    assert DirtyTicker.query.count() == 0
+
+def test_incremental_wilder_rsi_state(app):
+    """Bars folded in one at a time give the same RSI as smoothing the whole history"""
+    stock = Stock(ticker="W1", name="Wilder", sector="Tech")
+    db.session.add(stock)
+    db.session.commit()
+
+    rng = np.random.default_rng(3)
+    closes = [round(float(c), 2) for c in 100 * np.cumprod(1 + rng.normal(0, 0.02, 60))]
+    bars = [(datetime(2024, 1, 1) + timedelta(days=d), c) for d, c in enumerate(closes)]
+
+    def ingest(batch):
+        for ts, close in batch:
+            db.session.merge(StockPrice(ticker_id=stock.id, timestamp=ts, close=close))
+        db.session.flush()
+        IndicatorService.apply_bars(stock.id, batch)
+        db.session.commit()
+
+    # Not enough changes for an RSI yet
+    ingest(bars[:10])
+    assert IndicatorService.state_rsi(db.session.get(IndicatorState, stock.id)) is None
+
+    for bar in bars[10:40]:
+        ingest([bar])
+    ingest(bars[40:])
+    state = db.session.get(IndicatorState, stock.id)
+    assert state.bars == 59 and state.last_timestamp == bars[-1][0]
+
+    expected = IndicatorService.wilder_rsi(np.array([closes]))[0]
+    assert IndicatorService.state_rsi(state) == expected
+
+    # First 14 changes are a simple mean, then Wilder smoothing
+    deltas = np.diff(closes)
+    gain = np.where(deltas > 0, deltas, 0)[:14].mean()
+    loss = np.where(deltas < 0, -deltas, 0)[:14].mean()
+    for d in deltas[14:]:
+        gain = (gain * 13 + max(d, 0)) / 14
+        loss = (loss * 13 + max(-d, 0)) / 14
+    assert IndicatorService.state_rsi(state) == pytest.approx(100 - 100 / (1 + gain / loss))
+
+    # A correction of an older bar rebuilds the state from history
+    corrected = (bars[30][0], closes[30] + 5)
+    ingest([corrected])
+    closes[30] += 5
+    assert IndicatorService.state_rsi(db.session.get(IndicatorState, stock.id)) == \
+        pytest.approx(IndicatorService.wilder_rsi(np.array([closes]))[0])
+
+def test_wilder_rsi_method_scoring(app):
+    """With RSI_METHOD 'wilder', scoring reads RSI from the stored state"""
+    stocks = _seed_sectors()
+    day = date(2024, 1, 1)
+    sma = ScoringService._load_momentum([s.id for s in stocks], ScoringService._end_of_day(day))
+
+    app.config['RSI_METHOD'] = 'wilder'
+    IndicatorService.rebuild_states([s.id for s in stocks])
+    momentum = ScoringService._load_momentum([s.id for s in stocks], ScoringService._end_of_day(day))
+
+    rsi = ScoringService._peer_rsi(momentum)
+    for stock in stocks:
+        state_rsi = IndicatorService.state_rsi(db.session.get(IndicatorState, stock.id))
+        if state_rsi is None:
+            assert stock.id not in momentum.index or pd.isna(rsi.at[stock.id])
+        else:
+            assert rsi.at[stock.id] == state_rsi
+    assert momentum['return'].equals(sma['return'])
+    assert not rsi.equals(sma['rsi'])
+
+    # The state is ahead of earlier dates, which smooth over the window instead
+    earlier = ScoringService._end_of_day(date(2023, 12, 1))
+    _, dates, closes = ScoringService.load_price_matrix([stocks[0].id], earlier)
+    past = ScoringService._load_momentum([stocks[0].id], earlier)
+    assert ScoringService._peer_rsi(past).at[stocks[0].id] == IndicatorService.wilder_rsi(closes)[0]
+
+    # A peer without a state puts the whole sector on window RSI, never a mix
+    tech = [s.id for s in stocks if s.sector == "Tech"]
+    db.session.delete(db.session.get(IndicatorState, tech[0]))
+    db.session.commit()
+    mixed = ScoringService._load_momentum(tech, ScoringService._end_of_day(day))
+    ids, _, closes = ScoringService.load_price_matrix(tech, ScoringService._end_of_day(day))
+    window = pd.Series(IndicatorService.wilder_rsi(closes), index=ids)
+    assert ScoringService._peer_rsi(mixed).equals(window.loc[mixed.index].rename('rsi'))
+
+    # Batch and per-ticker paths still agree
+    batch = ScoringService.compute_sector_scores("Tech", day)
+    for stock in stocks[:6]:
+        assert batch.loc[stock.id, 'momentum_score'] == ScoringService.calculate_momentum_score(
+            stock.id, ScoringService._end_of_day(day))
+
+def test_price_writes_advance_existing_states_only(app):
+    """Price writes touch RSI states only with RSI_METHOD 'wilder', and never seed them inline"""
+    from app.services.market_data import write_prices
+    from app.tasks.collector import rebuild_indicator_states
+
+    stocks = [Stock(ticker=f"R{i}", name=f"R{i}", sector="Tech") for i in range(2)]
+    db.session.add_all(stocks)
+    db.session.commit()
+
+    def bars(stock, start, days):
+        return [(datetime(2024, 1, 1) + timedelta(days=start + d), stock.id, 1.0, 2.0, 0.5, 100.0 + d % 3, 10)
+                for d in range(days)]
+
+    write_prices(bars(stocks[0], 0, 20) + bars(stocks[1], 0, 20))
+    db.session.commit()
+    assert IndicatorState.query.count() == 0
+
+    app.config['RSI_METHOD'] = 'wilder'
+    write_prices(bars(stocks[0], 20, 5))
+    db.session.commit()
+    assert IndicatorState.query.count() == 0
+    assert IndicatorService.missing_states() == [stocks[0].id, stocks[1].id]
+
+    # The nightly seeding rebuilds the missing ones; later writes advance them
+    rebuild_indicator_states.run(missing_only=True)
+    assert IndicatorService.missing_states() == []
+    write_prices(bars(stocks[0], 25, 2))
+    db.session.commit()
+    state = db.session.get(IndicatorState, stocks[0].id)
+    assert state.bars == 26 and state.last_timestamp == datetime(2024, 1, 27)
+
+    # A correction of an older bar drops the state instead of replaying the history inline
+    with patch.object(IndicatorService, 'rebuild_state') as rebuild:
+        write_prices([(datetime(2024, 1, 10), stocks[0].id, 1.0, 2.0, 0.5, 120.0, 10)])
+        db.session.commit()
+    assert rebuild.call_count == 0
+    assert IndicatorService.missing_states() == [stocks[0].id]
+    rebuild_indicator_states.run(missing_only=True)
+    assert db.session.get(IndicatorState, stocks[0].id).last_timestamp == datetime(2024, 1, 27)
+
+def test_latest_financials_snapshot(app, client):
+    """Scoring and the stock detail endpoint read the latest financials snapshot"""
+    stocks = _seed_sectors()
+    day = date(2024, 1, 1)
+    from_history = {sector: ScoringService.compute_sector_scores(sector, day) for sector in ["Tech", "Energy"]}
+
+    FinancialSnapshotService.refresh()
+    db.session.commit()
+    # One row per ticker with financials, all on its latest fiscal date
+    assert LatestFinancials.query.count() == len(stocks)
+    assert {r.fiscal_date for r in LatestFinancials.query} == {date(2023, 12, 31)}
+
+    with patch('app.services.scoring_service.ScoringService._query_latest_financials') as fallback:
+        for sector, expected in from_history.items():
+            assert ScoringService.compute_sector_scores(sector, day).equals(expected)
+        assert ScoringService.calculate_valuation_score(stocks[0].id, day) == \
+            from_history["Tech"].at[stocks[0].id, 'valuation_score']
+        assert fallback.call_count == 0
+
+    # A newer filing refreshes only its ticker; earlier dates fall back to the history
+    db.session.add(Financials(ticker_id=stocks[0].id, fiscal_date=date(2024, 3, 31), period='Quarterly',
+                              pe_ratio=50.0, pb_ratio=9.0, roe=0.01))
+    FinancialSnapshotService.refresh([stocks[0].id])
+    db.session.commit()
+    assert LatestFinancials.query.filter_by(ticker_id=stocks[0].id).one().fiscal_date == date(2024, 3, 31)
+    assert ScoringService.compute_sector_scores("Tech", day).equals(from_history["Tech"])
+    assert ScoringService.calculate_valuation_score(stocks[0].id, date(2024, 4, 1)) == 0
 
+    response = client.get(f'/api/stocks/{stocks[0].ticker}')
+    assert response.status_code == 200
+    latest = response.get_json()['latest_financials']
+    assert latest['fiscal_date'] == '2024-03-31' and latest['pe_ratio'] == 50.0